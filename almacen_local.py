@@ -0,0 +1,600 @@
+# Almacén de datos del ERP: interfaz común y una implementación local en SQLite.
+# erp.py habla con la BD solo a través de table(...).select/eq/.../execute() y rpc(...).execute();
+# AlmacenSQLite cumple ese mismo contrato con el esquema de supabase/migrations y datos de ejemplo,
+# para correr la app, pruebas o mediciones de carga sin Supabase. Las funciones rpc están
+# portadas a Python con la misma lógica que sus versiones plpgsql.
+
+import json
+import sqlite3
+import sys
+import threading
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timezone
+
+from dominio import TRANSICIONES_PEDIDO, UNIDADES_MEDIDA, factor_unidad
+
+class Almacen(ABC):
+    # Interfaz mínima que debe cumplir cualquier backend (Supabase, SQLite...).
+    def __init__(self):
+        # Idas y vueltas a la BD: permite comparar backends y detectar consultas de más
+        self.viajes = 0
+
+    @abstractmethod
+    def table(self, nombre): ...
+    @abstractmethod
+    def rpc(self, funcion, params=None): ...
+
+    @property
+    def en_linea(self):
+        return True
+
+    # Cola de escrituras sin conexión: solo la tiene el cliente remoto
+    def pendientes(self): return 0
+    def problemas(self): return []
+
+class Respuesta:
+    # Misma forma que la respuesta de postgrest
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+# Marca de tiempo con el mismo formato ISO que devuelve postgrest
+AHORA = "(strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))"
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS usuarios (id INTEGER PRIMARY KEY, nombre TEXT, username TEXT, password TEXT, rol TEXT);
+CREATE TABLE IF NOT EXISTS insumos (
+  id INTEGER PRIMARY KEY, nombre TEXT UNIQUE, unidad_medida TEXT, stock_actual REAL DEFAULT 0, costo_unitario REAL DEFAULT 0);
+CREATE TABLE IF NOT EXISTS productos (id INTEGER PRIMARY KEY, nombre TEXT, categoria TEXT, imagen_url TEXT);
+CREATE TABLE IF NOT EXISTS variaciones (
+  id INTEGER PRIMARY KEY, producto_id INTEGER REFERENCES productos(id) ON DELETE CASCADE, nombre TEXT, precio REAL,
+  ingredientes_json TEXT, rendimiento REAL DEFAULT 1, parametros_json TEXT,
+  tiempo_prep_min INTEGER NOT NULL DEFAULT 30, tiempo_horno_min INTEGER NOT NULL DEFAULT 45);
+CREATE TABLE IF NOT EXISTS recetas (id INTEGER PRIMARY KEY, nombre TEXT, ingredientes_json TEXT);
+CREATE TABLE IF NOT EXISTS pedidos (
+  id INTEGER PRIMARY KEY, cliente_nombre TEXT, cliente_contacto TEXT, fecha_entrega TEXT, hora_entrega TEXT, variacion_id INTEGER,
+  nombre_producto_snapshot TEXT, cantidad INTEGER, precio_unitario_final REAL, total_pedido REAL, estado TEXT, notas TEXT,
+  detalle_json TEXT, created_at TEXT DEFAULT AHORA, actualizado_en TEXT NOT NULL DEFAULT AHORA, cambio_xid INTEGER);
+CREATE INDEX IF NOT EXISTS idx_pedidos_actualizado_en ON pedidos (actualizado_en);
+CREATE INDEX IF NOT EXISTS idx_pedidos_cambio_xid ON pedidos (cambio_xid);
+CREATE TABLE IF NOT EXISTS gastos (id INTEGER PRIMARY KEY, fecha TEXT, monto REAL, descripcion TEXT, tipo TEXT);
+
+CREATE TABLE IF NOT EXISTS unidades_medida (unidad TEXT PRIMARY KEY, dimension TEXT NOT NULL, factor REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS receta_ingredientes (
+  id INTEGER PRIMARY KEY, variacion_id INTEGER NOT NULL REFERENCES variaciones(id) ON DELETE CASCADE, posicion INTEGER NOT NULL DEFAULT 0,
+  insumo_id INTEGER REFERENCES insumos(id) ON DELETE SET NULL, nombre TEXT NOT NULL, cantidad REAL NOT NULL, unidad TEXT,
+  costo REAL NOT NULL DEFAULT 0);
+CREATE INDEX IF NOT EXISTS idx_receta_ingredientes_variacion ON receta_ingredientes (variacion_id, posicion);
+CREATE TABLE IF NOT EXISTS pedido_items (
+  id INTEGER PRIMARY KEY, pedido_id INTEGER NOT NULL REFERENCES pedidos(id) ON DELETE CASCADE,
+  variacion_id INTEGER REFERENCES variaciones(id) ON DELETE SET NULL, producto TEXT NOT NULL, cantidad REAL NOT NULL, precio_unitario REAL);
+CREATE INDEX IF NOT EXISTS idx_pedido_items_pedido ON pedido_items (pedido_id);
+
+CREATE TABLE IF NOT EXISTS movimientos_inventario (
+  id INTEGER PRIMARY KEY, fecha TEXT NOT NULL DEFAULT AHORA, insumo_id INTEGER NOT NULL REFERENCES insumos(id) ON DELETE RESTRICT,
+  tipo TEXT NOT NULL DEFAULT 'ajuste' CHECK (tipo IN ('entrega', 'devolucion', 'compra', 'ajuste')),
+  cantidad REAL NOT NULL, referencia_tipo TEXT, referencia_id INTEGER, usuario TEXT, costo REAL);
+CREATE INDEX IF NOT EXISTS idx_mov_inv_insumo ON movimientos_inventario (insumo_id, id);
+CREATE TABLE IF NOT EXISTS snapshots_inventario (
+  id INTEGER PRIMARY KEY, fecha TEXT NOT NULL DEFAULT AHORA, insumo_id INTEGER NOT NULL REFERENCES insumos(id) ON DELETE RESTRICT,
+  stock REAL NOT NULL, ultimo_movimiento_id INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS costos_insumo (
+  insumo_id INTEGER PRIMARY KEY REFERENCES insumos(id) ON DELETE CASCADE,
+  metodo TEXT NOT NULL DEFAULT 'promedio' CHECK (metodo IN ('promedio', 'fifo')),
+  cantidad REAL NOT NULL DEFAULT 0, valor REAL NOT NULL DEFAULT 0, costo_promedio REAL NOT NULL DEFAULT 0,
+  actualizado_en TEXT NOT NULL DEFAULT AHORA);
+CREATE TABLE IF NOT EXISTS capas_costo_insumo (
+  id INTEGER PRIMARY KEY, insumo_id INTEGER NOT NULL REFERENCES insumos(id) ON DELETE CASCADE,
+  cantidad REAL NOT NULL, costo_unitario REAL NOT NULL, fecha TEXT NOT NULL DEFAULT AHORA);
+
+CREATE TABLE IF NOT EXISTS versiones_datos (clave TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0);
+INSERT OR IGNORE INTO versiones_datos (clave) VALUES ('finanzas'), ('catalogo'), ('pedidos');
+CREATE TABLE IF NOT EXISTS libro_financiero (
+  id INTEGER PRIMARY KEY, fecha TEXT NOT NULL DEFAULT (date('now')),
+  tipo TEXT NOT NULL CHECK (tipo IN ('venta', 'compra_insumo', 'ajuste')), monto REAL NOT NULL, descripcion TEXT,
+  pedido_id INTEGER REFERENCES pedidos(id) ON DELETE SET NULL, insumo_id INTEGER REFERENCES insumos(id) ON DELETE SET NULL,
+  usuario TEXT, creado_en TEXT NOT NULL DEFAULT AHORA);
+CREATE INDEX IF NOT EXISTS idx_libro_financiero_fecha_tipo ON libro_financiero (fecha, tipo);
+CREATE TABLE IF NOT EXISTS totales_financieros (
+  mes TEXT NOT NULL, tipo TEXT NOT NULL, monto REAL NOT NULL DEFAULT 0, movimientos INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (mes, tipo));
+
+-- Marcas de cambio (en SQLite los triggers son por fila: la versión sube una vez por fila, no por sentencia)
+-- cambio_xid: en SQLite las escrituras son en serie, un contador alcanza como marca en orden de commit
+CREATE TRIGGER IF NOT EXISTS trg_pedidos_cambio AFTER INSERT ON pedidos BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE clave = 'pedidos';
+  UPDATE pedidos SET cambio_xid = (SELECT version FROM versiones_datos WHERE clave = 'pedidos') WHERE id = new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_pedidos_actualizado AFTER UPDATE ON pedidos WHEN new.actualizado_en IS old.actualizado_en BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE clave = 'pedidos';
+  UPDATE pedidos SET actualizado_en = AHORA, cambio_xid = (SELECT version FROM versiones_datos WHERE clave = 'pedidos') WHERE id = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_libro_financiero_ins AFTER INSERT ON libro_financiero BEGIN
+  INSERT INTO totales_financieros (mes, tipo, monto, movimientos) VALUES (strftime('%Y-%m-01', new.fecha), new.tipo, new.monto, 1)
+    ON CONFLICT (mes, tipo) DO UPDATE SET monto = monto + excluded.monto, movimientos = movimientos + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE clave = 'finanzas';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_libro_financiero_del AFTER DELETE ON libro_financiero BEGIN
+  UPDATE totales_financieros SET monto = monto - old.monto, movimientos = movimientos - 1
+   WHERE mes = strftime('%Y-%m-01', old.fecha) AND tipo = old.tipo;
+  UPDATE versiones_datos SET version = version + 1 WHERE clave = 'finanzas';
+END;
+CREATE TRIGGER IF NOT EXISTS trg_libro_financiero_upd AFTER UPDATE ON libro_financiero BEGIN
+  UPDATE totales_financieros SET monto = monto - old.monto, movimientos = movimientos - 1
+   WHERE mes = strftime('%Y-%m-01', old.fecha) AND tipo = old.tipo;
+  INSERT INTO totales_financieros (mes, tipo, monto, movimientos) VALUES (strftime('%Y-%m-01', new.fecha), new.tipo, new.monto, 1)
+    ON CONFLICT (mes, tipo) DO UPDATE SET monto = monto + excluded.monto, movimientos = movimientos + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE clave = 'finanzas';
+END;
+"""
+
+# Versión del catálogo: sube con cualquier cambio en productos, variaciones o ingredientes
+for _tabla in ('productos', 'variaciones', 'receta_ingredientes'):
+    for _op in ('INSERT', 'UPDATE', 'DELETE'):
+        ESQUEMA += (f"CREATE TRIGGER IF NOT EXISTS trg_{_tabla}_version_{_op.lower()} AFTER {_op} ON {_tabla} "
+                    f"BEGIN UPDATE versiones_datos SET version = version + 1 WHERE clave = 'catalogo'; END;\n")
+
+ESQUEMA += """
+CREATE VIEW IF NOT EXISTS resumen_mensual AS
+  SELECT strftime('%Y-%m', mes) AS mes,
+         CASE tipo WHEN 'venta' THEN 'Venta' WHEN 'compra_insumo' THEN 'Gasto' ELSE 'Ajuste' END AS tipo, monto
+    FROM totales_financieros
+   WHERE movimientos > 0;
+CREATE VIEW IF NOT EXISTS receta_consumo AS
+  SELECT ri.variacion_id, ri.insumo_id,
+         SUM(ri.cantidad * factor_unidad(COALESCE(ri.unidad, i.unidad_medida), i.unidad_medida) / COALESCE(NULLIF(v.rendimiento, 0), 1)) AS cantidad
+    FROM receta_ingredientes ri
+    JOIN insumos i ON i.id = ri.insumo_id
+    JOIN variaciones v ON v.id = ri.variacion_id
+   WHERE factor_unidad(COALESCE(ri.unidad, i.unidad_medida), i.unidad_medida) IS NOT NULL
+   GROUP BY ri.variacion_id, ri.insumo_id;
+CREATE VIEW IF NOT EXISTS consumo_pedidos AS
+  SELECT p.id AS pedido_id, p.estado, p.fecha_entrega, rc.insumo_id, ROUND(SUM(pi.cantidad * rc.cantidad), 6) AS cantidad
+    FROM pedidos p
+    JOIN pedido_items pi ON pi.pedido_id = p.id
+    JOIN receta_consumo rc ON rc.variacion_id = pi.variacion_id
+   GROUP BY p.id, p.estado, p.fecha_entrega, rc.insumo_id;
+CREATE VIEW IF NOT EXISTS costo_recetas AS
+  SELECT rc.variacion_id, ROUND(SUM(rc.cantidad * COALESCE(i.costo_unitario, 0)), 4) AS costo_insumos
+    FROM receta_consumo rc
+    JOIN insumos i ON i.id = rc.insumo_id
+   GROUP BY rc.variacion_id;
+"""
+ESQUEMA = ESQUEMA.replace("AHORA", AHORA)
+
+# Datos de ejemplo: lo mínimo para recorrer todas las pantallas
+SEMILLA = """
+INSERT INTO usuarios (nombre, username, password, rol) VALUES ('Admin', 'admin', 'admin', 'Administrador');
+INSERT INTO insumos (nombre, unidad_medida, stock_actual, costo_unitario) VALUES
+  ('Harina', 'kg', 10, 1200), ('Azúcar', 'kg', 8, 1100), ('Leche', 'lt', 6, 1000),
+  ('Huevos', 'unidades', 60, 180), ('Mantequilla', 'gr', 2000, 12), ('Polvo de hornear', 'gr', 500, 8);
+INSERT INTO productos (nombre, categoria) VALUES ('Torta Bizcocho', 'Tortas'), ('Pan de Pascua', 'Bollería');
+INSERT INTO variaciones (producto_id, nombre, precio, rendimiento) VALUES
+  (1, 'Tradicional - 12 Personas', 25000, 1), (2, 'Clásico - 1 Kilo', 9000, 10);
+INSERT INTO receta_ingredientes (variacion_id, posicion, insumo_id, nombre, cantidad, unidad, costo) VALUES
+  (1, 1, 1, 'Harina', 500, 'gr', 600), (1, 2, 2, 'Azúcar', 400, 'gr', 440), (1, 3, 4, 'Huevos', 6, 'unidades', 1080),
+  (1, 4, 3, 'Leche', 250, 'ml', 250), (1, 5, 6, 'Polvo de hornear', 2, 'cdta', 80),
+  (2, 1, 1, 'Harina', 3, 'kg', 3600), (2, 2, 5, 'Mantequilla', 500, 'gr', 6000), (2, 3, 4, 'Huevos', 12, 'unidades', 2160);
+INSERT INTO pedidos (cliente_nombre, fecha_entrega, hora_entrega, variacion_id, nombre_producto_snapshot, cantidad, precio_unitario_final, total_pedido, estado) VALUES
+  ('Ana', date('now'), '12:00:00', 1, 'Torta Bizcocho - Tradicional - 12 Personas', 2, 25000, 50000, 'Pendiente'),
+  ('Beto', date('now', '+1 day'), '10:00:00', 2, 'Pan de Pascua - Clásico - 1 Kilo', 5, 9000, 45000, 'Listo'),
+  ('Carla', date('now', '-3 days'), '09:00:00', 1, 'Torta Bizcocho - Tradicional - 12 Personas', 1, 25000, 25000, 'Entregado');
+INSERT INTO pedido_items (pedido_id, variacion_id, producto, cantidad, precio_unitario)
+  SELECT id, variacion_id, nombre_producto_snapshot, cantidad, precio_unitario_final FROM pedidos;
+INSERT INTO libro_financiero (fecha, tipo, monto, descripcion, pedido_id, insumo_id) VALUES
+  (date('now', '-10 days'), 'compra_insumo', 20000, 'Compra: Harina', NULL, 1),
+  (date('now', '-3 days'), 'venta', 25000, 'Venta Pedido #3 - Carla', 3, NULL);
+-- Punto de partida del costeo y del libro de inventario: el stock actual al costo de referencia
+INSERT INTO costos_insumo (insumo_id, cantidad, valor, costo_promedio) SELECT id, stock_actual, stock_actual * costo_unitario, costo_unitario FROM insumos;
+INSERT INTO capas_costo_insumo (insumo_id, cantidad, costo_unitario) SELECT id, stock_actual, costo_unitario FROM insumos WHERE stock_actual > 0;
+INSERT INTO snapshots_inventario (insumo_id, stock, ultimo_movimiento_id) SELECT id, stock_actual, 0 FROM insumos;
+"""
+
+def _valor(v):
+    # Lo que postgrest recibiría como JSON, en tipos que SQLite entiende
+    if hasattr(v, 'item'): v = v.item()  # escalares de numpy
+    if isinstance(v, (dict, list)): return json.dumps(v, ensure_ascii=False)
+    if isinstance(v, (date, datetime)): return v.isoformat()
+    return v
+
+def _instante_utc(valor):
+    # timestamptz como texto UTC con el formato de AHORA, para comparar con las columnas guardadas
+    t = datetime.fromisoformat(str(valor))
+    if t.tzinfo: t = t.astimezone(timezone.utc)
+    return t.strftime('%Y-%m-%dT%H:%M:%S.') + f"{t.microsecond // 1000:03d}+00:00"
+
+def _col(nombre):
+    return '"' + str(nombre).strip().replace('"', '') + '"'
+
+class ConsultaSQLite:
+    # Arma la sentencia con la misma cadena que el cliente de Supabase y la ejecuta en execute()
+    OPERADORES = {'eq': '=', 'neq': '<>', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+    def __init__(self, almacen, tabla):
+        self.almacen = almacen
+        self.tabla = tabla
+        self.operacion = 'select'
+        self.columnas = '*'
+        self.datos = None
+        self.conflicto = 'id'
+        self.filtros = []
+        self.parametros = []
+        self.orden = []
+        self.limite = None
+
+    def select(self, columnas='*', count=None):
+        self.operacion, self.columnas = 'select', columnas
+        return self
+
+    def insert(self, datos):
+        self.operacion, self.datos = 'insert', datos
+        return self
+
+    def upsert(self, datos, on_conflict='id', **kwargs):
+        self.operacion, self.datos, self.conflicto = 'upsert', datos, on_conflict or 'id'
+        return self
+
+    def update(self, datos):
+        self.operacion, self.datos = 'update', datos
+        return self
+
+    def delete(self):
+        self.operacion = 'delete'
+        return self
+
+    def _filtro(self, sql, *valores):
+        self.filtros.append(sql)
+        self.parametros.extend(_valor(v) for v in valores)
+        return self
+
+    def eq(self, columna, valor): return self._filtro(f"{_col(columna)} = ?", valor)
+    def neq(self, columna, valor): return self._filtro(f"{_col(columna)} <> ?", valor)
+    def gt(self, columna, valor): return self._filtro(f"{_col(columna)} > ?", valor)
+    def gte(self, columna, valor): return self._filtro(f"{_col(columna)} >= ?", valor)
+    def lt(self, columna, valor): return self._filtro(f"{_col(columna)} < ?", valor)
+    def lte(self, columna, valor): return self._filtro(f"{_col(columna)} <= ?", valor)
+
+    def in_(self, columna, valores):
+        valores = list(valores)
+        if not valores: return self._filtro("0")
+        return self._filtro(f"{_col(columna)} IN ({', '.join('?' * len(valores))})", *valores)
+
+    def is_(self, columna, valor):
+        return self._filtro(f"{_col(columna)} IS NULL" if valor in (None, 'null') else f"{_col(columna)} IS NOT NULL")
+
+    def order(self, columna, desc=False):
+        self.orden.append(f"{_col(columna)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, n):
+        self.limite = int(n)
+        return self
+
+    def execute(self):
+        return self.almacen._ejecutar(self)
+
+    def sentencias(self):
+        """[(sql, parámetros), ...]: una por fila al insertar, una sola en lo demás."""
+        donde = (" WHERE " + " AND ".join(self.filtros)) if self.filtros else ""
+        t = _col(self.tabla)
+        if self.operacion == 'select':
+            cols = '*' if self.columnas.strip() == '*' else ', '.join(_col(c) for c in self.columnas.split(','))
+            sql = f"SELECT {cols} FROM {t}{donde}"
+            if self.orden: sql += " ORDER BY " + ", ".join(self.orden)
+            if self.limite is not None: sql += f" LIMIT {self.limite}"
+            return [(sql, self.parametros)]
+        if self.operacion in ('insert', 'upsert'):
+            filas = self.datos if isinstance(self.datos, list) else [self.datos]
+            res = []
+            for fila in filas:
+                cols = list(fila)
+                sql = f"INSERT INTO {t} ({', '.join(_col(c) for c in cols)}) VALUES ({', '.join('?' * len(cols))})"
+                if self.operacion == 'upsert':
+                    sql += f" ON CONFLICT ({_col(self.conflicto)}) DO UPDATE SET " + ", ".join(
+                        f"{_col(c)} = excluded.{_col(c)}" for c in cols if c != self.conflicto)
+                res.append((sql + " RETURNING *", [_valor(fila[c]) for c in cols]))
+            return res
+        if self.operacion == 'update':
+            cols = list(self.datos)
+            sql = f"UPDATE {t} SET {', '.join(_col(c) + ' = ?' for c in cols)}{donde} RETURNING *"
+            return [(sql, [_valor(self.datos[c]) for c in cols] + self.parametros)]
+        return [(f"DELETE FROM {t}{donde} RETURNING *", self.parametros)]
+
+class LlamadaSQLite:
+    def __init__(self, almacen, funcion, params):
+        self.almacen = almacen
+        self.funcion = funcion
+        self.params = params or {}
+
+    def execute(self):
+        return self.almacen._llamar(self.funcion, self.params)
+
+class AlmacenSQLite(Almacen):
+    # Una sola conexión protegida por un bloqueo: sirve para archivo o ':memory:' y para los hilos de Streamlit
+    def __init__(self, ruta=':memory:', sembrar=True):
+        super().__init__()
+        self.ruta = ruta
+        self._bloqueo = threading.RLock()
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function('factor_unidad', 2, factor_unidad, deterministic=True)
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        if ruta != ':memory:': self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.executescript(ESQUEMA)
+            self.conn.executemany("INSERT OR IGNORE INTO unidades_medida VALUES (?, ?, ?)", [(u, d, f) for u, (d, f) in UNIDADES_MEDIDA.items()])
+        if sembrar and not self.conn.execute("SELECT 1 FROM usuarios LIMIT 1").fetchone():
+            with self.conn:
+                self.conn.executescript(SEMILLA)
+
+    def table(self, nombre): return ConsultaSQLite(self, nombre)
+    def rpc(self, funcion, params=None): return LlamadaSQLite(self, funcion, params)
+
+    def _ejecutar(self, consulta):
+        with self._bloqueo, self.conn:
+            self.viajes += 1
+            data = []
+            for sql, params in consulta.sentencias():
+                data.extend(dict(f) for f in self.conn.execute(sql, params).fetchall())
+        return Respuesta(data)
+
+    def _llamar(self, funcion, params):
+        implementacion = getattr(self, f"_rpc_{funcion}", None)
+        if implementacion is None: raise ValueError(f"La función {funcion} no existe en el almacén local")
+        # Igual que en Postgres, toda la función corre en una transacción
+        with self._bloqueo, self.conn:
+            self.viajes += 1
+            return Respuesta(implementacion(**params))
+
+    def _filas(self, sql, params=()):
+        return [dict(f) for f in self.conn.execute(sql, params).fetchall()]
+
+    # --- Costeo (promedio ponderado con capas FIFO opcionales) ---
+    def _costear(self, insumo_id, delta, tipo, costo_total):
+        """Actualiza el estado de costo del insumo y devuelve el valor del movimiento (negativo = salida)."""
+        c = self.conn
+        c.execute("INSERT INTO costos_insumo (insumo_id, costo_promedio) SELECT id, COALESCE(costo_unitario, 0) FROM insumos WHERE id = ? "
+                  "ON CONFLICT (insumo_id) DO NOTHING", (insumo_id,))
+        r = c.execute("SELECT metodo, cantidad, valor, costo_promedio FROM costos_insumo WHERE insumo_id = ?", (insumo_id,)).fetchone()
+        if r is None: return None
+        metodo, cantidad, valor, promedio = r
+        movimiento = 0.0
+        if delta > 0:
+            # Compras entran a su costo real; devoluciones y ajustes, al promedio vigente
+            unitario = round(costo_total / delta, 6) if tipo == 'compra' and costo_total is not None else promedio
+            movimiento = delta * unitario
+            c.execute("INSERT INTO capas_costo_insumo (insumo_id, cantidad, costo_unitario) VALUES (?, ?, ?)", (insumo_id, delta, unitario))
+            if cantidad <= 0:
+                promedio, valor = unitario, (cantidad + delta) * unitario
+            else:
+                valor += movimiento
+                promedio = round(valor / (cantidad + delta), 6)
+            cantidad += delta
+        elif delta < 0:
+            # Las capas se consumen siempre de la más antigua; lo que no alcance sale al promedio
+            resto, fifo = -delta, 0.0
+            for capa_id, cant_capa, costo_capa in c.execute(
+                    "SELECT id, cantidad, costo_unitario FROM capas_costo_insumo WHERE insumo_id = ? ORDER BY id", (insumo_id,)).fetchall():
+                if resto <= 0: break
+                toma = min(cant_capa, resto)
+                fifo += toma * costo_capa
+                resto -= toma
+                if toma >= cant_capa: c.execute("DELETE FROM capas_costo_insumo WHERE id = ?", (capa_id,))
+                else: c.execute("UPDATE capas_costo_insumo SET cantidad = cantidad - ? WHERE id = ?", (toma, capa_id))
+            fifo += resto * promedio
+            cantidad += delta
+            if metodo == 'fifo':
+                movimiento = -fifo
+                valor -= fifo
+                if cantidad > 0: promedio = round(valor / cantidad, 6)
+            else:
+                movimiento = delta * promedio
+                valor = cantidad * promedio
+        c.execute(f"UPDATE costos_insumo SET cantidad = ?, valor = ?, costo_promedio = ?, actualizado_en = {AHORA} WHERE insumo_id = ?",
+                  (cantidad, round(valor, 4), promedio, insumo_id))
+        if metodo == 'fifo':
+            c.execute("UPDATE insumos SET costo_unitario = COALESCE((SELECT costo_unitario FROM capas_costo_insumo WHERE insumo_id = ? ORDER BY id LIMIT 1), ?) "
+                      "WHERE id = ?", (insumo_id, promedio, insumo_id))
+        elif tipo == 'compra':
+            c.execute("UPDATE insumos SET costo_unitario = ? WHERE id = ?", (promedio, insumo_id))
+        return round(movimiento, 4)
+
+    # --- Funciones rpc (mismos nombres, parámetros y resultados que en supabase/migrations) ---
+    def _rpc_aplicar_movimientos_stock(self, movimientos, usuario=None):
+        existentes = {f[0] for f in self.conn.execute("SELECT id FROM insumos").fetchall()}
+        deltas = {}
+        for m in movimientos or []:
+            insumo_id, delta = int(m['insumo_id']), float(m.get('delta') or 0)
+            deltas[insumo_id] = deltas.get(insumo_id, 0) + delta
+            if delta == 0 or insumo_id not in existentes: continue
+            tipo = m.get('tipo') or 'ajuste'
+            costo = self._costear(insumo_id, delta, tipo, m.get('costo_total'))
+            self.conn.execute("INSERT INTO movimientos_inventario (insumo_id, tipo, cantidad, referencia_tipo, referencia_id, usuario, costo) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?)", (insumo_id, tipo, delta, m.get('referencia_tipo'), m.get('referencia_id'), usuario, costo))
+        res = []
+        for insumo_id in sorted(deltas):
+            fila = self.conn.execute("UPDATE insumos SET stock_actual = stock_actual + ? WHERE id = ? RETURNING id, nombre, CAST(stock_actual AS REAL)",
+                                     (deltas[insumo_id], insumo_id)).fetchone()
+            if fila:
+                res.append({"insumo_id": fila[0], "insumo": fila[1], "stock_anterior": fila[2] - deltas[insumo_id], "stock_nuevo": fila[2]})
+        return res
+
+    def _rpc_fijar_stock_insumo(self, p_insumo_id, p_stock, p_usuario=None):
+        fila = self.conn.execute("SELECT stock_actual FROM insumos WHERE id = ?", (p_insumo_id,)).fetchone()
+        if fila is None: return []
+        return self._rpc_aplicar_movimientos_stock([{"insumo_id": p_insumo_id, "delta": float(p_stock) - fila[0], "tipo": "ajuste"}], p_usuario)
+
+    def _rpc_registrar_compras(self, p_compras, p_usuario=None, p_fecha=None):
+        nombres = dict(self.conn.execute("SELECT id, nombre FROM insumos").fetchall())
+        for c in p_compras or []:
+            if c.get('costo_total') is None or int(c['insumo_id']) not in nombres: continue
+            self.conn.execute("INSERT INTO libro_financiero (fecha, tipo, monto, descripcion, insumo_id, usuario) VALUES (?, 'compra_insumo', ?, ?, ?, ?)",
+                              (p_fecha or date.today().isoformat(), c['costo_total'], c.get('descripcion') or f"Compra: {nombres[int(c['insumo_id'])]}",
+                               c['insumo_id'], p_usuario))
+        return self._rpc_aplicar_movimientos_stock([
+            {"insumo_id": c['insumo_id'], "delta": c['cantidad'], "tipo": "compra", "referencia_tipo": "compra", "costo_total": c.get('costo_total')}
+            for c in p_compras or []
+        ], p_usuario)
+
+    def _rpc_transicionar_pedidos(self, p_ids, p_estado, p_usuario=None):
+        ids = [int(i) for i in p_ids]
+        marcas = ', '.join('?' * len(ids)) or 'NULL'
+        antes = dict(self.conn.execute(f"SELECT id, estado FROM pedidos WHERE id IN ({marcas})", ids).fetchall())
+        ok = sorted(i for i, estado in antes.items() if p_estado in TRANSICIONES_PEDIDO.get(estado, []))
+        marcas_ok = ', '.join('?' * len(ok)) or 'NULL'
+        self.conn.execute(f"UPDATE pedidos SET estado = ? WHERE id IN ({marcas_ok})", [p_estado] + ok)
+
+        # Ventas de lo entregado y anulaciones de lo que estaba entregado
+        for p in self._filas(f"SELECT id, cliente_nombre, total_pedido FROM pedidos WHERE id IN ({marcas_ok})", ok):
+            if p_estado == 'Entregado' or antes[p['id']] == 'Entregado':
+                entrega = p_estado == 'Entregado'
+                self.conn.execute("INSERT INTO libro_financiero (fecha, tipo, monto, descripcion, pedido_id, usuario) VALUES (?, 'venta', ?, ?, ?, ?)",
+                                  (date.today().isoformat(), p['total_pedido'] if entrega else -(p['total_pedido'] or 0),
+                                   f"{'Venta' if entrega else 'Anulación Venta'} Pedido #{p['id']} - {p['cliente_nombre']}", p['id'], p_usuario))
+
+        movimientos = []
+        if p_estado == 'Entregado':
+            movimientos = [{"insumo_id": c['insumo_id'], "delta": -c['cantidad'], "tipo": "entrega", "referencia_tipo": "pedido", "referencia_id": c['pedido_id']}
+                           for c in self._filas(f"SELECT pedido_id, insumo_id, cantidad FROM consumo_pedidos WHERE pedido_id IN ({marcas_ok}) AND cantidad <> 0 "
+                                                     "ORDER BY pedido_id, insumo_id", ok)]
+        elif p_estado == 'Cancelado':
+            # Se devuelve exactamente lo que se descontó; si no quedó en el libro, lo que indica la receta
+            entregados = [i for i in ok if antes[i] == 'Entregado']
+            marcas_e = ', '.join('?' * len(entregados)) or 'NULL'
+            descontado = self._filas(f"SELECT referencia_id AS pedido_id, insumo_id, SUM(cantidad) AS cantidad FROM movimientos_inventario "
+                                     f"WHERE referencia_tipo = 'pedido' AND tipo = 'entrega' AND referencia_id IN ({marcas_e}) "
+                                     f"GROUP BY referencia_id, insumo_id", entregados)
+            con_libro = {d['pedido_id'] for d in descontado}
+            por_receta = [dict(c, cantidad=-c['cantidad']) for c in self._filas(
+                f"SELECT pedido_id, insumo_id, cantidad FROM consumo_pedidos WHERE pedido_id IN ({marcas_e})", entregados) if c['pedido_id'] not in con_libro]
+            movimientos = [{"insumo_id": m['insumo_id'], "delta": -m['cantidad'], "tipo": "devolucion", "referencia_tipo": "pedido", "referencia_id": m['pedido_id']}
+                           for m in sorted(descontado + por_receta, key=lambda m: (m['pedido_id'], m['insumo_id'])) if m['cantidad'] != 0]
+        if movimientos:
+            self._rpc_aplicar_movimientos_stock(movimientos, p_usuario)
+
+        reporte = []
+        for i in ids:
+            anterior = antes.get(i)
+            sin_cambio = i in ok or anterior == p_estado
+            if i not in antes: error = f"El pedido {i} no existe"
+            elif sin_cambio: error = None
+            else: error = f"Transición no permitida: {anterior} -> {p_estado}"
+            reporte.append({"pedido_id": i, "estado_anterior": anterior, "estado_nuevo": p_estado if sin_cambio else anterior,
+                            "aplicado": i in ok, "error": error})
+        return reporte
+
+    def _rpc_crear_pedidos(self, p_pedidos):
+        columnas = ['cliente_nombre', 'cliente_contacto', 'fecha_entrega', 'hora_entrega', 'variacion_id', 'nombre_producto_snapshot',
+                    'cantidad', 'precio_unitario_final', 'total_pedido', 'estado', 'notas']
+        ids = []
+        for p in p_pedidos or []:
+            valores = [_valor(p.get(c)) for c in columnas]
+            valores[columnas.index('estado')] = p.get('estado') or 'Pendiente'
+            pedido_id = self.conn.execute(f"INSERT INTO pedidos ({', '.join(columnas)}) VALUES ({', '.join('?' * len(columnas))}) RETURNING id", valores).fetchone()[0]
+            self.conn.executemany("INSERT INTO pedido_items (pedido_id, variacion_id, producto, cantidad, precio_unitario) VALUES (?, ?, ?, ?, ?)",
+                                  [(pedido_id, _valor(i.get('variacion_id')), i.get('producto'), _valor(i.get('cantidad')), _valor(i.get('precio_unitario')))
+                                   for i in p.get('items') or []])
+            ids.append(pedido_id)
+        return ids
+
+    def _rpc_guardar_receta(self, p_variacion_id, p_datos, p_ingredientes):
+        editables = ['producto_id', 'nombre', 'precio', 'rendimiento', 'parametros_json', 'tiempo_prep_min', 'tiempo_horno_min']
+        datos = {c: _valor(v) for c, v in (p_datos or {}).items() if c in editables}
+        variacion_id = p_variacion_id
+        if variacion_id is None:
+            datos = {"rendimiento": 1, "tiempo_prep_min": 30, "tiempo_horno_min": 45, **{c: v for c, v in datos.items() if v is not None}}
+            variacion_id = self.conn.execute(f"INSERT INTO variaciones ({', '.join(datos)}) VALUES ({', '.join('?' * len(datos))}) RETURNING id",
+                                             list(datos.values())).fetchone()[0]
+        else:
+            sets = [f"{c} = ?" for c in datos] or ["id = id"]  # sin datos solo se reemplaza la receta
+            if self.conn.execute(f"UPDATE variaciones SET {', '.join(sets)} WHERE id = ?", list(datos.values()) + [variacion_id]).rowcount == 0:
+                raise ValueError(f"La variación {variacion_id} no existe")
+            self.conn.execute("DELETE FROM receta_ingredientes WHERE variacion_id = ?", (variacion_id,))
+        ids_insumos = {f[0] for f in self.conn.execute("SELECT id FROM insumos").fetchall()}
+        por_nombre = dict(self.conn.execute("SELECT nombre, MIN(id) FROM insumos GROUP BY nombre").fetchall())
+        self.conn.executemany(
+            "INSERT INTO receta_ingredientes (variacion_id, posicion, insumo_id, nombre, cantidad, unidad, costo) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(variacion_id, n, e.get('insumo_id') if e.get('insumo_id') in ids_insumos else por_nombre.get(e.get('nombre')),
+              e.get('nombre'), e.get('cantidad'), e.get('unidad'), e.get('costo') or 0)
+             for n, e in enumerate(p_ingredientes or [], start=1)])
+        return variacion_id
+
+    def _rpc_actualizar_costos_recetas(self):
+        filas = self.conn.execute(
+            "UPDATE receta_ingredientes AS ri "
+            "   SET costo = ROUND(ri.cantidad * factor_unidad(COALESCE(ri.unidad, i.unidad_medida), i.unidad_medida) * COALESCE(i.costo_unitario, 0), 2) "
+            "  FROM insumos i "
+            " WHERE i.id = ri.insumo_id AND factor_unidad(COALESCE(ri.unidad, i.unidad_medida), i.unidad_medida) IS NOT NULL "
+            "RETURNING variacion_id").fetchall()
+        return len({f[0] for f in filas})
+
+    def _rpc_cambiar_metodo_costeo(self, p_insumo_id, p_metodo):
+        self._costear(p_insumo_id, 0, 'ajuste', None)  # asegura el registro
+        self.conn.execute("UPDATE costos_insumo SET metodo = ? WHERE insumo_id = ?", (p_metodo, p_insumo_id))
+        if p_metodo == 'fifo':
+            capas, cant_capas = self.conn.execute("SELECT COALESCE(SUM(cantidad * costo_unitario), 0), COALESCE(SUM(cantidad), 0) "
+                                                  "FROM capas_costo_insumo WHERE insumo_id = ?", (p_insumo_id,)).fetchone()
+            self.conn.execute(
+                f"UPDATE costos_insumo SET valor = ? + (cantidad - ?) * costo_promedio, "
+                f"costo_promedio = CASE WHEN cantidad > 0 THEN ROUND((? + (cantidad - ?) * costo_promedio) / cantidad, 6) ELSE costo_promedio END, "
+                f"actualizado_en = {AHORA} WHERE insumo_id = ?", (capas, cant_capas, capas, cant_capas, p_insumo_id))
+        return None
+
+    def _rpc_fijar_costo_insumo(self, p_insumo_id, p_costo_unitario, p_usuario=None):
+        fila = self.conn.execute("SELECT costo_unitario FROM insumos WHERE id = ?", (p_insumo_id,)).fetchone()
+        if fila is None: return []
+        self._costear(p_insumo_id, 0, 'ajuste', None)  # asegura el registro
+        valor_antes = self.conn.execute("SELECT valor FROM costos_insumo WHERE insumo_id = ?", (p_insumo_id,)).fetchone()[0]
+        self.conn.execute("UPDATE capas_costo_insumo SET costo_unitario = ? WHERE insumo_id = ?", (p_costo_unitario, p_insumo_id))
+        valor = self.conn.execute(
+            f"UPDATE costos_insumo SET costo_promedio = ?, valor = ROUND(cantidad * ?, 4), actualizado_en = {AHORA} "
+            "WHERE insumo_id = ? RETURNING valor", (p_costo_unitario, p_costo_unitario, p_insumo_id)).fetchone()[0]
+        if valor != valor_antes:
+            self.conn.execute("INSERT INTO movimientos_inventario (insumo_id, tipo, cantidad, referencia_tipo, usuario, costo) "
+                              "VALUES (?, 'ajuste', 0, 'revaluacion', ?, ?)", (p_insumo_id, p_usuario, valor - valor_antes))
+        nombre, costo = self.conn.execute("UPDATE insumos SET costo_unitario = ? WHERE id = ? RETURNING nombre, CAST(costo_unitario AS REAL)",
+                                          (p_costo_unitario, p_insumo_id)).fetchone()
+        return [{"insumo_id": p_insumo_id, "insumo": nombre, "costo_anterior": fila[0], "costo_nuevo": costo}]
+
+    def _rpc_resumen_costeo(self):
+        return self._filas("SELECT COALESCE((SELECT -SUM(costo) FROM movimientos_inventario WHERE tipo IN ('entrega', 'devolucion')), 0) AS costo_vendido, "
+                           "COALESCE((SELECT SUM(valor) FROM costos_insumo), 0) AS valor_inventario")
+
+    def _rpc_stock_a_fecha(self, p_fecha):
+        # Último snapshot anterior a la fecha + movimientos posteriores hasta la fecha
+        return self._filas(
+            "SELECT i.id AS insumo_id, i.nombre AS insumo, i.unidad_medida, "
+            "       COALESCE(s.stock, 0) + COALESCE((SELECT SUM(m.cantidad) FROM movimientos_inventario m "
+            "                                         WHERE m.insumo_id = i.id AND m.id > COALESCE(s.ultimo_movimiento_id, 0) AND m.fecha <= :f), 0) AS stock "
+            "  FROM insumos i "
+            "  LEFT JOIN snapshots_inventario s ON s.id = (SELECT sn.id FROM snapshots_inventario sn WHERE sn.insumo_id = i.id AND sn.fecha <= :f "
+            "                                               ORDER BY sn.fecha DESC LIMIT 1) "
+            " ORDER BY i.nombre", {"f": _instante_utc(p_fecha)})
+
+    def _rpc_pedidos_cambiados(self, p_desde=None):
+        marca = self.conn.execute("SELECT version + 1 FROM versiones_datos WHERE clave = 'pedidos'").fetchone()[0]
+        if p_desde is None:
+            pedidos = self._filas("SELECT * FROM pedidos WHERE estado NOT IN ('Cancelado', 'Entregado') ORDER BY id")
+        else:
+            pedidos = self._filas("SELECT * FROM pedidos WHERE cambio_xid >= ? ORDER BY id", (int(p_desde),))
+        items = {}
+        for i in self._filas(f"SELECT pedido_id, variacion_id, cantidad FROM pedido_items WHERE pedido_id IN ({', '.join('?' * len(pedidos)) or 'NULL'}) "
+                             "ORDER BY id", [p['id'] for p in pedidos]):
+            items.setdefault(i.pop('pedido_id'), []).append(i)
+        return {"marca": str(marca), "pedidos": [dict(p, items=items.get(p['id'], [])) for p in pedidos]}
+
+    def _rpc_generar_snapshot_inventario(self):
+        hasta = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM movimientos_inventario").fetchone()[0]
+        return self.conn.execute(
+            "INSERT INTO snapshots_inventario (insumo_id, stock, ultimo_movimiento_id) "
+            "SELECT i.id, COALESCE(s.stock, 0) + COALESCE((SELECT SUM(m.cantidad) FROM movimientos_inventario m "
+            "                                              WHERE m.insumo_id = i.id AND m.id > COALESCE(s.ultimo_movimiento_id, 0) AND m.id <= :h), 0), :h "
+            "  FROM insumos i "
+            "  LEFT JOIN snapshots_inventario s ON s.id = (SELECT sn.id FROM snapshots_inventario sn WHERE sn.insumo_id = i.id ORDER BY sn.fecha DESC, sn.id DESC LIMIT 1)",
+            {"h": hasta}).rowcount
+
+if __name__ == '__main__':
+    # python almacen_local.py [ruta]: crea (o abre) la base local con los datos de ejemplo
+    almacen = AlmacenSQLite(sys.argv[1] if len(sys.argv) > 1 else 'erp_local.sqlite')
+    for tabla in ('usuarios', 'insumos', 'productos', 'variaciones', 'receta_ingredientes', 'pedidos', 'libro_financiero'):
+        print(f"{tabla}: {len(almacen.table(tabla).select('id').execute().data)}")
@@ -0,0 +1,393 @@
+# Almacén remoto del ERP: cliente de Supabase con cola de escrituras sin conexión.
+# Si Supabase no responde, las lecturas salen de la última copia guardada y las escrituras quedan
+# anotadas en un diario SQLite local; se envían en orden y por lotes apenas vuelve la conexión.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import httpx
+
+from almacen_local import Almacen
+
+# Errores en que la petición no llegó al servidor: es seguro encolarla y reenviarla después
+ERRORES_SIN_ENVIO = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, ConnectionError)
+# Cualquier falla de red (incluye respuestas que no alcanzaron a llegar): las lecturas usan la copia local
+ERRORES_CONEXION = (httpx.TransportError, ConnectionError, TimeoutError)
+# Falla a mitad de una escritura (timeout de lectura, conexión cortada): no se sabe si el servidor la aplicó
+SIN_RESPUESTA = "Sin respuesta del servidor: pudo haberse aplicado; revisar antes de reintentar"
+METODOS_ESCRITURA = {'insert', 'upsert', 'update', 'delete'}
+RPC_LECTURA = {'resumen_costeo', 'stock_a_fecha', 'pedidos_cambiados'}
+# Credenciales: ni copia local (el login no puede funcionar sin conexión con una contraseña vieja)
+# ni diario (la contraseña quedaría en claro en el disco); sin conexión fallan enseguida
+TABLAS_SOLO_EN_LINEA = {'usuarios'}
+# Lo que leen las pantallas que deben seguir andando sin conexión (tomar pedidos, tablero e inventario);
+# el resto de las lecturas no deja copia
+TABLAS_CON_COPIA = {'versiones_datos', 'productos', 'variaciones', 'receta_ingredientes', 'insumos', 'costos_insumo', 'pedidos_cambiados'}
+# Las claves incluyen los valores de eq/in_: se guardan las más recientes por tabla y ninguna más vieja que una semana
+COPIAS_POR_TABLA = 20
+EDAD_MAXIMA_COPIA = 7 * 24 * 3600
+# Una copia idéntica a la última guardada no se reescribe hasta pasado este tiempo
+REFRESCO_COPIA = 600
+# rpc que fijan un valor absoluto: al reenviarlas se compara la fila con la vista al encolar, igual que un update.
+# rpc -> (tabla, columna clave, parámetro con la clave, columnas que fija o parámetro cuyas claves las nombran)
+GUARDAS_RPC = {
+    'fijar_stock_insumo': ('insumos', 'id', 'p_insumo_id', ['stock_actual']),
+    'fijar_costo_insumo': ('insumos', 'id', 'p_insumo_id', ['costo_unitario']),
+    'cambiar_metodo_costeo': ('costos_insumo', 'insumo_id', 'p_insumo_id', ['metodo']),
+    'guardar_receta': ('variaciones', 'id', 'p_variacion_id', 'p_datos'),
+}
+# transicionar_pedidos no lleva guarda: la BD valida cada transición contra el estado actual y rechaza las que ya no
+# corresponden; al reenviarla, un rechazo deja la entrada en conflicto
+# Parámetro de las lecturas incrementales (la marca del tablero): solo se copia la carga completa, sin marca
+PARAMETRO_MARCA = 'p_desde'
+
+class RespuestaLocal:
+    # Misma forma que la respuesta de postgrest; 'origen' es 'copia' (leída sin conexión) o 'cola' (escritura pendiente)
+    def __init__(self, data, origen):
+        self.data = data
+        self.count = None
+        self.origen = origen
+
+AVISO_COLA = "📴 Guardado sin conexión, pendiente de envío"
+
+def en_cola(res):
+    """True si la escritura quedó en el diario local en vez de llegar a Supabase."""
+    return getattr(res, 'origen', None) == 'cola'
+
+class ConsultaDiferida:
+    # Anota la cadena table(...).select(...).eq(...) y recién la ejecuta en execute()
+    def __init__(self, cliente, raiz, args):
+        self._cliente = cliente
+        self._pasos = [(raiz, list(args), {})]
+
+    def __getattr__(self, metodo):
+        if metodo.startswith('_'): raise AttributeError(metodo)
+        def paso(*args, **kwargs):
+            self._pasos.append((metodo, list(args), kwargs))
+            return self
+        return paso
+
+    def execute(self):
+        return self._cliente.ejecutar(self._pasos)
+
+def directorio_local():
+    """Carpeta del usuario con permisos 0700 para el diario y las copias (guardan datos del negocio)."""
+    base = os.environ.get("XDG_DATA_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".local", "share")
+    ruta = os.path.join(base, "tv-reposteria")
+    os.makedirs(ruta, mode=0o700, exist_ok=True)
+    if os.name == "posix":
+        info = os.stat(ruta)
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f"La carpeta {ruta} pertenece a otro usuario")
+        if info.st_mode & 0o077:
+            os.chmod(ruta, 0o700)
+    return ruta
+
+def crear_privado(ruta):
+    """Crea el archivo con permisos 0600 antes de que SQLite lo abra (el -wal y el -shm heredan los mismos)."""
+    if os.name != "posix": return
+    os.close(os.open(ruta, os.O_CREAT | os.O_RDWR, 0o600))
+    for archivo in (ruta, ruta + "-wal", ruta + "-shm"):
+        if os.path.exists(archivo) and os.stat(archivo).st_mode & 0o077:
+            os.chmod(archivo, 0o600)
+
+class ClienteResiliente(Almacen):
+    # Almacén sobre Supabase (table/rpc ... execute) con copia local de lecturas y diario de escrituras
+    def __init__(self, conectar, ruta, espera_reintento=30, lote=50):
+        super().__init__()
+        self.conectar = conectar  # crea el cliente real (sin ir a la red) la primera vez que se usa
+        self.ruta = ruta
+        self.espera_reintento = espera_reintento
+        self.lote = lote
+        self._cliente = None
+        self._caido_hasta = 0.0
+        self._bloqueo = threading.Lock()
+        self._bloqueo_cuenta = threading.Lock()
+        self._copiadas = {}  # clave -> (huella de los datos, momento en que se guardó)
+        self._podado = 0.0
+        crear_privado(ruta)
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS copias (clave TEXT PRIMARY KEY, tabla TEXT, datos TEXT, guardado REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_copias_tabla ON copias (tabla, guardado)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS diario (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, tabla TEXT, pasos TEXT, antes TEXT,
+                creado REAL, estado TEXT NOT NULL DEFAULT 'pendiente', detalle TEXT)""")
+            # Copias guardadas por versiones anteriores (incluidas las de usuarios)
+            conn.execute(f"DELETE FROM copias WHERE tabla NOT IN ({','.join('?' * len(TABLAS_CON_COPIA))})", sorted(TABLAS_CON_COPIA))
+            # Pendientes en memoria: lo usan todas las lecturas y escrituras, no vale un COUNT(*) cada vez
+            self._pendientes = conn.execute("SELECT COUNT(*) FROM diario WHERE estado = 'pendiente'").fetchone()[0]
+        self._podar()
+
+    def _conn(self):
+        # Conexión corta por operación: sqlite3 no comparte conexiones entre hilos de Streamlit
+        return sqlite3.connect(self.ruta, timeout=10)
+
+    def table(self, nombre): return ConsultaDiferida(self, 'table', [nombre])
+    def rpc(self, funcion, params=None): return ConsultaDiferida(self, 'rpc', [funcion, params or {}])
+
+    @property
+    def en_linea(self):
+        return time.time() >= self._caido_hasta
+
+    def _enviar(self, pasos):
+        """Reproduce la cadena sobre el cliente real; tras una falla de red no reintenta hasta pasada la espera."""
+        if not self.en_linea: raise ConnectionError("Supabase sin conexión")
+        try:
+            if self._cliente is None: self._cliente = self.conectar()
+            consulta = self._cliente
+            for metodo, args, kwargs in pasos:
+                consulta = getattr(consulta, metodo)(*args, **kwargs)
+            self.viajes += 1
+            return consulta.execute()
+        except ERRORES_CONEXION:
+            self._caido_hasta = time.time() + self.espera_reintento
+            raise
+
+    def ejecutar(self, pasos):
+        tabla = pasos[0][1][0]
+        if pasos[0][0] == 'rpc':
+            escritura = tabla not in RPC_LECTURA
+        else:
+            escritura = any(m in METODOS_ESCRITURA for m, _, _ in pasos)
+        return self._escribir(tabla, pasos) if escritura else self._leer(tabla, pasos)
+
+    def _leer(self, tabla, pasos):
+        # Sin conexión se devuelve la última respuesta a la misma consulta; una lectura incremental no tiene copia
+        clave = json.dumps(pasos, default=str, sort_keys=True)
+        incremental = pasos[0][0] == 'rpc' and pasos[0][1][1].get(PARAMETRO_MARCA) is not None
+        if tabla not in TABLAS_CON_COPIA or incremental:
+            res = self._enviar(pasos)
+        else:
+            try:
+                res = self._enviar(pasos)
+            except ERRORES_CONEXION:
+                with self._conn() as conn:
+                    fila = conn.execute("SELECT datos FROM copias WHERE clave = ?", (clave,)).fetchone()
+                if fila is None: raise
+                return RespuestaLocal(json.loads(fila[0]), 'copia')
+            self._guardar_copia(clave, tabla, res.data)
+        if self.pendientes(): self.sincronizar()
+        return res
+
+    def _guardar_copia(self, clave, tabla, data):
+        datos = json.dumps(data, default=str)
+        huella, ahora = hash(datos), time.time()
+        anterior = self._copiadas.get(clave)
+        if anterior and anterior[0] == huella and ahora - anterior[1] < REFRESCO_COPIA: return
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO copias VALUES (?, ?, ?, ?)", (clave, tabla, datos, ahora))
+        self._copiadas[clave] = (huella, ahora)
+        if ahora - self._podado > REFRESCO_COPIA: self._podar()
+
+    def _podar(self):
+        """Descarta las copias viejas y las que sobran en cada tabla (las menos recientes)."""
+        self._podado = time.time()
+        with self._conn() as conn:
+            conn.execute("DELETE FROM copias WHERE guardado < ?", (self._podado - EDAD_MAXIMA_COPIA,))
+            conn.execute("DELETE FROM copias WHERE clave IN (SELECT clave FROM (SELECT clave, ROW_NUMBER() OVER "
+                         "(PARTITION BY tabla ORDER BY guardado DESC) AS n FROM copias) WHERE n > ?)", (COPIAS_POR_TABLA,))
+
+    def _escribir(self, tabla, pasos):
+        if tabla in TABLAS_SOLO_EN_LINEA: return self._enviar(pasos)
+        # Lo encolado antes va primero; si algo sigue pendiente, esta escritura espera su turno en la cola
+        if self.pendientes(): self.sincronizar()
+        if not self.pendientes():
+            try:
+                return self._enviar(pasos)
+            except ERRORES_SIN_ENVIO:
+                pass
+        guarda = self._guarda(tabla, pasos)
+        if guarda:
+            t, clave, valor, columnas = guarda
+            filas = self._filas_vistas(t, [('eq', [clave, valor], {})])
+            antes = [{c: f.get(c) for c in [clave] + columnas} for f in filas] if filas else None
+        else:
+            antes = self._filas_vistas(tabla, pasos) if any(m in ('update', 'delete') for m, _, _ in pasos) else None
+        with self._conn() as conn:
+            conn.execute("INSERT INTO diario (tabla, pasos, antes, creado) VALUES (?, ?, ?, ?)",
+                         (tabla, json.dumps(pasos, default=str), json.dumps(antes, default=str) if antes else None, time.time()))
+        self._contar(1)
+        return RespuestaLocal([], 'cola')
+
+    def _guarda(self, tabla, pasos):
+        """(tabla, columna clave, valor, columnas) de la fila que fija una rpc de GUARDAS_RPC, o None."""
+        if pasos[0][0] != 'rpc' or tabla not in GUARDAS_RPC: return None
+        t, clave, parametro, columnas = GUARDAS_RPC[tabla]
+        params = pasos[0][1][1]
+        if params.get(parametro) is None: return None  # guardar_receta de una variación nueva
+        if isinstance(columnas, str): columnas = sorted(params.get(columnas) or {})
+        return t, clave, params[parametro], columnas
+
+    def _filas_vistas(self, tabla, pasos):
+        """Filas que se van a modificar tal como se leyeron por última vez (para detectar conflictos al sincronizar)."""
+        filtros = {args[0]: str(args[1]) for m, args, _ in pasos if m == 'eq'}
+        if not filtros: return None
+        with self._conn() as conn:
+            copias = conn.execute("SELECT datos FROM copias WHERE tabla = ? ORDER BY guardado DESC", (tabla,)).fetchall()
+        for (datos,) in copias:
+            filas = [f for f in json.loads(datos) if isinstance(f, dict)
+                     and all(c in f and str(f[c]) == v for c, v in filtros.items())]
+            if filas: return filas
+        return None
+
+    def pendientes(self):
+        return self._pendientes
+
+    def _contar(self, delta):
+        with self._bloqueo_cuenta:
+            self._pendientes += delta
+
+    def problemas(self):
+        """Escrituras que no se aplicaron: conflictos con cambios hechos en otro lado y errores del servidor."""
+        with self._conn() as conn:
+            filas = conn.execute("SELECT id, tabla, pasos, estado, detalle, creado FROM diario WHERE estado IN ('conflicto', 'error') ORDER BY id").fetchall()
+        return [{"id": i, "tabla": t, "pasos": json.loads(p), "estado": e, "detalle": d, "creado": datetime.fromtimestamp(c)} for i, t, p, e, d, c in filas]
+
+    def forzar(self, entrada_id):
+        """Vuelve a encolar una escritura en conflicto sin comparar (la última escritura gana)."""
+        with self._conn() as conn:
+            n = conn.execute("UPDATE diario SET estado = 'pendiente', antes = NULL, detalle = NULL "
+                             "WHERE id = ? AND estado <> 'pendiente'", (entrada_id,)).rowcount
+        self._contar(n)
+
+    def descartar(self, entrada_id):
+        with self._conn() as conn:
+            n = conn.execute("DELETE FROM diario WHERE id = ? AND estado = 'pendiente'", (entrada_id,)).rowcount
+            conn.execute("DELETE FROM diario WHERE id = ?", (entrada_id,))
+        self._contar(-n)
+
+    def sincronizar(self, reintentar=False):
+        """Envía lo encolado en orden, por lotes; se detiene si la conexión vuelve a fallar. Devuelve cuántas se aplicaron."""
+        if reintentar: self._caido_hasta = 0.0
+        if not self.en_linea or not self._bloqueo.acquire(blocking=False): return 0
+        aplicadas = 0
+        try:
+            while True:
+                with self._conn() as conn:
+                    filas = conn.execute("SELECT id, tabla, pasos FROM diario WHERE estado = 'pendiente' ORDER BY id LIMIT ?", (self.lote,)).fetchall()
+                if not filas: return aplicadas
+                for grupo in self._agrupar(filas):
+                    try:
+                        self._aplicar(grupo)
+                    except ERRORES_CONEXION:
+                        return aplicadas
+                    aplicadas += len(grupo)
+        finally:
+            self._bloqueo.release()
+
+    def _agrupar(self, filas):
+        # Inserciones seguidas en la misma tabla y con las mismas columnas viajan juntas en una sola petición
+        # (con columnas distintas PostgREST completaría las que faltan con null en vez del default)
+        grupo = []
+        for fila in filas:
+            pasos = json.loads(fila[2])
+            columnas = None
+            if len(pasos) == 2 and pasos[1][0] == 'insert' and not pasos[1][2]:
+                datos = pasos[1][1][0] if isinstance(pasos[1][1][0], list) else [pasos[1][1][0]]
+                claves = {tuple(sorted(f)) if isinstance(f, dict) else None for f in datos}
+                if len(claves) == 1: columnas = claves.pop()
+            if grupo and not (columnas and grupo[-1][3] == columnas and grupo[-1][1] == fila[1]):
+                yield grupo
+                grupo = []
+            grupo.append((fila[0], fila[1], pasos, columnas))
+        if grupo: yield grupo
+
+    def _marcar(self, ids, estado, detalle=None):
+        # Solo se marcan entradas pendientes: todas salen de la cola
+        self._contar(-len(ids))
+        with self._conn() as conn:
+            if estado == 'aplicada':
+                conn.execute(f"DELETE FROM diario WHERE id IN ({','.join('?' * len(ids))})", ids)
+            else:
+                conn.execute(f"UPDATE diario SET estado = ?, detalle = ? WHERE id IN ({','.join('?' * len(ids))})", [estado, detalle] + ids)
+
+    def _aplicar(self, grupo):
+        if len(grupo) > 1:
+            filas = [f for _, _, pasos, _ in grupo for f in (pasos[1][1][0] if isinstance(pasos[1][1][0], list) else [pasos[1][1][0]])]
+            try:
+                self._enviar([grupo[0][2][0], ('insert', [filas], {})])
+                self._marcar([g[0] for g in grupo], 'aplicada')
+            except ERRORES_SIN_ENVIO:
+                raise
+            except ERRORES_CONEXION:
+                # Reenviarlo podría duplicar las filas: queda para revisión manual
+                self._marcar([g[0] for g in grupo], 'error', SIN_RESPUESTA)
+                raise
+            except Exception:
+                # Una fila rechazada no debe arrastrar a las demás: se reintentan una por una
+                for g in grupo: self._aplicar([g])
+            return
+
+        entrada_id, tabla, pasos, _ = grupo[0]
+        guarda = self._guarda(tabla, pasos)
+        # 'antes' se lee recién ahora: una edición anterior del mismo lote pudo haberlo rebasado
+        with self._conn() as conn:
+            antes = conn.execute("SELECT antes FROM diario WHERE id = ?", (entrada_id,)).fetchone()[0]
+        try:
+            if antes:
+                antes = json.loads(antes)
+                # solo lee: si falla la red, la entrada sigue pendiente
+                if guarda: cambios = self._conflicto(guarda[0], [('eq', list(guarda[1:3]), {})], antes, guarda[1])
+                else: cambios = self._conflicto(tabla, pasos, antes)
+                if cambios:
+                    self._marcar([entrada_id], 'conflicto', cambios)
+                    return
+            try:
+                res = self._enviar(pasos)
+            except ERRORES_SIN_ENVIO:
+                raise
+            except ERRORES_CONEXION:
+                self._marcar([entrada_id], 'error', SIN_RESPUESTA)
+                raise
+        except ERRORES_CONEXION:
+            raise
+        except Exception as e:
+            self._marcar([entrada_id], 'error', str(e))
+            return
+        rechazos = [f['error'] for f in res.data if isinstance(f, dict) and f.get('error')] \
+            if pasos[0][0] == 'rpc' and isinstance(res.data, list) else []
+        if rechazos:
+            # Se aplicó lo que seguía siendo válido; lo demás cambió en otro lado mientras estaba en cola
+            self._marcar([entrada_id], 'conflicto', "; ".join(rechazos))
+            return
+        self._marcar([entrada_id], 'aplicada')
+        if guarda:
+            t, clave, valor, _ = guarda
+            self._rebasar(t, self._enviar([('table', [t], {}), ('select', ['*'], {}), ('eq', [clave, valor], {})]).data, clave)
+        elif res.data and any(m == 'update' for m, _, _ in pasos):
+            self._rebasar(tabla, res.data)
+
+    def _conflicto(self, tabla, pasos, antes, columna_clave='id'):
+        """Compara las filas actuales con las que se vieron al encolar; devuelve qué cambió o None."""
+        columnas = sorted({c for f in antes for c in f})
+        filtros = [('table', [tabla], {}), ('select', [", ".join(columnas)], {})] + [p for p in pasos if p[0] == 'eq']
+        actuales = self._enviar(filtros).data
+        clave = lambda f: str(f.get(columna_clave, json.dumps(f, sort_keys=True, default=str)))
+        vistas, ahora = {clave(f): f for f in antes}, {clave(f): f for f in actuales}
+        cambios = []
+        for k, fila in vistas.items():
+            if k not in ahora:
+                cambios.append(f"{tabla} {k}: ya no existe")
+                continue
+            distintas = [c for c in fila if str(fila[c]) != str(ahora[k].get(c))]
+            if distintas: cambios.append(f"{tabla} {k}: cambió {', '.join(distintas)}")
+        return "; ".join(cambios) or None
+
+    def _rebasar(self, tabla, filas_nuevas, columna_clave='id'):
+        # Otras ediciones en cola sobre las mismas filas (updates o rpc con guarda en esa tabla) se comparan contra lo que
+        # acabamos de escribir, no contra la copia vieja
+        nuevas = {str(f.get(columna_clave)): f for f in filas_nuevas if isinstance(f, dict) and columna_clave in f}
+        entradas = [tabla] + [r for r, g in GUARDAS_RPC.items() if g[0] == tabla]
+        with self._conn() as conn:
+            for entrada_id, antes in conn.execute(f"SELECT id, antes FROM diario WHERE estado = 'pendiente' AND antes IS NOT NULL "
+                                                  f"AND tabla IN ({','.join('?' * len(entradas))})", entradas).fetchall():
+                filas = json.loads(antes)
+                for f in filas:
+                    nueva = nuevas.get(str(f.get(columna_clave)))
+                    if nueva: f.update({c: nueva[c] for c in f if c in nueva})
+                conn.execute("UPDATE diario SET antes = ? WHERE id = ?", (json.dumps(filas, default=str), entrada_id))
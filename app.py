@@ -1,10 +1,22 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
 import plotly.express as px
 import plotly.graph_objects as go
 from datetime import date
+from decimal import Decimal
 import time
+import functools
+import hashlib
+import io
+import os
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
 
 # ==========================================
 # 1. CONFIGURACIÓN Y ESTILOS "GOOGLE STITCH"
@@ -86,15 +98,82 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# ... (MANTÉN TU FUNCIÓN get_engine Y EL LOGIN IGUAL QUE ANTES) ...
+# --- CONEXIONES: PRIMARIA (ESCRITURA) Y RÉPLICA OPCIONAL (LECTURA) ---
+# secrets.toml:
+#   [db]        url = "...", read_url = "..." (opcional), read_lag_s = 10 (atraso máximo esperado de la réplica)
+#   [db.pool] / [db.read_pool]   pool_size, max_overflow, pool_recycle, pool_timeout, statement_timeout_ms
+try:
+    READ_DATABASE_URL = st.secrets["db"].get("read_url") or None
+    RETRASO_REPLICA_S = float(st.secrets["db"].get("read_lag_s", 10))
+except Exception:
+    READ_DATABASE_URL = None
+    RETRASO_REPLICA_S = 10.0
+
+class PoolMedido(QueuePool):
+    # QueuePool que registra cuánto espera cada checkout (cola llena o conexión nueva)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.esperas = deque(maxlen=500)
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.esperas.append(time.perf_counter() - t0)
+
+def config_pool(seccion):
+    try: cfg = dict(st.secrets["db"].get(seccion, {}))
+    except Exception: cfg = {}
+    return {
+        "pool_size": int(cfg.get("pool_size", 5)),
+        "max_overflow": int(cfg.get("max_overflow", 10)),
+        "pool_recycle": int(cfg.get("pool_recycle", 1800)),
+        "pool_timeout": int(cfg.get("pool_timeout", 30)),
+        "statement_timeout_ms": int(cfg.get("statement_timeout_ms", 0)),
+    }
+
+def crear_engine(url, cfg):
+    connect_args = {}
+    if url.startswith("postgresql") and cfg["statement_timeout_ms"]:
+        connect_args["options"] = f"-c statement_timeout={cfg['statement_timeout_ms']}"
+    elif url.startswith("sqlite"):
+        # Permite probar localmente con dos archivos SQLite (primaria y réplica)
+        connect_args["check_same_thread"] = False
+    return create_engine(
+        url, pool_pre_ping=True, poolclass=PoolMedido, connect_args=connect_args,
+        pool_size=cfg["pool_size"], max_overflow=cfg["max_overflow"],
+        pool_recycle=cfg["pool_recycle"], pool_timeout=cfg["pool_timeout"],
+    )
+
 @st.cache_resource
 def get_engine():
-    return create_engine(DATABASE_URL, pool_pre_ping=True)
+    return crear_engine(DATABASE_URL, config_pool("pool"))
+
+@st.cache_resource
+def get_read_engine():
+    # Sin réplica configurada las lecturas usan la primaria
+    if not READ_DATABASE_URL: return get_engine()
+    return crear_engine(READ_DATABASE_URL, config_pool("read_pool"))
+
 try:
     engine = get_engine()
+    engine_lectura = get_read_engine()
 except Exception as e:
     st.error(f"❌ Error fatal: {e}")
     st.stop()
+
+def resumen_pool(eng):
+    esperas_ms = np.array(getattr(eng.pool, "esperas", []), dtype=float) * 1000
+    return {
+        "En uso": eng.pool.checkedout(),
+        "Tamaño": eng.pool.size(),
+        "Overflow": eng.pool.overflow(),
+        "Espera p50 (ms)": float(np.percentile(esperas_ms, 50)) if esperas_ms.size else 0.0,
+        "Espera p95 (ms)": float(np.percentile(esperas_ms, 95)) if esperas_ms.size else 0.0,
+        "Espera máx (ms)": float(esperas_ms.max()) if esperas_ms.size else 0.0,
+        "Checkouts": int(esperas_ms.size),
+    }
 # ==========================================
 # 2. SISTEMA DE LOGIN
 # ==========================================
@@ -148,6 +227,7 @@ with st.sidebar:
     menu = st.radio("Módulos ERP", 
         [
             "Dashboard", 
+            "Rentabilidad", 
             "Historial de Viajes", 
             "Subir Archivos", 
             "Gestión de Flota", 
@@ -177,21 +257,258 @@ with st.sidebar:
         iva_input = st.number_input("% Recuperación IVA Petróleo", value=19, max_value=100)
         IVA_PETROLEO = iva_input / 100
     
+    with st.expander("🔌 Conexiones BD", expanded=False):
+        pools = {"Primaria (escritura)": resumen_pool(engine)}
+        if engine_lectura is not engine:
+            pools["Réplica (lectura)"] = resumen_pool(engine_lectura)
+        else:
+            st.caption("Sin réplica configurada: las lecturas usan la primaria.")
+        st.dataframe(pd.DataFrame(pools).T.style.format("{:,.1f}", subset=["Espera p50 (ms)", "Espera p95 (ms)", "Espera máx (ms)"]), use_container_width=True)
+    
     st.markdown("---")
     st.info("Sistema Operativo v10.2 (ERP Full)")
 
 # ==========================================
-# 4. FUNCIONES HELPER GLOBALES
+# 4. CACHÉ COMPARTIDA ENTRE PROCESOS
+# ==========================================
+# st.cache_data vive dentro de cada proceso de Streamlit; con varias réplicas cada una cargaba
+# sus propios datos y quedaban desfasadas tras una escritura. Los loaders usan esta caché, cuyo
+# backend es intercambiable y por defecto es un SQLite en disco compartido por todo el host.
+
+class CacheBackend(ABC):
+    # Interfaz mínima que debe cumplir cualquier backend (SQLite, Redis, memoria...).
+    # Cada entrada es un sobre JSON (texto) más los bytes Parquet a los que apunta.
+    @abstractmethod
+    def leer(self, clave): ...  # (sobre, datos) o None
+
+    @abstractmethod
+    def guardar(self, clave, sobre, datos, ttl): ...
+
+    @abstractmethod
+    def versiones(self, namespaces): ...
+
+    @abstractmethod
+    def invalidar(self, namespace): ...
+
+    @abstractmethod
+    def ultima_escritura(self, namespaces): ...
+
+class CacheMemoria(CacheBackend):
+    # Solo para un proceso (desarrollo): mismo contrato que el backend en disco
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entradas = {}
+        self.vers = {}
+        self.escrituras = {}
+
+    def leer(self, clave):
+        entrada = self.entradas.get(clave)
+        if entrada is None: return None
+        sobre, datos, expira, _ = entrada
+        if expira < time.time():
+            del self.entradas[clave]
+            return None
+        self.entradas[clave] = (sobre, datos, expira, time.time())
+        return sobre, datos
+
+    def guardar(self, clave, sobre, datos, ttl):
+        self.entradas[clave] = (sobre, datos, time.time() + ttl, time.time())
+        total = sum(len(s) + len(d) for s, d, _, _ in self.entradas.values())
+        for k, (s, d, _, _) in sorted(self.entradas.items(), key=lambda kv: kv[1][3]):
+            if total <= self.max_bytes: break
+            total -= len(s) + len(d)
+            del self.entradas[k]
+
+    def versiones(self, namespaces):
+        return [self.vers.get(n, 0) for n in namespaces]
+
+    def invalidar(self, namespace):
+        self.vers[namespace] = self.vers.get(namespace, 0) + 1
+        self.escrituras[namespace] = time.time()
+
+    def ultima_escritura(self, namespaces):
+        return max((self.escrituras.get(n, 0.0) for n in namespaces), default=0.0)
+
+class CacheSQLite(CacheBackend):
+    # Un archivo SQLite en modo WAL: lo comparten todos los procesos del host sin servidor extra
+    def __init__(self, ruta, max_bytes):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Archivos de versiones anteriores (todo en un JSON con base64): es una caché, se descartan
+            columnas = [c[1] for c in conn.execute("PRAGMA table_info(entradas)")]
+            if columnas and 'sobre' not in columnas: conn.execute("DROP TABLE entradas")
+            conn.execute("CREATE TABLE IF NOT EXISTS entradas (clave TEXT PRIMARY KEY, sobre TEXT, datos BLOB, bytes INTEGER, expira REAL, usado REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entradas_usado ON entradas (usado)")
+            conn.execute("CREATE TABLE IF NOT EXISTS versiones (namespace TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS escrituras (namespace TEXT PRIMARY KEY, momento REAL NOT NULL)")
+
+    def _conn(self):
+        # Conexión corta por operación: sqlite3 no comparte conexiones entre hilos de Streamlit
+        return sqlite3.connect(self.ruta, timeout=10)
+
+    def leer(self, clave):
+        ahora = time.time()
+        with self._conn() as conn:
+            fila = conn.execute("SELECT sobre, datos, expira FROM entradas WHERE clave = ?", (clave,)).fetchone()
+            if fila is None: return None
+            if fila[2] < ahora:
+                conn.execute("DELETE FROM entradas WHERE clave = ?", (clave,))
+                return None
+            conn.execute("UPDATE entradas SET usado = ? WHERE clave = ?", (ahora, clave))
+            return fila[0], fila[1]
+
+    def guardar(self, clave, sobre, datos, ttl):
+        ahora = time.time()
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO entradas VALUES (?, ?, ?, ?, ?, ?)",
+                         (clave, sobre, sqlite3.Binary(datos), len(sobre) + len(datos), ahora + ttl, ahora))
+            conn.execute("DELETE FROM entradas WHERE expira < ?", (ahora,))
+            # Desalojo por tamaño: se borran las menos usadas hasta caber en max_bytes
+            total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entradas").fetchone()[0]
+            if total > self.max_bytes:
+                for k, b in conn.execute("SELECT clave, bytes FROM entradas ORDER BY usado").fetchall():
+                    if total <= self.max_bytes: break
+                    conn.execute("DELETE FROM entradas WHERE clave = ?", (k,))
+                    total -= b
+
+    def versiones(self, namespaces):
+        with self._conn() as conn:
+            filas = dict(conn.execute(
+                f"SELECT namespace, version FROM versiones WHERE namespace IN ({','.join('?' * len(namespaces))})", list(namespaces)
+            ).fetchall())
+        return [filas.get(n, 0) for n in namespaces]
+
+    def invalidar(self, namespace):
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO versiones (namespace, version) VALUES (?, 1) ON CONFLICT(namespace) DO UPDATE SET version = version + 1",
+                (namespace,)
+            )
+            conn.execute("INSERT OR REPLACE INTO escrituras (namespace, momento) VALUES (?, ?)", (namespace, time.time()))
+
+    def ultima_escritura(self, namespaces):
+        with self._conn() as conn:
+            return conn.execute(
+                f"SELECT COALESCE(MAX(momento), 0) FROM escrituras WHERE namespace IN ({','.join('?' * len(namespaces))})", list(namespaces)
+            ).fetchone()[0]
+
+BACKENDS_CACHE = {"sqlite": CacheSQLite, "memoria": CacheMemoria}
+
+def directorio_cache():
+    # Carpeta del usuario con permisos 0700: en el /tmp compartido cualquier usuario local podría plantar entradas
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    ruta = os.path.join(base, "logisticshub")
+    os.makedirs(ruta, mode=0o700, exist_ok=True)
+    if os.name == "posix":
+        info = os.stat(ruta)
+        if info.st_uid != os.getuid():
+            raise RuntimeError(f"La carpeta de caché {ruta} pertenece a otro usuario")
+        if info.st_mode & 0o077:
+            os.chmod(ruta, 0o700)
+    return ruta
+
+def config_cache():
+    try: cfg = dict(st.secrets.get("cache", {}))
+    except Exception: cfg = {}
+    return {
+        "backend": cfg.get("backend", "sqlite"),
+        "ruta": cfg.get("ruta"),
+        "max_bytes": int(cfg.get("max_mb", 256)) * 1024 * 1024,
+        "ttl": int(cfg.get("ttl", 3600)),
+    }
+
+@st.cache_resource
+def get_cache_backend():
+    cfg = config_cache()
+    if cfg["backend"] == "sqlite":
+        return CacheSQLite(cfg["ruta"] or os.path.join(directorio_cache(), "cache.sqlite"), cfg["max_bytes"])
+    return BACKENDS_CACHE[cfg["backend"]](cfg["max_bytes"])
+
+def _empaquetar(obj, datos):
+    # Solo formatos de datos, nunca pickle: leer una entrada de la caché no puede ejecutar código.
+    # DataFrames en Parquet (columnar, conserva category/datetime), agregados en bruto a 'datos';
+    # el sobre JSON guarda dónde quedó cada uno y el resto de los valores.
+    if isinstance(obj, pd.DataFrame):
+        buf = io.BytesIO()
+        obj.to_parquet(buf, index=True)
+        inicio = len(datos)
+        datos += buf.getbuffer()
+        return {"parquet": [inicio, len(datos)]}
+    if isinstance(obj, tuple):
+        return {"tupla": [_empaquetar(o, datos) for o in obj]}
+    return {"json": obj}
+
+def _desempaquetar(sobre, datos):
+    if "parquet" in sobre:
+        inicio, fin = sobre["parquet"]
+        return pd.read_parquet(io.BytesIO(memoryview(datos)[inicio:fin]))
+    if "tupla" in sobre: return tuple(_desempaquetar(v, datos) for v in sobre["tupla"])
+    return sobre["json"]
+
+def cache_compartido(namespaces, ttl=None):
+    # Reemplazo de st.cache_data: la llave incluye la versión de cada namespace, así que
+    # invalidar_cache() en una réplica deja obsoleta la entrada para todas las demás.
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(*args):
+            backend = get_cache_backend()
+            versiones = backend.versiones(namespaces)
+            clave = hashlib.sha1(f"{func.__name__}|{namespaces}|{versiones}|{args!r}".encode()).hexdigest()
+            entrada = backend.leer(clave)
+            if entrada is not None:
+                try:
+                    return _desempaquetar(json.loads(entrada[0]), entrada[1])
+                except (ValueError, KeyError, OSError):
+                    pass  # entrada ilegible (p. ej. de una versión anterior): se recalcula
+            _lectura.primaria = leer_de_primaria(namespaces)
+            try:
+                resultado = func(*args)
+            finally:
+                _lectura.primaria = False
+            datos = bytearray()
+            try:
+                sobre = json.dumps(_empaquetar(resultado, datos))
+            except Exception:
+                return resultado  # no representable en Parquet/JSON: se sirve sin cachear
+            backend.guardar(clave, sobre, bytes(datos), ttl or config_cache()["ttl"])
+            return resultado
+        return envoltura
+    return decorador
+
+def invalidar_cache(*namespaces):
+    # Llamar después de cada escritura: 'viajes', 'gastos' o 'maestros' (clientes, rutas, flota, tarifas)
+    backend = get_cache_backend()
+    for namespace in namespaces:
+        backend.invalidar(namespace)
+
+# Tras una escritura la réplica puede venir atrasada. Si el loader que llena la caché leyera de ella,
+# el dato viejo quedaría guardado bajo la versión nueva para todos los procesos hasta el TTL. Durante
+# read_lag_s después de cada invalidar_cache esas lecturas van a la primaria (para todas las sesiones).
+_lectura = threading.local()
+
+def leer_de_primaria(namespaces):
+    if engine_lectura is engine: return False
+    return time.time() - get_cache_backend().ultima_escritura(namespaces) < RETRASO_REPLICA_S
+
+def motor_lectura():
+    # Engine que usan los loaders: la réplica, salvo que cache_compartido haya pedido la primaria
+    return engine if getattr(_lectura, "primaria", False) else engine_lectura
+
+# ==========================================
+# 5. FUNCIONES HELPER GLOBALES
 # ==========================================
 
-@st.cache_data(ttl=60)
+@cache_compartido(['maestros'], ttl=60)
 def load_maestros():
     try:
-        df_cli = pd.read_sql('SELECT id_cliente, nombre FROM "CLIENTE"', engine)
-        df_rut = pd.read_sql('SELECT id_ruta, origen, destino, km_estimados, tarifa_sugerida FROM "RUTAS"', engine)
-        df_con = pd.read_sql('SELECT id_conductor, nombre FROM "CONDUCTORES"', engine)
-        df_cam = pd.read_sql('SELECT id_camion, patente, marca FROM "CAMIONES"', engine)
-        df_tar = pd.read_sql('SELECT id_cliente, id_ruta, monto_pactado FROM "TARIFAS"', engine)
+        eng = motor_lectura()
+        df_cli = pd.read_sql('SELECT id_cliente, nombre FROM "CLIENTE"', eng)
+        df_rut = pd.read_sql('SELECT id_ruta, origen, destino, km_estimados, tarifa_sugerida FROM "RUTAS"', eng)
+        df_con = pd.read_sql('SELECT id_conductor, nombre FROM "CONDUCTORES"', eng)
+        df_cam = pd.read_sql('SELECT id_camion, patente, marca FROM "CAMIONES"', eng)
+        df_tar = pd.read_sql('SELECT id_cliente, id_ruta, monto_pactado FROM "TARIFAS"', eng)
         return df_cli, df_rut, df_con, df_cam, df_tar
     except Exception as e:
         st.error(f"Error cargando maestros: {e}")
@@ -214,8 +531,9 @@ def get_or_create_ruta(origen_abbr, destino_abbr):
         with engine.begin() as conn:
             sql_insert = text('INSERT INTO "RUTAS" (origen, destino, km_estimados, tarifa_sugerida) VALUES (:o, :d, :k, 0) RETURNING id_ruta')
             result = conn.execute(sql_insert, {"o": origen_abbr, "d": destino_abbr, "k": 0}).fetchone()
-            st.toast(f"Ruta creada: {origen_abbr} -> {destino_abbr}", icon="🆕")
-            return int(result[0]), True
+        invalidar_cache('maestros')
+        st.toast(f"Ruta creada: {origen_abbr} -> {destino_abbr}", icon="🆕")
+        return int(result[0]), True
     except Exception as e:
         st.error(f"Error ruta: {e}")
         return None, True
@@ -260,8 +578,185 @@ def parse_ids_para_borrar(texto_input):
             ids.add(int(parte))
     return sorted(list(ids))
 
+@cache_compartido(['viajes', 'gastos', 'maestros'])
+def load_movimientos():
+    with motor_lectura().connect() as conn:
+        df_ingresos = pd.read_sql(text("""
+            SELECT v.fecha, 'INGRESO' as tipo_movimiento,
+            c.nombre || ' - ' || r.origen || '->' || r.destino as detalle,
+            v.monto_neto as monto, v.estado
+            FROM "VIAJES" v
+            LEFT JOIN "CLIENTE" c ON v.id_cliente = c.id_cliente
+            LEFT JOIN "RUTAS" r ON v.id_ruta = r.id_ruta
+        """), conn)
+        df_egresos = pd.read_sql(text("""
+            SELECT fecha, 'EGRESO' as tipo_movimiento,
+            descripcion as detalle, monto, tipo_gasto, 'Pagado' as estado
+            FROM "GASTOS"
+        """), conn)
+
+    reporte = {"Ingresos": [bytes_df(df_ingresos)], "Egresos": [bytes_df(df_egresos)]}
+    df_ingresos = compactar_df(df_ingresos, categoricas=['tipo_movimiento', 'detalle', 'estado'])
+    df_egresos = compactar_df(df_egresos, categoricas=['tipo_movimiento', 'detalle', 'tipo_gasto', 'estado'])
+    reporte["Ingresos"].append(bytes_df(df_ingresos))
+    reporte["Egresos"].append(bytes_df(df_egresos))
+    return df_ingresos, df_egresos, reporte
+
+@cache_compartido(['viajes', 'maestros'])
+def load_historial():
+    df_viajes = pd.read_sql("""
+        SELECT 
+            v.id_viaje, v.fecha, c.nombre as cliente, r.origen, r.destino, 
+            v.monto_neto as tarifa, v.observaciones, v.estado
+        FROM "VIAJES" v
+        LEFT JOIN "CLIENTE" c ON v.id_cliente = c.id_cliente
+        LEFT JOIN "RUTAS" r ON v.id_ruta = r.id_ruta
+        ORDER BY v.id_viaje DESC
+    """, motor_lectura())
+    antes = bytes_df(df_viajes)
+    df_viajes = compactar_df(df_viajes, categoricas=['cliente', 'origen', 'destino', 'estado'])
+    return df_viajes, {"Historial": [antes, bytes_df(df_viajes)]}
+
+def tabla_reporte_memoria(reporte):
+    df = pd.DataFrame.from_dict(reporte, orient='index', columns=['Antes (KB)', 'Después (KB)'])
+    df.loc['Total'] = df.sum()
+    df['Ahorro %'] = (1 - df['Después (KB)'] / df['Antes (KB)'].where(df['Antes (KB)'] > 0)).fillna(0) * 100
+    df[['Antes (KB)', 'Después (KB)']] = df[['Antes (KB)', 'Después (KB)']] / 1024
+    return df
+
+def es_gasto_petroleo(df):
+    # Misma regla del Dashboard: gasto VARIABLE cuyo detalle menciona PETRÓLEO
+    return (df['tipo_gasto'] == 'VARIABLE') & (df['detalle'].str.contains('PETRÓLEO', case=False, na=False))
+
+def compactar_df(df, categoricas=(), fechas=('fecha',)):
+    # Fechas a datetime64, textos repetitivos a category y montos al entero/flotante más chico que los contiene
+    for col in fechas:
+        if col in df.columns: df[col] = pd.to_datetime(df[col])
+    for col in categoricas:
+        if col in df.columns and df[col].nunique(dropna=False) <= max(1, len(df) // 2):
+            df[col] = df[col].astype('category')
+    for col in df.columns:
+        if df[col].dtype == object and col not in categoricas and not df[col].dropna().empty:
+            # Solo los NUMERIC de Postgres, que llegan como Decimal (object); textos como "00123" quedan igual
+            if df[col].dropna().map(lambda v: isinstance(v, Decimal)).all(): df[col] = pd.to_numeric(df[col])
+        if pd.api.types.is_float_dtype(df[col]) and df[col].notna().all() and (df[col] % 1 == 0).all():
+            df[col] = df[col].astype('int64')
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+def bytes_df(df):
+    return int(df.memory_usage(deep=True).sum())
+
+def sql_mes(col, eng):
+    # Primer día del mes en SQL; SQLite solo se usa para pruebas locales
+    if eng.dialect.name == 'sqlite': return f"date({col}, 'start of month')"
+    return f"CAST(date_trunc('month', {col}) AS date)"
+
+@cache_compartido(['viajes', 'gastos', 'maestros'])
+def load_cubo_rentabilidad():
+    # Cubo cliente × ruta × mes agrupado en la BD; pandas solo clasifica los gastos (regla del petróleo).
+    eng = motor_lectura()
+    mes_v, mes_g = sql_mes('v.fecha', eng), sql_mes('fecha', eng)
+    with eng.connect() as conn:
+        cubo = pd.read_sql(text(f"""
+            SELECT {mes_v} as mes, v.id_cliente, c.nombre as cliente, v.id_ruta,
+            r.origen || '->' || r.destino as ruta,
+            COUNT(*) as viajes, SUM(v.monto_neto) as ingresos
+            FROM "VIAJES" v
+            LEFT JOIN "CLIENTE" c ON v.id_cliente = c.id_cliente
+            LEFT JOIN "RUTAS" r ON v.id_ruta = r.id_ruta
+            GROUP BY 1, v.id_cliente, c.nombre, v.id_ruta, r.origen, r.destino
+        """), conn)
+        df_g = pd.read_sql(text(f"""
+            SELECT {mes_g} as mes, tipo_gasto, descripcion as detalle, SUM(monto) as monto
+            FROM "GASTOS"
+            GROUP BY 1, tipo_gasto, descripcion
+        """), conn)
+
+    cubo['mes'] = pd.to_datetime(cubo['mes'])
+    cubo['cliente'] = cubo['cliente'].fillna('Sin cliente')
+    cubo['ruta'] = cubo['ruta'].fillna('Sin ruta')
+    cubo['ingresos'] = cubo['ingresos'].astype(float)
+
+    gastos_mes = pd.DataFrame({'mes': pd.Series(dtype='datetime64[ns]'), 'petroleo': pd.Series(dtype=float), 'otros': pd.Series(dtype=float)})
+    if not df_g.empty:
+        df_g['mes'] = pd.to_datetime(df_g['mes'])
+        df_g['monto'] = df_g['monto'].astype(float)
+        mask_pet = es_gasto_petroleo(df_g)
+        df_g['petroleo'] = df_g['monto'].where(mask_pet, 0.0)
+        df_g['otros'] = df_g['monto'].where(~mask_pet, 0.0)
+        gastos_mes = df_g.groupby('mes')[['petroleo', 'otros']].sum().reset_index()
+
+    return cubo, gastos_mes
+
+def asignar_costos_cubo(cubo, gastos_mes, pago_vuelta, costo_previred, iva_petroleo):
+    # Reparte los costos del mes según la participación de cada celda en los viajes del mes.
+    # Mismos parámetros que el Dashboard: chofer = vueltas * pago + Previred mensual, petróleo neto de IVA.
+    df = cubo.merge(gastos_mes, on='mes', how='left')
+    df[['petroleo', 'otros']] = df[['petroleo', 'otros']].fillna(0.0)
+    participacion = df['viajes'] / df.groupby('mes')['viajes'].transform('sum')
+
+    df['costo_chofer'] = df['viajes'] * pago_vuelta + costo_previred * participacion
+    df['costo_combustible'] = df['petroleo'] * (1 - iva_petroleo) * participacion
+    df['otros_gastos'] = df['otros'] * participacion
+    df['egresos'] = df['costo_chofer'] + df['costo_combustible'] + df['otros_gastos']
+    df['utilidad'] = df['ingresos'] - df['egresos']
+    return df.drop(columns=['petroleo', 'otros'])
+
+DIMENSIONES_CUBO = {
+    "Cliente": ['cliente'],
+    "Ruta": ['ruta'],
+    "Cliente × Ruta": ['cliente', 'ruta'],
+    "Mes": ['mes'],
+}
+
+def resumir_cubo(df, dimensiones):
+    metricas = ['viajes', 'ingresos', 'costo_chofer', 'costo_combustible', 'otros_gastos', 'egresos', 'utilidad']
+    res = df.groupby(dimensiones)[metricas].sum().reset_index()
+    res['margen'] = (res['utilidad'] / res['ingresos'].where(res['ingresos'] > 0)).fillna(0) * 100
+    return res.sort_values('utilidad')
+
+def totales_mensuales(df_in, mask_in, df_out, mask_out):
+    # Pre-agregado mensual del período filtrado: viajes, ingresos, petróleo bruto y otros gastos.
+    # Trabaja con las máscaras sobre los frames cargados, sin armar copias filtradas.
+    meses_in = df_in.loc[mask_in, 'fecha'].dt.to_period('M')
+    g_in = df_in.loc[mask_in, 'monto'].groupby(meses_in).agg(viajes='size', ingresos='sum')
+    mask_pet = es_gasto_petroleo(df_out)
+    meses_out = df_out.loc[mask_out, 'fecha'].dt.to_period('M')
+    g_out = pd.DataFrame({
+        'petroleo': df_out.loc[mask_out & mask_pet, 'monto'].groupby(meses_out).sum(),
+        'otros': df_out.loc[mask_out & ~mask_pet, 'monto'].groupby(meses_out).sum(),
+    })
+    return g_in.join(g_out, how='outer').fillna(0)
+
+def suma_mensual(df, mask):
+    # Suma de 'monto' por mes (fin de mes, como pd.Grouper(freq='M')) de las filas marcadas
+    return df.loc[mask, 'monto'].set_axis(df.loc[mask, 'fecha']).resample('M').sum().reset_index()
+
+def grilla_sensibilidad(totales, meses, pagos, previreds, ivas):
+    # Misma fórmula del Dashboard, evaluada por broadcasting sobre la grilla (pago × previred × iva)
+    ingresos, viajes, petroleo, otros = totales.reindex(columns=['ingresos', 'viajes', 'petroleo', 'otros']).fillna(0).to_numpy(dtype=float).sum(axis=0)
+    P = np.asarray(pagos, dtype=float)[:, None, None]
+    C = np.asarray(previreds, dtype=float)[None, :, None]
+    I = np.asarray(ivas, dtype=float)[None, None, :]
+
+    egresos = viajes * P + meses * C + petroleo * (1 - I) + otros
+    utilidad = ingresos - egresos
+    margen = utilidad / ingresos * 100 if ingresos > 0 else np.zeros_like(utilidad)
+    return utilidad, margen
+
+def estilo_oscuro(fig):
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(30, 41, 59, 1)', # Slate 800
+        font=dict(color="#94A3B8", family="Inter"),
+        margin=dict(t=20, l=20, r=20, b=20),
+    )
+    return fig
+
 # ==========================================
-# 5. MÓDULOS DE LA APP
+# 6. MÓDULOS DE LA APP
 # ==========================================
 
 # ==========================================
@@ -278,29 +773,9 @@ if menu == "Dashboard":
     </div>
     """, unsafe_allow_html=True)
 
-    # --- LÓGICA DE DATOS (MANTENIDA) ---
+    # --- LÓGICA DE DATOS (CACHEADA Y COMPACTA) ---
     try:
-        with engine.connect() as conn:
-            # Consultas SQL (Igual que antes)
-            df_ingresos = pd.read_sql(text("""
-                SELECT v.fecha, 'INGRESO' as tipo_movimiento,
-                c.nombre || ' - ' || r.origen || '->' || r.destino as detalle,
-                v.monto_neto as monto, v.estado
-                FROM "VIAJES" v
-                LEFT JOIN "CLIENTE" c ON v.id_cliente = c.id_cliente
-                LEFT JOIN "RUTAS" r ON v.id_ruta = r.id_ruta
-            """), conn)
-            
-            df_egresos = pd.read_sql(text("""
-                SELECT fecha, 'EGRESO' as tipo_movimiento,
-                descripcion as detalle, monto, tipo_gasto, 'Pagado' as estado
-                FROM "GASTOS"
-            """), conn)
-            
-            # Conversión de fechas
-            if not df_ingresos.empty: df_ingresos['fecha'] = pd.to_datetime(df_ingresos['fecha'])
-            if not df_egresos.empty: df_egresos['fecha'] = pd.to_datetime(df_egresos['fecha'])
-
+        df_ingresos, df_egresos, reporte_mem = load_movimientos()
     except Exception as e:
         st.error(f"Error BD: {e}")
         st.stop()
@@ -316,8 +791,7 @@ if menu == "Dashboard":
         """, unsafe_allow_html=True)
     
     # Lógica de fechas
-    todas_fechas = pd.concat([df_ingresos['fecha'], df_egresos['fecha']])
-    anios = sorted(todas_fechas.dt.year.unique(), reverse=True) if not todas_fechas.empty else [date.today().year]
+    anios = sorted(np.union1d(df_ingresos['fecha'].dt.year.unique(), df_egresos['fecha'].dt.year.unique()), reverse=True) or [date.today().year]
     
     filtro_anio = col_y.selectbox("Año", ["Todos"] + list(anios))
     
@@ -326,35 +800,35 @@ if menu == "Dashboard":
         meses = {1:"Enero", 2:"Febrero", 3:"Marzo", 4:"Abril", 5:"Mayo", 6:"Junio", 7:"Julio", 8:"Agosto", 9:"Septiembre", 10:"Octubre", 11:"Noviembre", 12:"Diciembre"}
         filtro_mes = col_m.selectbox("Mes", ["Todos"] + list(meses.values()))
 
-    # --- FILTRADO DE DATAFRAMES ---
-    df_in = df_ingresos.copy()
-    df_out = df_egresos.copy()
+    # --- FILTRADO (MÁSCARAS SOBRE LOS FRAMES CARGADOS, SIN COPIAS FILTRADAS) ---
+    mask_in = pd.Series(True, index=df_ingresos.index)
+    mask_out = pd.Series(True, index=df_egresos.index)
     
     if filtro_anio != "Todos":
-        df_in = df_in[df_in['fecha'].dt.year == filtro_anio]
-        df_out = df_out[df_out['fecha'].dt.year == filtro_anio]
+        mask_in &= df_ingresos['fecha'].dt.year == filtro_anio
+        mask_out &= df_egresos['fecha'].dt.year == filtro_anio
         if filtro_mes != "Todos":
             mes_idx = list(meses.keys())[list(meses.values()).index(filtro_mes)]
-            df_in = df_in[df_in['fecha'].dt.month == mes_idx]
-            df_out = df_out[df_out['fecha'].dt.month == mes_idx]
+            mask_in &= df_ingresos['fecha'].dt.month == mes_idx
+            mask_out &= df_egresos['fecha'].dt.month == mes_idx
 
     # --- CÁLCULOS MATEMÁTICOS (TU LÓGICA) ---
-    total_ingresos = df_in['monto'].sum() if not df_in.empty else 0
-    total_viajes = len(df_in)
+    total_viajes = int(mask_in.sum())
+    total_ingresos = df_ingresos.loc[mask_in, 'monto'].sum() if total_viajes else 0
     
     # Costo Chofer
     costo_var = total_viajes * PAGO_CHOFER_POR_VUELTA
-    meses_calc = 1 if (filtro_anio != "Todos" and filtro_mes != "Todos") else (pd.concat([df_in['fecha'], df_out['fecha']]).dt.to_period('M').nunique() if not df_in.empty else 0)
+    meses_calc = 1 if (filtro_anio != "Todos" and filtro_mes != "Todos") else (np.union1d(df_ingresos.loc[mask_in, 'fecha'].values.astype('datetime64[M]'), df_egresos.loc[mask_out, 'fecha'].values.astype('datetime64[M]')).size if total_viajes else 0)
     costo_fijo = COSTO_PREVIRED * meses_calc
     total_chofer = costo_var + costo_fijo
     
     # Combustible y Otros
     gasto_petroleo = 0
     otros = 0
-    if not df_out.empty:
-        mask_pet = (df_out['tipo_gasto'] == 'VARIABLE') & (df_out['detalle'].str.contains('PETRÓLEO', case=False, na=False))
-        gasto_petroleo = df_out[mask_pet]['monto'].sum()
-        otros = df_out[~mask_pet]['monto'].sum()
+    if mask_out.any():
+        mask_pet = es_gasto_petroleo(df_egresos)
+        gasto_petroleo = df_egresos.loc[mask_out & mask_pet, 'monto'].sum()
+        otros = df_egresos.loc[mask_out & ~mask_pet, 'monto'].sum()
         
     iva_recuperado = gasto_petroleo * IVA_PETROLEO
     petroleo_real = gasto_petroleo - iva_recuperado
@@ -424,18 +898,18 @@ if menu == "Dashboard":
     # 4. GRÁFICOS (ESTILO PLOTLY PARA FONDO OSCURO)
     st.markdown("<h3 style='margin-top: 30px; margin-bottom: 20px; color: #F8FAFC;'>📈 Análisis Gráfico</h3>", unsafe_allow_html=True)
     
-    tab_flow, tab_cost = st.tabs(["📊 Flujo de Caja", "🍩 Estructura de Costos"])
+    tab_flow, tab_cost, tab_whatif = st.tabs(["📊 Flujo de Caja", "🍩 Estructura de Costos", "🧪 What-if"])
 
     # --- GRÁFICO BARRAS ---
     with tab_flow:
         df_graph = pd.DataFrame()
-        if not df_in.empty:
-            g_in = df_in.groupby(pd.Grouper(key='fecha', freq='M'))['monto'].sum().reset_index()
+        if total_viajes:
+            g_in = suma_mensual(df_ingresos, mask_in)
             g_in['Tipo'] = 'Ingresos'
             df_graph = pd.concat([df_graph, g_in])
         
-        if not df_out.empty:
-            g_out = df_out.groupby(pd.Grouper(key='fecha', freq='M'))['monto'].sum().reset_index()
+        if mask_out.any():
+            g_out = suma_mensual(df_egresos, mask_out)
             # Sumamos costo fijo visualmente
             g_out['monto'] += COSTO_PREVIRED
             g_out['Tipo'] = 'Egresos'
@@ -496,21 +970,162 @@ if menu == "Dashboard":
         else:
             st.info("Sin costos registrados.")
 
+    # --- SIMULADOR WHAT-IF (GRILLA DE PARÁMETROS) ---
+    with tab_whatif:
+        st.caption("Evalúa de una vez todas las combinaciones de parámetros sobre el período filtrado. No consulta la base de datos.")
+        totales = totales_mensuales(df_ingresos, mask_in, df_egresos, mask_out)
+
+        cw1, cw2, cw3 = st.columns(3)
+        with cw1:
+            st.markdown("**Pago Chofer por Vuelta ($)**")
+            pago_min = st.number_input("Desde", value=max(0, PAGO_CHOFER_POR_VUELTA - 5000), step=1000, key="wi_pago_min")
+            pago_max = st.number_input("Hasta", value=PAGO_CHOFER_POR_VUELTA + 10000, step=1000, key="wi_pago_max")
+            pago_n = st.number_input("Pasos", 2, 200, 31, key="wi_pago_n")
+        with cw2:
+            st.markdown("**Costo Previred Mensual ($)**")
+            prev_min = st.number_input("Desde", value=max(0, COSTO_PREVIRED - 30000), step=1000, key="wi_prev_min")
+            prev_max = st.number_input("Hasta", value=COSTO_PREVIRED + 30000, step=1000, key="wi_prev_max")
+            prev_n = st.number_input("Pasos", 2, 200, 31, key="wi_prev_n")
+        with cw3:
+            st.markdown("**% Recuperación IVA Petróleo**")
+            iva_min = st.number_input("Desde", 0, 100, 0, key="wi_iva_min")
+            iva_max = st.number_input("Hasta", 0, 100, 19, key="wi_iva_max")
+            iva_n = st.number_input("Pasos", 2, 101, 20, key="wi_iva_n")
+
+        pagos = np.linspace(pago_min, pago_max, int(pago_n))
+        previreds = np.linspace(prev_min, prev_max, int(prev_n))
+        ivas = np.linspace(iva_min, iva_max, int(iva_n)) / 100
+
+        t0 = time.perf_counter()
+        grid_util, grid_margen = grilla_sensibilidad(totales, meses_calc, pagos, previreds, ivas)
+        ms = (time.perf_counter() - t0) * 1000
+        st.caption(f"⚡ {grid_util.size:,} escenarios evaluados en {ms:.1f} ms · {(grid_util < 0).mean() * 100:.1f}% con pérdida")
+
+        cs1, cs2 = st.columns([2, 1])
+        iva_sel = cs1.select_slider("IVA recuperado (%)", options=[round(i * 100, 1) for i in ivas], value=round(ivas[-1] * 100, 1), key="wi_iva_sel")
+        metrica = cs2.radio("Métrica", ["Utilidad", "Margen"], horizontal=True, key="wi_metrica")
+        k = int(np.argmin(np.abs(ivas * 100 - iva_sel)))
+        z = grid_util[:, :, k] if metrica == "Utilidad" else grid_margen[:, :, k]
+
+        fig_heat = px.imshow(
+            z, x=previreds, y=pagos, origin="lower", aspect="auto",
+            color_continuous_scale="RdYlGn", color_continuous_midpoint=0,
+            labels=dict(x="Previred Mensual ($)", y="Pago por Vuelta ($)", color="Utilidad ($)" if metrica == "Utilidad" else "Margen (%)")
+        )
+        estilo_oscuro(fig_heat)
+        st.plotly_chart(fig_heat, use_container_width=True)
+
+    with st.expander("🧠 Memoria de datos por sesión", expanded=False):
+        st.caption("Bytes de los DataFrames del Dashboard tal como llegan de la BD (antes) y con tipos compactos (después).")
+        st.dataframe(tabla_reporte_memoria(reporte_mem).style.format({'Antes (KB)': '{:,.1f}', 'Después (KB)': '{:,.1f}', 'Ahorro %': '{:.1f}%'}), use_container_width=True)
+
+# ==========================================
+# SECCIÓN RENTABILIDAD (CUBO CLIENTE × RUTA × MES)
+# ==========================================
+elif menu == "Rentabilidad":
+    st.markdown("""
+    <div style="margin-bottom: 20px;">
+        <h1 style="display: flex; align-items: center; gap: 10px; font-size: 26px;">
+            <span style="font-size: 32px;">💹</span> Rentabilidad por Cliente y Ruta
+        </h1>
+    </div>
+    """, unsafe_allow_html=True)
+
+    try:
+        cubo, gastos_mes = load_cubo_rentabilidad()
+    except Exception as e:
+        st.error(f"Error BD: {e}")
+        st.stop()
+
+    if cubo.empty:
+        st.info("Sin viajes registrados para analizar.")
+        st.stop()
+
+    # Solo la asignación depende de los parámetros del sidebar: es vectorizada y no vuelve a la BD
+    df_cubo = asignar_costos_cubo(cubo, gastos_mes, PAGO_CHOFER_POR_VUELTA, COSTO_PREVIRED, IVA_PETROLEO)
+
+    col_y, col_cli, col_dim = st.columns([1, 2, 1])
+    anios = sorted(df_cubo['mes'].dt.year.unique(), reverse=True)
+    filtro_anio = col_y.selectbox("Año", ["Todos"] + list(anios), key="rent_anio")
+    clientes_sel = col_cli.multiselect("Clientes", sorted(df_cubo['cliente'].unique()), key="rent_cli", placeholder="Todos")
+    dimension = col_dim.selectbox("Agrupar por", list(DIMENSIONES_CUBO.keys()), key="rent_dim")
+
+    mask = pd.Series(True, index=df_cubo.index)
+    if filtro_anio != "Todos":
+        mask &= df_cubo['mes'].dt.year == filtro_anio
+    if clientes_sel:
+        mask &= df_cubo['cliente'].isin(clientes_sel)
+    df_sel = df_cubo[mask]
+
+    if df_sel.empty:
+        st.info("Sin datos para los filtros elegidos.")
+        st.stop()
+
+    k1, k2, k3, k4 = st.columns(4)
+    k1.metric("Ingresos", f"${df_sel['ingresos'].sum():,.0f}")
+    k2.metric("Egresos Asignados", f"${df_sel['egresos'].sum():,.0f}")
+    k3.metric("Utilidad", f"${df_sel['utilidad'].sum():,.0f}")
+    k4.metric("Viajes", f"{int(df_sel['viajes'].sum())}")
+
+    # Gastos de meses sin viajes no tienen a quién asignarse
+    meses_sin_viajes = gastos_mes[~gastos_mes['mes'].isin(cubo['mes'])]
+    if filtro_anio != "Todos":
+        meses_sin_viajes = meses_sin_viajes[meses_sin_viajes['mes'].dt.year == filtro_anio]
+    if not meses_sin_viajes.empty and not clientes_sel:
+        sin_asignar = (meses_sin_viajes['petroleo'] * (1 - IVA_PETROLEO) + meses_sin_viajes['otros']).sum()
+        st.caption(f"⚠️ ${sin_asignar:,.0f} en gastos de meses sin viajes quedan sin asignar.")
+
+    st.markdown("---")
+    dims = DIMENSIONES_CUBO[dimension]
+    resumen = resumir_cubo(df_sel, dims)
+    if dims == ['mes']:
+        resumen = resumen.sort_values('mes')
+        resumen['mes'] = resumen['mes'].dt.strftime('%Y-%m')
+    resumen['etiqueta'] = resumen[dims].astype(str).agg(' | '.join, axis=1)
+
+    tab_tabla, tab_graf = st.tabs(["📋 Tabla", "📊 Utilidad"])
+    with tab_tabla:
+        st.dataframe(
+            resumen.drop(columns=['etiqueta']).style.format({
+                'ingresos': '${:,.0f}', 'costo_chofer': '${:,.0f}', 'costo_combustible': '${:,.0f}',
+                'otros_gastos': '${:,.0f}', 'egresos': '${:,.0f}', 'utilidad': '${:,.0f}', 'margen': '{:.1f}%'
+            }),
+            use_container_width=True, hide_index=True
+        )
+    with tab_graf:
+        df_bar = resumen.tail(30) if dims != ['mes'] else resumen
+        df_bar = df_bar.assign(Resultado=df_bar['utilidad'].gt(0).map({True: 'Gana', False: 'Pierde'}))
+        fig = px.bar(df_bar, x='utilidad', y='etiqueta', orientation='h', color='Resultado',
+                     color_discrete_map={'Gana': '#2dd4bf', 'Pierde': '#fb7185'},
+                     hover_data={'ingresos': ':,.0f', 'egresos': ':,.0f', 'margen': ':.1f'})
+        estilo_oscuro(fig).update_layout(
+            height=max(300, 28 * len(df_bar)),
+            legend=dict(title=None, orientation="h", y=1.02, x=1),
+            xaxis=dict(showgrid=True, gridcolor="#334155", title=None),
+            yaxis=dict(showgrid=False, title=None)
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+    # --- DRILL-DOWN: CLIENTE -> RUTAS POR MES ---
+    st.markdown("<h3 style='margin-top: 30px; color: #F8FAFC;'>🔎 Detalle por Cliente</h3>", unsafe_allow_html=True)
+    cliente_drill = st.selectbox("Cliente", sorted(df_sel['cliente'].unique()), key="rent_drill")
+    df_drill = df_sel[df_sel['cliente'] == cliente_drill]
+
+    metrica_drill = st.radio("Métrica", ["utilidad", "ingresos", "viajes"], horizontal=True, key="rent_metrica")
+    pivot = df_drill.pivot_table(index='ruta', columns='mes', values=metrica_drill, aggfunc='sum', fill_value=0)
+    pivot.columns = pivot.columns.strftime('%Y-%m')
+    pivot['Total'] = pivot.sum(axis=1)
+    fmt = '{:,.0f}' if metrica_drill == 'viajes' else '${:,.0f}'
+    st.dataframe(pivot.sort_values('Total').style.format(fmt), use_container_width=True)
+
 # --- HISTORIAL DE VIAJES ---
 elif menu == "Historial de Viajes":
     st.header("🗂️ Administrador de Viajes (Ingresos)")
     try:
-        sql_full = """
-            SELECT 
-                v.id_viaje, v.fecha, c.nombre as cliente, r.origen, r.destino, 
-                v.monto_neto as tarifa, v.observaciones, v.estado
-            FROM "VIAJES" v
-            LEFT JOIN "CLIENTE" c ON v.id_cliente = c.id_cliente
-            LEFT JOIN "RUTAS" r ON v.id_ruta = r.id_ruta
-            ORDER BY v.id_viaje DESC
-        """
-        df_viajes = pd.read_sql(sql_full, engine)
+        df_viajes, reporte_mem = load_historial()
         st.dataframe(df_viajes, use_container_width=True)
+        with st.expander("🧠 Memoria de datos por sesión", expanded=False):
+            st.dataframe(tabla_reporte_memoria(reporte_mem).style.format({'Antes (KB)': '{:,.1f}', 'Después (KB)': '{:,.1f}', 'Ahorro %': '{:.1f}%'}), use_container_width=True)
         
         st.markdown("---")
         st.subheader("🗑️ Eliminación Masiva de Viajes")
@@ -527,6 +1142,7 @@ elif menu == "Historial de Viajes":
                         ids_tuple = f"({ids_a_borrar[0]})" if len(ids_a_borrar) == 1 else str(tuple(ids_a_borrar))
                         result = conn.execute(text(f'DELETE FROM "VIAJES" WHERE id_viaje IN {ids_tuple}'))
                         rows_deleted = result.rowcount
+                    invalidar_cache('viajes')
                     if rows_deleted > 0:
                         st.success(f"✅ {rows_deleted} viajes eliminados.")
                         time.sleep(1.5)
@@ -636,6 +1252,7 @@ elif menu == "Subir Archivos":
                                     conn.execute(sql, {"f": v['fecha'], "c": int(v['id_cliente']), "r": int(v['id_ruta']), "m": float(v['monto']), "o": str(v['observaciones'])})
                                     count += 1
                                 except Exception as row_error: st.error(f"Error: {row_error}")
+                        invalidar_cache('viajes')
                         if count > 0: st.success(f"¡Éxito! {count} viajes importados.")
                         if skip_count > 0: st.warning(f"Se omitieron {skip_count} duplicados.")
                         time.sleep(2)
@@ -716,6 +1333,7 @@ elif menu == "Subir Archivos":
                                     count += 1
                                 except Exception as row_error: st.error(f"Error fila {count+1}: {row_error}")
                         
+                        invalidar_cache('gastos')
                         if count > 0:
                             st.success(f"¡Listo! {count} gastos registrados correctamente.")
                             time.sleep(2)
@@ -746,6 +1364,7 @@ elif menu == "Gestión de Flota":
                     try:
                         with engine.begin() as conn:
                             conn.execute(text("INSERT INTO \"CAMIONES\" (patente, marca, modelo, \"año\", rendimiento_esperado) VALUES (:p, :m, :mo, :a, :r)"), {"p": pat, "m": marca, "mo": mod, "a": ani, "r": rend})
+                        invalidar_cache('maestros')
                         st.success("Guardado")
                         time.sleep(1)
                         st.rerun()
@@ -761,6 +1380,7 @@ elif menu == "Gestión de Flota":
                     try:
                         with engine.begin() as conn:
                             conn.execute(text("DELETE FROM \"CAMIONES\" WHERE id_camion=:id"), {"id": id_sel})
+                        invalidar_cache('maestros')
                         st.success("Eliminado")
                         time.sleep(1)
                         st.rerun()
@@ -779,6 +1399,7 @@ elif menu == "Conductores":
             if st.form_submit_button("Guardar"):
                 with engine.begin() as conn:
                     conn.execute(text("INSERT INTO \"CONDUCTORES\" (nombre, rut, licencia, activo) VALUES (:n, :r, :l, true)"), {"n": nom, "r": rut, "l": lic})
+                invalidar_cache('maestros')
                 st.success("Guardado")
                 time.sleep(1)
                 st.rerun()
@@ -795,6 +1416,7 @@ elif menu == "Conductores":
                 if st.button("💾 Guardar"):
                     with engine.begin() as conn:
                         conn.execute(text("UPDATE \"CONDUCTORES\" SET nombre=:n, activo=:a WHERE id_conductor=:id"), {"n": n_nom, "a": n_act, "id": id_sel})
+                    invalidar_cache('maestros')
                     st.toast("Actualizado")
                     time.sleep(1)
                     st.rerun()
@@ -802,6 +1424,7 @@ elif menu == "Conductores":
                     try:
                         with engine.begin() as conn:
                             conn.execute(text("DELETE FROM \"CONDUCTORES\" WHERE id_conductor=:id"), {"id": id_sel})
+                        invalidar_cache('maestros')
                         st.success("Eliminado")
                         time.sleep(1)
                         st.rerun()
@@ -821,6 +1444,7 @@ elif menu == "Clientes":
             if st.form_submit_button("Guardar Cliente"):
                 with engine.begin() as conn:
                     conn.execute(text("INSERT INTO \"CLIENTE\" (nombre, rut_empresa, contacto) VALUES (:n, :r, :c)"), {"n": nom, "r": rut, "c": con})
+                invalidar_cache('maestros')
                 st.success("Guardado")
                 time.sleep(1)
                 st.rerun()
@@ -835,6 +1459,7 @@ elif menu == "Clientes":
                     try:
                         with engine.begin() as conn:
                             conn.execute(text("DELETE FROM \"CLIENTE\" WHERE id_cliente=:id"), {"id": id_sel})
+                        invalidar_cache('maestros')
                         st.success("Eliminado")
                         time.sleep(1)
                         st.rerun()
@@ -855,6 +1480,7 @@ elif menu == "Rutas":
             if st.form_submit_button("Crear Ruta"):
                 with engine.begin() as conn:
                     conn.execute(text("INSERT INTO \"RUTAS\" (origen, destino, km_estimados, tarifa_sugerida) VALUES (:o, :d, :k, :t)"), {"o": ori, "d": des, "k": km, "t": tar})
+                invalidar_cache('maestros')
                 st.success("Ruta creada")
                 time.sleep(1)
                 st.rerun()
@@ -873,12 +1499,14 @@ elif menu == "Rutas":
             if st.button("Actualizar"):
                 with engine.begin() as conn:
                     conn.execute(text("UPDATE \"RUTAS\" SET origen=:o, destino=:d, km_estimados=:k, tarifa_sugerida=:t WHERE id_ruta=:id"), {"o": n_ori, "d": n_des, "k": n_km, "t": n_tar, "id": id_sel})
+                invalidar_cache('maestros')
                 st.toast("Actualizado")
                 time.sleep(1)
                 st.rerun()
             if st.button("Eliminar Ruta"):
                 with engine.begin() as conn:
                     conn.execute(text("DELETE FROM \"RUTAS\" WHERE id_ruta=:id"), {"id": id_sel})
+                invalidar_cache('maestros')
                 st.rerun()
         st.dataframe(df_rutas, use_container_width=True)
 
@@ -897,6 +1525,7 @@ elif menu == "Tarifarios":
                 with engine.begin() as conn:
                     sql = text("INSERT INTO \"TARIFAS\" (id_cliente, id_ruta, monto_pactado) VALUES (:c, :r, :m) ON CONFLICT (id_cliente, id_ruta) DO UPDATE SET monto_pactado = EXCLUDED.monto_pactado")
                     conn.execute(sql, {"c": cli_id, "r": rut_id, "m": precio})
+                invalidar_cache('maestros')
                 st.success("Tarifa guardada")
             except Exception as e: st.error(f"Error: {e}")
     st.dataframe(pd.read_sql('SELECT * FROM "TARIFAS"', engine), use_container_width=True)
\ No newline at end of file
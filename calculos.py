@@ -0,0 +1,270 @@
+# Cálculos de erp.py que no tocan Streamlit ni la base de datos: se importan desde la app y desde tests/.
+import difflib
+import heapq
+import unicodedata
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from dominio import UNIDADES_MEDIDA, factor_unidad
+
+# --- CONVERSIÓN DE UNIDADES ---
+# Unidad -> (dimensión, factor a la unidad mínima de su dimensión)
+UNIDADES = {u: (d, f) for u, (d, f) in UNIDADES_MEDIDA.items() if d != 'cuchara'}
+# Cucharas: valen lo mismo en gr que en ml (densidad ~1), solo tienen sentido en recetas
+CUCHARAS = {u: f for u, (d, f) in UNIDADES_MEDIDA.items() if d == 'cuchara'}
+
+LISTA_UNIDADES = list(UNIDADES) + list(CUCHARAS)
+_IDX_UNIDAD = {u: i for i, u in enumerate(LISTA_UNIDADES)}
+
+def _matriz_factores():
+    """FACTORES[i, j] multiplica una cantidad en la unidad i para llevarla a la j; NaN si no son compatibles."""
+    n = len(LISTA_UNIDADES)
+    m = np.full((n + 1, n + 1), np.nan)  # la última fila/columna es para unidades desconocidas
+    for a in LISTA_UNIDADES:
+        for b in LISTA_UNIDADES:
+            factor = factor_unidad(a, b)
+            if factor is not None: m[_IDX_UNIDAD[a], _IDX_UNIDAD[b]] = factor
+    return m
+
+FACTORES = _matriz_factores()
+
+def convertir(cantidad, desde, hacia):
+    """Convierte escalares o arrays (cantidad, desde, hacia) en una sola operación.
+    Pares incompatibles o desconocidos: None si es escalar, NaN si es array."""
+    desde_a, hacia_a = np.asarray(desde, dtype=object), np.asarray(hacia, dtype=object)
+    desconocida = len(LISTA_UNIDADES)
+    i = np.vectorize(lambda u: _IDX_UNIDAD.get(u, desconocida), otypes=[int])(desde_a)
+    j = np.vectorize(lambda u: _IDX_UNIDAD.get(u, desconocida), otypes=[int])(hacia_a)
+    # Misma unidad (aunque no esté en la tabla) siempre vale 1
+    factor = np.where(desde_a == hacia_a, 1.0, FACTORES[i, j])
+    res = np.asarray(cantidad, dtype=float) * factor
+    if np.ndim(res) == 0:
+        return None if np.isnan(res) else float(res)
+    return res
+
+def opciones_unidad(u_base, receta=False):
+    """Unidades válidas para ingresar un insumo medido en u_base (la base primero; en recetas, la más chica primero)."""
+    if u_base not in UNIDADES: return [u_base]
+    dim = UNIDADES[u_base][0]
+    mismas = sorted([u for u, (d, _) in UNIDADES.items() if d == dim], key=lambda u: UNIDADES[u][1])
+    if receta:
+        return mismas + (list(CUCHARAS) if dim in ('masa', 'volumen') else [])
+    return [u_base] + [u for u in mismas if u != u_base]
+
+def costear_ingredientes(ingredientes, mapa_insumos):
+    """Costo actual de cada línea de receta (array), convirtiendo todas las cantidades en una sola llamada."""
+    if not ingredientes: return np.zeros(0)
+    datos = [mapa_insumos.get(ing['nombre']) for ing in ingredientes]
+    cant = convertir([ing['cantidad'] for ing in ingredientes],
+                     [ing.get('unidad') for ing in ingredientes],
+                     [d['unidad_medida'] if d else None for d in datos])
+    costo_u = np.array([d['costo_unitario'] if d else np.nan for d in datos], dtype=float)
+    costos = cant * costo_u
+    # Insumos borrados o sin conversión: se mantiene el costo guardado en la receta
+    guardado = np.array([ing.get('costo', 0) for ing in ingredientes], dtype=float)
+    return np.where(np.isnan(costos), guardado, costos)
+
+# --- PROGRAMACIÓN DEL HORNO ---
+TIEMPOS_DEFECTO = (30, 45)  # (preparación, horno) en minutos por unidad
+
+def programar_horno(pedidos, tiempos, capacidad, ahora, inicio_jornada=7):
+    """Plan de horneado: unidades por hora comprometida (EDF) a la bandeja que se libera primero (montículo).
+    Cada línea del pedido ('items') usa los tiempos de su variación. Devuelve un DataFrame por pedido con inicio,
+    fin, hora límite y si llega a tiempo."""
+    trabajos = []
+    limites = {}
+    for p in pedidos:
+        if p['estado'] not in ('Pendiente', 'En Horno'): continue
+        hora = str(p.get('hora_entrega') or '23:59:00')[:8]
+        limite = datetime.fromisoformat(f"{p['fecha_entrega']}T{hora}")
+        # Apertura: se hornea el día de la entrega, no antes de abrir la cocina ni antes de ahora
+        apertura = max(ahora, datetime.combine(limite.date(), datetime.min.time()) + timedelta(hours=inicio_jornada))
+        limites[p['id']] = limite
+        # Pedidos sin ítems (anteriores a pedido_items): una sola línea con la cabecera
+        for linea in p.get('items') or [{"variacion_id": p.get('variacion_id'), "cantidad": p.get('cantidad')}]:
+            prep, horno = tiempos.get(linea.get('variacion_id'), TIEMPOS_DEFECTO)
+            listo = ahora if p['estado'] == 'En Horno' else apertura + timedelta(minutes=prep)  # En Horno: ya está preparado
+            for _ in range(int(np.ceil(float(linea.get('cantidad') or 1)))):
+                trabajos.append((p['estado'] != 'En Horno', limite, listo, p['id'], horno))
+    if not trabajos: return pd.DataFrame()
+
+    trabajos.sort(key=lambda t: t[:4])
+    bandejas = [ahora] * max(int(capacidad), 1)
+    inicio, fin = {}, {}
+    for _, limite, listo, pid, horno in trabajos:
+        libre = heapq.heappop(bandejas)
+        empieza = max(libre, listo)
+        termina = empieza + timedelta(minutes=horno)
+        heapq.heappush(bandejas, termina)
+        inicio[pid] = min(inicio.get(pid, empieza), empieza)
+        fin[pid] = max(fin.get(pid, termina), termina)
+
+    plan = pd.DataFrame({"id": list(inicio), "inicio": list(inicio.values()), "fin": [fin[i] for i in inicio]})
+    plan['limite'] = plan['id'].map(limites)
+    plan['holgura_min'] = (plan['limite'] - plan['fin']).dt.total_seconds() / 60
+    plan['a_tiempo'] = plan['holgura_min'] >= 0
+    return plan.sort_values(['inicio', 'limite']).reset_index(drop=True)
+
+# --- ARMADO E IMPORTACIÓN DE PEDIDOS ---
+def armar_pedido(cliente, contacto, fecha, hora, notas, lineas):
+    """Pedido listo para crear_pedidos a partir de sus líneas [{variacion_id, producto, cantidad, precio_unitario}]."""
+    # Variación, cantidad y precio de la cabecera solo valen para pedidos de una línea; el detalle va en 'items'
+    una = lineas[0] if len(lineas) == 1 else {}
+    return {
+        "cliente_nombre": cliente,
+        "cliente_contacto": contacto,
+        "fecha_entrega": fecha,
+        "hora_entrega": hora,
+        "variacion_id": una.get('variacion_id'),
+        "nombre_producto_snapshot": lineas[0]['producto'] if len(lineas) == 1 else " + ".join(f"{l['producto']} x{l['cantidad']}" for l in lineas),
+        "cantidad": una.get('cantidad'),
+        "precio_unitario_final": una.get('precio_unitario'),
+        "total_pedido": float(sum(l['cantidad'] * l['precio_unitario'] for l in lineas)),
+        "estado": "Pendiente",
+        "notas": notas,
+        "items": lineas,
+    }
+
+COLUMNAS_IMPORTACION = ['PEDIDO', 'CLIENTE', 'CONTACTO', 'FECHA_ENTREGA', 'HORA', 'PRODUCTO', 'CANTIDAD', 'PRECIO', 'NOTAS']
+
+def preparar_importacion(df, indice):
+    """Valida todas las líneas contra el catálogo en una pasada y las agrupa en pedidos.
+    Devuelve (pedidos, lineas, errores); con errores no se importa nada."""
+    df = df.copy()
+    df.columns = df.columns.astype(str).str.strip().str.upper().str.replace(' ', '_')
+    faltan = [c for c in ('CLIENTE', 'FECHA_ENTREGA', 'PRODUCTO', 'CANTIDAD') if c not in df.columns]
+    if faltan: raise ValueError(f"Faltan columnas: {', '.join(faltan)}")
+    for c in COLUMNAS_IMPORTACION:
+        if c not in df.columns: df[c] = None
+    df['fila'] = np.arange(len(df)) + 2  # fila en el archivo (la 1 es el encabezado)
+    df = df.dropna(how='all', subset=COLUMNAS_IMPORTACION).reset_index(drop=True)
+
+    texto = lambda c: df[c].fillna('').astype(str).str.strip()
+    df['cliente'], df['producto'] = texto('CLIENTE'), texto('PRODUCTO')
+    df['fecha'] = pd.to_datetime(df['FECHA_ENTREGA'], errors='coerce', dayfirst=True)
+    df['cantidad'] = pd.to_numeric(df['CANTIDAD'], errors='coerce')
+    hora = pd.to_datetime(df['HORA'].astype(str), format='mixed', errors='coerce')
+    df['hora'] = hora.dt.strftime('%H:%M:%S').where(hora.notna(), None)
+
+    # Catálogo como tabla: "Base - Variación" (sin distinguir mayúsculas) -> variación y precio
+    productos = indice['productos_por_id']
+    catalogo = pd.DataFrame([
+        {"clave": f"{productos[v['producto_id']]['nombre']} - {v['nombre']}".casefold(), "variacion_id": v['id'],
+         "producto_catalogo": f"{productos[v['producto_id']]['nombre']} - {v['nombre']}", "precio_catalogo": float(v['precio'] or 0)}
+        for v in indice['variaciones'].values() if v['producto_id'] in productos
+    ], columns=['clave', 'variacion_id', 'producto_catalogo', 'precio_catalogo'])
+    df['clave'] = df['producto'].str.casefold()
+    df = df.merge(catalogo.drop_duplicates('clave'), on='clave', how='left')
+    df['precio'] = pd.to_numeric(df['PRECIO'], errors='coerce').fillna(df['precio_catalogo'])
+
+    df['error'] = np.select([
+        df['cliente'] == '',
+        df['fecha'].isna(),
+        df['HORA'].notna() & df['hora'].isna(),
+        df['variacion_id'].isna(),
+        ~(df['cantidad'] > 0) | (df['cantidad'] % 1 != 0),
+        df['precio'] < 0,
+    ], ["Falta el cliente", "Fecha inválida", "Hora inválida", "El producto no está en el catálogo", "Cantidad inválida", "Precio inválido"], default='')
+    errores = df.loc[df['error'] != '', ['fila', 'producto', 'error']]
+    if not errores.empty or df.empty:
+        return [], pd.DataFrame(), errores
+
+    # Una misma columna PEDIDO agrupa líneas; sin ella, se agrupa por cliente, fecha y hora
+    df['clave_pedido'] = df['PEDIDO'].astype(str).where(df['PEDIDO'].notna(),
+                                                        df['cliente'] + '|' + df['fecha'].dt.strftime('%Y-%m-%d') + '|' + df['hora'].fillna(''))
+    items = [{"variacion_id": int(v), "producto": n, "cantidad": int(c), "precio_unitario": float(pr)}
+             for v, n, c, pr in zip(df['variacion_id'], df['producto_catalogo'], df['cantidad'], df['precio'])]
+    grupos = df.groupby('clave_pedido', sort=False)
+    # Datos del pedido: el primer valor informado de cada columna dentro del grupo
+    cab = grupos.agg(cliente=('cliente', 'first'), fecha=('fecha', 'first'), hora=('hora', 'first'), contacto=('CONTACTO', 'first'))
+    notas = df.dropna(subset=['NOTAS']).drop_duplicates(['clave_pedido', 'NOTAS']).groupby('clave_pedido')['NOTAS'].agg(" | ".join)
+    pedidos = [armar_pedido(c.cliente, c.contacto if pd.notna(c.contacto) else "", c.fecha.strftime('%Y-%m-%d'), c.hora,
+                            notas.get(clave, ""), [items[i] for i in grupos.indices[clave]])
+               for clave, c in zip(cab.index, cab.itertuples())]
+    lineas = pd.DataFrame({"fecha_entrega": df['fecha'].dt.strftime('%Y-%m-%d'), "variacion_id": df['variacion_id'].astype(int), "cantidad": df['cantidad']})
+    return pedidos, lineas, errores
+
+# --- IMPORTACIÓN DE FACTURAS ---
+# Cómo vienen escritas las unidades en boletas y facturas
+ALIAS_UNIDADES = {
+    'g': 'gr', 'grs': 'gr', 'gramo': 'gr', 'gramos': 'gr',
+    'kgs': 'kg', 'kilo': 'kg', 'kilos': 'kg',
+    'l': 'lt', 'lts': 'lt', 'litro': 'lt', 'litros': 'lt', 'mls': 'ml',
+    'u': 'unidades', 'un': 'unidades', 'und': 'unidades', 'uni': 'unidades', 'unidad': 'unidades', 'c/u': 'unidades',
+}
+COLUMNAS_FACTURA = {'ITEM': ('PRODUCTO', 'DESCRIPCION', 'DETALLE', 'INSUMO'), 'CANTIDAD': ('CANT',), 'UNIDAD': ('UM', 'U_MEDIDA'), 'TOTAL': ('MONTO', 'VALOR', 'PRECIO')}
+
+def normalizar_texto(texto):
+    """Minúsculas, sin tildes ni espacios de más."""
+    sin_tildes = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode()
+    return " ".join(sin_tildes.casefold().split())
+
+def emparejar_insumos(items, nombres, corte=0.6):
+    """Insumo más parecido a cada texto de la factura: {item: (nombre o None, similitud 0-1)}.
+    Cuenta como coincidencia si todas las palabras del insumo aparecen en el texto ("HARINA SELECTA 1KG" -> Harina)."""
+    claves = {normalizar_texto(n): n for n in nombres}
+    palabras = {k: set(k.split()) for k in claves}
+    resultado = {}
+    for item in set(items):
+        k = normalizar_texto(item)
+        if k in claves:
+            resultado[item] = (claves[k], 1.0)
+            continue
+        en_item, comparador = set(k.split()), difflib.SequenceMatcher(b=k, autojunk=False)
+        mejor, puntaje = None, 0.0
+        for clave, nombre in claves.items():
+            comparador.set_seq1(clave)
+            p = comparador.ratio()
+            if palabras[clave] <= en_item: p = max(p, 0.75 + 0.25 * len(clave) / max(len(k), 1))
+            if p > puntaje: mejor, puntaje = nombre, p
+        resultado[item] = (mejor, round(puntaje, 2)) if puntaje >= corte else (None, round(puntaje, 2))
+    return resultado
+
+def preparar_factura(df, insumos):
+    """Lee una factura (ITEM, CANTIDAD, UNIDAD, TOTAL) y sugiere el insumo de cada línea. Devuelve la tabla para revisar."""
+    df = df.copy()
+    df.columns = df.columns.astype(str).map(normalizar_texto).str.upper().str.replace(' ', '_')
+    for col, alias in COLUMNAS_FACTURA.items():
+        if col not in df.columns:
+            df = df.rename(columns={next((a for a in alias if a in df.columns), col): col})
+    faltan = [c for c in ('ITEM', 'CANTIDAD', 'TOTAL') if c not in df.columns]
+    if faltan: raise ValueError(f"Faltan columnas: {', '.join(faltan)}")
+    if 'UNIDAD' not in df.columns: df['UNIDAD'] = None
+    df['fila'] = np.arange(len(df)) + 2
+    df = df.dropna(how='all', subset=['ITEM', 'CANTIDAD', 'TOTAL']).reset_index(drop=True)
+
+    # Montos y cantidades en formato chileno ("1.290", "2,5") o numérico
+    numero = lambda c: pd.to_numeric(df[c].astype(str).str.replace(r'[$\s]', '', regex=True)
+                                     .str.replace(r'\.(?=\d{3}(\D|$))', '', regex=True).str.replace(',', '.'), errors='coerce')
+    unidad = df['UNIDAD'].fillna('').astype(str).map(normalizar_texto)
+    items = df['ITEM'].fillna('').astype(str).str.strip()
+    sugerencias = emparejar_insumos(items, [i['nombre'] for i in insumos])
+    return pd.DataFrame({
+        "fila": df['fila'],
+        "item": items,
+        "insumo": items.map(lambda i: sugerencias[i][0]),
+        "similitud": items.map(lambda i: sugerencias[i][1]),
+        "cantidad": numero('CANTIDAD'),
+        "unidad": unidad.map(lambda u: ALIAS_UNIDADES.get(u, u) or None),
+        "total": numero('TOTAL'),
+    })
+
+def convertir_factura(lineas, mapa_insumos):
+    """Pasa todas las líneas revisadas a la unidad base de su insumo en una sola conversión y marca las que no se pueden ingresar."""
+    df = lineas.copy()
+    datos = df['insumo'].map(mapa_insumos)
+    df['unidad_base'] = datos.map(lambda d: d['unidad_medida'] if isinstance(d, dict) else None)
+    df['insumo_id'] = datos.map(lambda d: d['id'] if isinstance(d, dict) else None)
+    # Sin unidad en la factura se asume la unidad base del insumo
+    desde = df['unidad'].where(df['unidad'].notna() & (df['unidad'] != ''), df['unidad_base'])
+    df['cantidad_base'] = convertir(df['cantidad'].astype(float).to_numpy(), desde.to_numpy(), df['unidad_base'].to_numpy()) if len(df) else []
+    df['costo_unitario'] = df['total'] / df['cantidad_base']
+    df['error'] = np.select([
+        df['insumo_id'].isna(),
+        ~(df['cantidad'] > 0),
+        df['cantidad_base'].isna(),
+        ~(df['total'] >= 0),
+    ], ["Elige el insumo", "Cantidad inválida", "Unidad no compatible", "Total inválido"], default='')
+    return df
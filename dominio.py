@@ -0,0 +1,28 @@
+# Reglas del negocio que comparten erp.py y almacen_local.py.
+# Son las mismas que cargan las migraciones (tabla unidades_medida, factor_unidad() y
+# transicion_pedido_valida()); si cambian aquí, cambian también allá.
+
+# Unidad -> (dimensión, factor a la unidad mínima de su dimensión)
+UNIDADES_MEDIDA = {
+    'gr': ('masa', 1), 'kg': ('masa', 1000),
+    'ml': ('volumen', 1), 'cc': ('volumen', 1), 'lt': ('volumen', 1000),
+    'unidades': ('unidad', 1),
+    'cdta': ('cuchara', 5), 'cda': ('cuchara', 15),
+}
+
+# Estado actual -> estados a los que puede pasar un pedido
+TRANSICIONES_PEDIDO = {
+    'Pendiente': ['En Horno', 'Cancelado'],
+    'En Horno': ['Listo', 'Cancelado'],
+    'Listo': ['Entregado', 'Cancelado'],
+    'Entregado': ['Cancelado'],
+}
+
+def factor_unidad(desde, hacia):
+    """Factor para pasar de una unidad a otra; None si no son compatibles (cucharas valen igual en gr que en ml)."""
+    if desde == hacia: return 1
+    if desde not in UNIDADES_MEDIDA or hacia not in UNIDADES_MEDIDA: return None
+    (dd, fd), (dh, fh) = UNIDADES_MEDIDA[desde], UNIDADES_MEDIDA[hacia]
+    if dd == dh or (dd == 'cuchara' and dh in ('masa', 'volumen')) or (dh == 'cuchara' and dd in ('masa', 'volumen')):
+        return fd / fh
+    return None
@@ -3,11 +3,24 @@ try:
     from supabase import create_client, Client
 except ImportError:
     from supabase import create_client
+try:
+    from supabase import ClientOptions
+except ImportError:
+    ClientOptions = None
+import httpx
 import pandas as pd
+import numpy as np
 import time
 import json 
+import os
 import altair as alt
 from datetime import datetime
+from zoneinfo import ZoneInfo
+from almacen_local import AlmacenSQLite
+from dominio import TRANSICIONES_PEDIDO
+from calculos import (UNIDADES, TIEMPOS_DEFECTO, convertir, opciones_unidad, costear_ingredientes, programar_horno,
+                      armar_pedido, preparar_importacion, preparar_factura, convertir_factura)
+from almacen_supabase import ClienteResiliente, AVISO_COLA, directorio_local, en_cola
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
@@ -62,14 +75,31 @@ st.markdown("""
 # --- CONEXIÓN A SUPABASE ---
 @st.cache_resource
 def init_connection():
+    try: almacen = dict(st.secrets.get("almacen", {}))
+    except Exception: almacen = {}
+    if almacen.get("backend") == "sqlite":
+        # Base local con el mismo esquema y datos de ejemplo: desarrollo, pruebas y mediciones sin Supabase
+        return AlmacenSQLite(almacen.get("ruta", os.path.join(os.path.dirname(os.path.abspath(__file__)), "erp_local.sqlite")))
     try:
         url = st.secrets["supabase"]["url"]
         key = st.secrets["supabase"]["key"]
-        return create_client(url, key)
     except Exception as e:
         # ¡ESTO MOSTRARÁ LA CAUSA REAL DEL FALLO EN LA PANTALLA!
         st.error(f"¡ERROR FATAL DE CONEXIÓN! Detalle: {e}") 
         return None
+    try: cfg = dict(st.secrets.get("offline", {}))
+    except Exception: cfg = {}
+    # Tiempo corto para conectar: una red lenta pasa a la cola en segundos en vez de colgar la página
+    timeout = httpx.Timeout(float(cfg.get("timeout", 15)), connect=float(cfg.get("timeout_conexion", 4)))
+    opciones = ClientOptions(postgrest_client_timeout=timeout) if ClientOptions else None
+    # Versiones anteriores lo dejaban junto a erp.py: se sigue usando para no perder escrituras pendientes
+    ruta_anterior = os.path.join(os.path.dirname(os.path.abspath(__file__)), "erp_offline.sqlite")
+    return ClienteResiliente(
+        lambda: create_client(url, key, options=opciones) if opciones else create_client(url, key),
+        cfg.get("ruta", ruta_anterior if os.path.exists(ruta_anterior) else os.path.join(directorio_local(), "erp_offline.sqlite")),
+        espera_reintento=int(cfg.get("espera_reintento", 30)),
+        lote=int(cfg.get("lote", 50)),
+    )
 
 supabase = init_connection()
 
@@ -82,102 +112,250 @@ if 'rol_actual' not in st.session_state:
     st.session_state.rol_actual = None
 
 # --- LÓGICA DE NEGOCIO ---
+# Zona horaria del negocio: las fechas elegidas en pantalla viajan a la BD (timestamptz) con su offset
+ZONA_NEGOCIO = ZoneInfo(st.secrets.get("negocio", {}).get("zona_horaria", "America/Santiago"))
 
-def registrar_gasto(monto, descripcion, fecha=None):
-    """Registra una compra de insumos en el libro financiero."""
-    if not fecha: fecha = str(datetime.now().date())
-    if supabase:
-        try:
-            supabase.table('gastos').insert({
-                "fecha": fecha, "monto": monto, "descripcion": descripcion, "tipo": "Compra Insumo"
-            }).execute()
-            return True
-        except Exception as e:
-            st.error(f"Error registrando gasto: {e}")
-            return False
-
-def descontar_stock_automatico(pedido):
-    """Resta stock al entregar."""
-    if not supabase: return []
-    try:
-        if not pedido.get('detalle_json'): return []
-        detalle = json.loads(pedido['detalle_json'])
-        log = []
-        insumos_db = supabase.table('insumos').select("*").execute().data
-        insumos_map = {i['nombre']: i for i in insumos_db}
-        
-        for item in detalle:
-            nombre_prod = item['producto']
-            cant_vendida = item['cantidad']
-            receta = supabase.table('recetas').select("ingredientes_json").eq('nombre', nombre_prod).execute().data
-            
-            if receta and receta[0]['ingredientes_json']:
-                ings = json.loads(receta[0]['ingredientes_json'])
-                for ing in ings:
-                    nombre_ing = ing['nombre']
-                    cant_ing_unitaria = ing['cantidad']
-                    total_desc = cant_ing_unitaria * cant_vendida
-                    if nombre_ing in insumos_map:
-                        stock_actual = insumos_map[nombre_ing]['stock_actual']
-                        nuevo = stock_actual - total_desc
-                        supabase.table('insumos').update({"stock_actual": nuevo}).eq('nombre', nombre_ing).execute()
-                        log.append(f"- {nombre_ing}: {stock_actual} → {nuevo}")
-        return log
-    except Exception as e:
-        print(f"Error descontando stock: {e}")
-        return []
+def registrar_compras(compras, fecha=None):
+    """Ingresa compras [{insumo_id, cantidad (unidad base), costo_total, descripcion}]: stock, costo y libro financiero en una transacción.
+    None si quedaron en la cola sin conexión."""
+    if not compras: return []
+    res = supabase.rpc('registrar_compras', {
+        "p_compras": compras, "p_usuario": st.session_state.usuario_actual, "p_fecha": fecha or str(datetime.now().date())
+    }).execute()
+    if en_cola(res): return None
+    return [f"🛒 {r['insumo']}: {r['stock_anterior']} → {r['stock_nuevo']}" for r in res.data]
+
+# --- RECETAS ---
+def ingredientes_por_variacion(variacion_ids=None):
+    """{variacion_id: [{nombre, cantidad, unidad, costo, insumo_id}, ...]} desde receta_ingredientes, en el orden guardado."""
+    q = supabase.table('receta_ingredientes').select("variacion_id, posicion, insumo_id, nombre, cantidad, unidad, costo")
+    if variacion_ids is not None: q = q.in_('variacion_id', list(variacion_ids))
+    res = {}
+    for f in q.order('variacion_id').order('posicion').execute().data:
+        res.setdefault(f['variacion_id'], []).append({k: f[k] for k in ('nombre', 'cantidad', 'unidad', 'costo', 'insumo_id')})
+    return res
+
+def guardar_receta(variacion_id, datos, ingredientes):
+    """Crea (variacion_id=None) o actualiza una variación y reemplaza sus ingredientes en una sola transacción.
+    None si quedó en la cola sin conexión."""
+    res = supabase.rpc('guardar_receta', {"p_variacion_id": variacion_id, "p_datos": datos, "p_ingredientes": ingredientes}).execute()
+    if en_cola(res): return None
+    invalidar_catalogo()
+    return res.data
+
+def costos_insumos_variaciones():
+    """{variacion_id: costo de insumos por unidad vendida}, calculado en la BD con el costo actual de cada insumo."""
+    return {r['variacion_id']: float(r['costo_insumos'] or 0) for r in supabase.table('costo_recetas').select("variacion_id, costo_insumos").execute().data}
+
+# --- ÍNDICE DEL CATÁLOGO ---
+@st.cache_data(ttl=30, show_spinner=False)
+def version_catalogo():
+    """Versión del catálogo en la BD; se relee a lo más cada 30 s y al instante tras una escritura desde la app."""
+    r = supabase.table('versiones_datos').select("version").eq('clave', 'catalogo').execute().data
+    # Sin la fila los triggers no tienen qué subir: una versión inventada reconstruiría el índice en cada lectura
+    if not r: raise RuntimeError("Falta la versión 'catalogo' en versiones_datos (migración 20261019121200_version_catalogo.sql)")
+    return r[0]['version']
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _indice_catalogo(version):
+    """Productos por nombre e id y variaciones agrupadas por producto con su receta; uno por versión, compartido entre sesiones.
+    No modificar lo que devuelve: es el mismo objeto para todos."""
+    productos = supabase.table('productos').select("*").order('nombre').execute().data
+    variaciones = supabase.table('variaciones').select("*").order('nombre').execute().data
+    ingredientes = ingredientes_por_variacion()
+    por_producto = {}
+    for v in variaciones:
+        v['ingredientes'] = ingredientes.get(v['id'], [])
+        por_producto.setdefault(v['producto_id'], []).append(v)
+    return {
+        "productos": {p['nombre']: p for p in productos},
+        "productos_por_id": {p['id']: p for p in productos},
+        "variaciones": {v['id']: v for v in variaciones},
+        "por_producto": por_producto,
+    }
+
+def indice_catalogo():
+    return _indice_catalogo(version_catalogo())
+
+def invalidar_catalogo():
+    """Llamar después de cada escritura en Mis Productos (los triggers ya subieron la versión en la BD)."""
+    version_catalogo.clear()
+
+# --- COSTEO DEL CATÁLOGO ---
+PARAMETROS_COSTO_DEFECTO = {"merma": 5, "ops": 15, "mo": 6400, "maq": 5, "margen": 60, "empaque": 3000, "lote": False}
+
+def calcular_precio_final(costo_insumos, p_merma, p_ops, costo_mo, p_maq, p_margen, costo_empaque):
+    """Precio sugerido y desglose; acepta escalares o arrays de NumPy (una receta o todo el catálogo)."""
+    val_merma = costo_insumos * (p_merma / 100)
+    sub1 = costo_insumos + val_merma
+    val_ops = sub1 * (p_ops / 100)
+    sub2 = sub1 + val_ops
+    sub3 = sub2 + costo_mo
+    val_maq = sub3 * (p_maq / 100)
+    sub4 = sub3 + val_maq
+    val_ganancia = sub4 * (p_margen / 100)
+    sub5 = sub4 + val_ganancia
+    final = sub5 + costo_empaque
+    
+    return final, {
+        "insumos": costo_insumos, "merma": val_merma, "ops": val_ops,
+        "mo": costo_mo, "maq": val_maq, "ganancia": val_ganancia, "empaque": costo_empaque
+    }
+
+def parametros_costo(variacion):
+    """Parámetros de costeo guardados en la variación, completando con los valores por defecto."""
+    params = dict(PARAMETROS_COSTO_DEFECTO)
+    params["lote"] = (variacion.get('rendimiento') or 1) > 1
+    if params["lote"]: params["empaque"] = 0  # en lote el formulario parte sin empaque
+    try: params.update(json.loads(variacion.get('parametros_json') or '{}'))
+    except: pass
+    return params
+
+def recostear_catalogo(variaciones, costo_por_variacion):
+    """Costo y margen actual de todas las variaciones en una pasada, a partir del costo de insumos que entrega la BD."""
+    vars_ok = [v for v in variaciones if v['id'] in costo_por_variacion]
+    if not vars_ok: return pd.DataFrame()
+    costo_unitario = np.array([costo_por_variacion[v['id']] for v in vars_ok], dtype=float)
+
+    params = [parametros_costo(v) for v in vars_ok]
+    col = lambda k: np.array([float(p[k]) for p in params])
+    lote = np.array([bool(p["lote"]) for p in params])
+    rend = np.array([float(v.get('rendimiento') or 1) for v in vars_ok])
+    div = np.where(lote, rend, 1.0)
 
-def reponer_stock_automatico(pedido):
-    """Devuelve stock al cancelar una entrega (Devolución)."""
-    if not supabase: return []
+    # En modo lote la MO y el empaque son del lote completo: se costea el lote y se divide
+    final, bd = calcular_precio_final(costo_unitario * div, col("merma"), col("ops"), col("mo"), col("maq"), col("margen"), col("empaque"))
+    costo_prod = final - bd["ganancia"] - bd["empaque"]
+    precio_actual = np.array([float(v.get('precio') or 0) for v in vars_ok])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margen_real = np.where(costo_prod > 0, (precio_actual * div - bd["empaque"] - costo_prod) / costo_prod * 100, np.nan)
+
+    return pd.DataFrame({
+        "id": [v['id'] for v in vars_ok],
+        "nombre": [v['nombre'] for v in vars_ok],
+        "precio": precio_actual,
+        "costo_insumos": costo_unitario,
+        "precio_sugerido": final / div,
+        "margen_objetivo": col("margen"),
+        "margen_real": margen_real,
+    })
+
+# --- PLANIFICACIÓN DE MATERIALES ---
+def planificar_materiales(lineas, insumos):
+    """Requerimiento por día e insumo y lista de compras, a partir del consumo por pedido que explota la BD."""
+    if not lineas: return pd.DataFrame(), pd.DataFrame()
+
+    lineas = pd.DataFrame(lineas)
+    lineas['fecha'] = pd.to_datetime(lineas['fecha_entrega'])
+    lineas['cantidad'] = lineas['cantidad'].astype(float)
+    req = lineas.groupby(['fecha', 'insumo_id'])['cantidad'].sum().unstack(fill_value=0).sort_index()
+
+    info = pd.DataFrame(insumos).set_index('id').reindex(req.columns)
+    stock = info['stock_actual'].astype(float).fillna(0)
+    saldo = stock - req.cumsum()
+    falta = saldo.lt(0)
+
+    compras = pd.DataFrame({
+        "insumo": info['nombre'],
+        "unidad": info['unidad_medida'],
+        "necesario": req.sum(),
+        "stock": stock,
+        "faltante": (req.sum() - stock).clip(lower=0),
+        "falta_desde": falta.idxmax().where(falta.any()),
+    })
+    compras['costo_estimado'] = compras['faltante'] * info['costo_unitario'].astype(float).fillna(0)
+    compras = compras.sort_values(['falta_desde', 'insumo'], na_position='last').reset_index(drop=True)
+
+    req.columns = info['nombre'].fillna(req.columns.to_series().astype(str)).values
+    return req, compras
+
+def mover_stock(movimientos, icono="•"):
+    """Aplica deltas de stock en la BD y los anota en el libro de movimientos, en una sola llamada. None si quedó en cola."""
+    if not movimientos: return []
+    res = supabase.rpc('aplicar_movimientos_stock', {"movimientos": movimientos, "usuario": st.session_state.usuario_actual}).execute()
+    if en_cola(res): return None
+    return [f"{icono} {r['insumo']}: {r['stock_anterior']} → {r['stock_nuevo']}" for r in res.data]
+
+def fijar_stock(insumo_id, stock):
+    """Fija el stock total; queda en el libro como ajuste por la diferencia. None si quedó en cola."""
+    res = supabase.rpc('fijar_stock_insumo', {"p_insumo_id": insumo_id, "p_stock": stock, "p_usuario": st.session_state.usuario_actual}).execute()
+    return None if en_cola(res) else res.data
+
+def fijar_costo(insumo_id, costo_unitario):
+    """Fija el costo de referencia revalorizando el stock (promedio y capas FIFO), así el costeo no lo pisa. None si quedó en cola."""
+    res = supabase.rpc('fijar_costo_insumo', {"p_insumo_id": insumo_id, "p_costo_unitario": costo_unitario, "p_usuario": st.session_state.usuario_actual}).execute()
+    return None if en_cola(res) else res.data
+
+# --- ESTADOS DE PEDIDO ---
+# Las transiciones válidas (TRANSICIONES_PEDIDO) vienen de dominio.py, igual que en la BD
+def cambiar_estado_pedidos(pedidos, nuevo_estado):
+    """Transición en lote: un solo update y el stock de todos los pedidos en un solo movimiento. Devuelve el reporte por pedido
+    (vacío si quedó en la cola sin conexión)."""
+    if not supabase or not pedidos: return None
     try:
-        if not pedido.get('detalle_json'): return []
-        detalle = json.loads(pedido['detalle_json'])
-        log = []
-        insumos_db = supabase.table('insumos').select("*").execute().data
-        insumos_map = {i['nombre']: i for i in insumos_db}
-        
-        for item in detalle:
-            nombre_prod = item['producto']
-            cant_vendida = item['cantidad']
-            receta = supabase.table('recetas').select("ingredientes_json").eq('nombre', nombre_prod).execute().data
-            
-            if receta and receta[0]['ingredientes_json']:
-                ings = json.loads(receta[0]['ingredientes_json'])
-                for ing in ings:
-                    nombre_ing = ing['nombre']
-                    total_reponer = ing['cantidad'] * cant_vendida
-                    if nombre_ing in insumos_map:
-                        stock_actual = insumos_map[nombre_ing]['stock_actual']
-                        nuevo = stock_actual + total_reponer
-                        supabase.table('insumos').update({"stock_actual": nuevo}).eq('nombre', nombre_ing).execute()
-                        log.append(f"⬆️ {nombre_ing}: {stock_actual} → {nuevo}")
-        return log
+        # El consumo sale de los ítems y recetas en la BD, según el estado real de cada pedido
+        res = supabase.rpc('transicionar_pedidos', {
+            "p_ids": [p['id'] for p in pedidos], "p_estado": nuevo_estado, "p_usuario": st.session_state.usuario_actual
+        }).execute()
+        if en_cola(res):
+            st.toast(f"{AVISO_COLA}: {len(pedidos)} pedido(s) → {nuevo_estado}")
+            return []
+        return res.data
     except Exception as e:
-        print(f"Error reponiendo stock: {e}")
-        return []
+        st.error(f"No se pudieron cambiar los pedidos: {e}")
+        return None
 
-def cambiar_estado_pedido(id_pedido, nuevo_estado, datos_pedido=None):
-    if supabase:
-        supabase.table('pedidos').update({'estado': nuevo_estado}).eq('id', id_pedido).execute()
-        
+def cambiar_estado_pedido(pedido, nuevo_estado):
+    """Aplica la transición en la BD en una sola llamada (estado + stock + venta). Repetirla no hace nada."""
+    res = cambiar_estado_pedidos([pedido], nuevo_estado)
+    r = res[0] if res else None
+    if r and r['error']:
+        st.error(f"No se pudo cambiar el pedido #{pedido['id']}: {r['error']}")
+        return None
+    if r and r['aplicado']:
         msg = ""
-        # Lógica de Stock Completa (Entrada y Salida)
-        if nuevo_estado == "Entregado" and datos_pedido:
-            log = descontar_stock_automatico(datos_pedido)
-            if log: msg = " | 📉 Stock descontado"
-            
-        elif nuevo_estado == "Cancelado":
-            # Si estaba entregado y se cancela -> Devolución
-            if datos_pedido and datos_pedido['estado'] == 'Entregado':
-                log = reponer_stock_automatico(datos_pedido)
-                if log: msg = " | 🔄 Stock devuelto"
-            else:
-                msg = " | Pedido cerrado"
+        if nuevo_estado == "Entregado": msg = " | 📉 Stock descontado y venta registrada"
+        elif r['estado_anterior'] == "Entregado": msg = " | 🔄 Stock devuelto"
+        elif nuevo_estado == "Cancelado": msg = " | Pedido cerrado"
+        st.toast(f"Pedido #{pedido['id']}: {nuevo_estado}{msg}", icon="✅")
+    return r
 
-        st.toast(f"Estado: {nuevo_estado}{msg}", icon="✅")
-        time.sleep(1)
-        st.rerun()
+# --- ARMADO E IMPORTACIÓN DE PEDIDOS ---
+def demanda_insumos(lineas):
+    """Explota líneas (fecha_entrega, variacion_id, cantidad) con las recetas de la BD y las compara con el stock actual."""
+    if lineas.empty: return pd.DataFrame()
+    rc = pd.DataFrame(supabase.table('receta_consumo').select("variacion_id, insumo_id, cantidad").in_('variacion_id', [int(i) for i in lineas['variacion_id'].unique()]).execute().data,
+                      columns=['variacion_id', 'insumo_id', 'cantidad'])
+    explotado = lineas.merge(rc, on='variacion_id', suffixes=('_pedido', ''))
+    explotado['cantidad'] = explotado['cantidad_pedido'] * explotado['cantidad'].astype(float)
+    insumos = supabase.table('insumos').select("id, nombre, unidad_medida, stock_actual, costo_unitario").execute().data
+    return planificar_materiales(explotado[['fecha_entrega', 'insumo_id', 'cantidad']].to_dict('records'), insumos)[1]
+
+# --- FINANZAS ---
+def version_finanzas():
+    """Versión del libro financiero en la BD; sube con cada escritura en el libro."""
+    r = supabase.table('versiones_datos').select("version").eq('clave', 'finanzas').execute().data
+    # Sin la fila los triggers no tienen qué subir: una versión inventada dejaría una entrada de caché por recarga
+    if not r: raise RuntimeError("Falta la versión 'finanzas' en versiones_datos (migración 20261019120900_resumen_mensual.sql)")
+    return r[0]['version']
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def resumen_mensual(version):
+    """Filas (mes, tipo, monto) de la vista resumen_mensual para esa versión de los datos."""
+    df = pd.DataFrame(supabase.table('resumen_mensual').select("mes, tipo, monto").execute().data, columns=['mes', 'tipo', 'monto'])
+    df['monto'] = pd.to_numeric(df['monto']).fillna(0)
+    return df
+
+@st.cache_resource(max_entries=4)
+def grafico_mensual(version):
+    """Gráfico Venta/Gasto por mes; se arma una sola vez por versión de los datos."""
+    chart_data = resumen_mensual(version).dropna(subset=['mes']).rename(columns={'mes': 'Mes'})
+    return alt.Chart(chart_data).mark_bar().encode(
+        x='Mes',
+        y='monto',
+        color=alt.Color('tipo', scale=alt.Scale(domain=['Venta', 'Gasto', 'Ajuste'], range=['#22c55e', '#ef4444', '#f59e0b'])),
+        tooltip=['Mes', 'tipo', 'monto']
+    ).interactive()
 
 # --- PANTALLA DE LOGIN ---
 def login_screen():
@@ -206,6 +384,149 @@ def login_screen():
                 else:
                     st.error("Error de conexión DB")
 
+# --- TABLERO DE COCINA ---
+def sincronizar_pedidos_activos():
+    """Mantiene los pedidos activos en sesión y trae solo los que cambiaron desde la última marca."""
+    cache = st.session_state.setdefault('kanban', {"pedidos": {}, "marca": None})
+    # Sin marca: carga inicial de los activos. La marca sigue el orden de commit (ver pedidos_cambiados),
+    # así un lote que confirma tarde no queda detrás de la última lectura
+    res = supabase.rpc('pedidos_cambiados', {"p_desde": cache['marca']}).execute().data
+    cambios = res['pedidos']
+    for p in cambios:
+        if p['estado'] in ('Cancelado', 'Entregado'): cache['pedidos'].pop(p['id'], None)
+        else: cache['pedidos'][p['id']] = p
+    cache['marca'] = res['marca']
+    return cambios
+
+def refrescar_tablero():
+    """Vuelve a dibujar solo el tablero; si la acción llegó en una recarga completa, recarga la app."""
+    try: st.rerun(scope="fragment")
+    except st.errors.StreamlitAPIException: st.rerun()
+
+@st.fragment(run_every=int(st.secrets.get("cocina", {}).get("refresco_seg", 20)))
+def tablero_cocina(todas_variaciones):
+    st.subheader("📋 Tablero de Producción")
+
+    # Pedidos activos desde la caché de sesión (solo viajan los que cambiaron)
+    pedidos_activos = []
+    if supabase:
+        try:
+            sincronizar_pedidos_activos()
+            pedidos_activos = sorted(st.session_state.kanban['pedidos'].values(), key=lambda p: str(p['fecha_entrega']))
+        except: pass
+
+    # Plan del horno
+    cocina = st.secrets.get("cocina", {})
+    c_h1, c_h2, c_h3 = st.columns([1, 1, 2])
+    capacidad_horno = c_h1.number_input("Capacidad horno (unidades a la vez)", min_value=1, value=int(cocina.get("capacidad_horno", 2)), step=1, key="horno_cap")
+    inicio_jornada = c_h2.number_input("Inicio jornada (hora)", min_value=0, max_value=23, value=int(cocina.get("inicio_jornada", 7)), step=1, key="horno_ini")
+    orden_plan = c_h3.toggle("🔥 Ordenar según plan de horno", key="horno_orden")
+
+    plan_horno = pd.DataFrame()
+    if pedidos_activos:
+        tiempos = {v['id']: (v.get('tiempo_prep_min') or TIEMPOS_DEFECTO[0], v.get('tiempo_horno_min') or TIEMPOS_DEFECTO[1]) for v in todas_variaciones}
+        plan_horno = programar_horno(pedidos_activos, tiempos, capacidad_horno, datetime.now().replace(second=0, microsecond=0), inicio_jornada)
+    plan_por_id = plan_horno.set_index('id').to_dict('index') if not plan_horno.empty else {}
+    if plan_por_id:
+        atrasados = [i for i, r in plan_por_id.items() if not r['a_tiempo']]
+        if atrasados: st.error(f"⚠️ El horno no alcanza para {len(atrasados)} pedido(s): " + ", ".join(f"#{i}" for i in atrasados[:15]) + (" …" if len(atrasados) > 15 else ""))
+        else: st.success("✅ El plan de horno cumple todas las entregas.")
+
+    if orden_plan and plan_por_id:
+        # Primero lo que entra al horno, después lo demás (Listo) por fecha
+        posicion = {pid: k for k, pid in enumerate(plan_horno['id'])}
+        pedidos_activos = sorted(pedidos_activos, key=lambda p: (posicion.get(p['id'], len(posicion)), str(p['fecha_entrega'])))
+
+    # Acciones en lote
+    if st.session_state.get('reporte_lote'):
+        reporte = pd.DataFrame(st.session_state.reporte_lote)
+        reporte['resultado'] = np.where(reporte['aplicado'], "✅ Aplicado", np.where(reporte['error'].isna(), "➖ Ya estaba", "❌ " + reporte['error'].fillna('')))
+        with st.expander(f"📋 Último lote: {int(reporte['aplicado'].sum())} de {len(reporte)} pedido(s) aplicados", expanded=True):
+            st.dataframe(reporte[['pedido_id', 'estado_anterior', 'estado_nuevo', 'resultado']], hide_index=True, use_container_width=True,
+                         column_config={"pedido_id": "Pedido", "estado_anterior": "Antes", "estado_nuevo": "Ahora", "resultado": "Resultado"})
+            if st.button("Cerrar reporte", key="lote_cerrar"):
+                del st.session_state.reporte_lote
+                refrescar_tablero()
+
+    if pedidos_activos:
+        etiquetas = {p['id']: f"#{p['id']} · {p['cliente_nombre']} · {p['estado']}" for p in pedidos_activos}
+        if 'lote_sel' in st.session_state:
+            # Lo que ya salió del tablero (entregado o cancelado por otro usuario) deja de estar seleccionado
+            st.session_state.lote_sel = [i for i in st.session_state.lote_sel if i in etiquetas]
+        with st.expander("☑️ Acciones en lote"):
+            sel_lote = st.multiselect("Pedidos seleccionados", list(etiquetas), format_func=etiquetas.get, key="lote_sel")
+            c_l1, c_l2, c_l3, c_l4 = st.columns(4)
+            accion_lote = None
+            if c_l1.button("🔥 Horno", key="lote_h", disabled=not sel_lote, use_container_width=True): accion_lote = 'En Horno'
+            if c_l2.button("✅ Listo", key="lote_l", disabled=not sel_lote, use_container_width=True): accion_lote = 'Listo'
+            if c_l3.button("🚚 Entregar", key="lote_e", disabled=not sel_lote, use_container_width=True): accion_lote = 'Entregado'
+            if c_l4.button("❌ Cancelar", key="lote_c", disabled=not sel_lote, use_container_width=True): accion_lote = 'Cancelado'
+            if accion_lote:
+                reporte = cambiar_estado_pedidos([st.session_state.kanban['pedidos'][i] for i in sel_lote], accion_lote)
+                if reporte is not None:
+                    st.session_state.reporte_lote = reporte
+                    del st.session_state.lote_sel
+                    refrescar_tablero()
+
+    if not pedidos_activos:
+        st.info("🎉 No hay pedidos pendientes. ¡Todo al día!")
+    else:
+        for p in pedidos_activos:
+            # Tarjeta de Pedido
+            with st.container():
+                st.markdown(f"""
+                <div class="kanban-card">
+                    <div style="display:flex; justify-content:space-between;">
+                        <span>🆔 <b>#{p['id']}</b></span>
+                        <span>📅 <b>{p['fecha_entrega']}</b></span>
+                    </div>
+                    <h4 style="margin:5px 0">{p['cliente_nombre']}</h4>
+                    <p style="color:#666">🍰 {p['nombre_producto_snapshot']}{f" (x{p['cantidad']})" if p.get('cantidad') else ""}</p>
+                    <p><i>Nota: {p.get('notas') or 'Sin notas'}</i></p>
+                </div>
+                """, unsafe_allow_html=True)
+                if p['id'] in plan_por_id:
+                    r_plan = plan_por_id[p['id']]
+                    txt_plan = f"🔥 Horno {r_plan['inicio']:%d/%m %H:%M} → {r_plan['fin']:%H:%M} (entrega {r_plan['limite']:%H:%M})"
+                    if r_plan['a_tiempo']: st.caption(txt_plan)
+                    else: st.caption(f"⚠️ {txt_plan} — atrasado {-r_plan['holgura_min']:.0f} min")
+
+                col_state, col_btns = st.columns([2, 3])
+
+                with col_state:
+                    st.caption("Estado Actual:")
+                    if p['estado'] == 'Pendiente': st.warning("🟡 Pendiente")
+                    elif p['estado'] == 'En Horno': st.info("🔵 En Horno")
+                    elif p['estado'] == 'Listo': st.success("🟢 Listo para Retiro")
+
+                with col_btns:
+                    st.caption("Acciones:")
+                    c_b1, c_b2, c_b3 = st.columns(3)
+
+                    # Lógica de Botones según estado (las mismas transiciones que valida la BD)
+                    siguientes = TRANSICIONES_PEDIDO.get(p['estado'], [])
+                    if 'En Horno' in siguientes:
+                        if c_b1.button("🔥 Horno", key=f"h_{p['id']}"):
+                            cambiar_estado_pedido(p, 'En Horno')
+                            refrescar_tablero()
+
+                    if 'Listo' in siguientes:
+                        if c_b2.button("✅ Listo", key=f"l_{p['id']}"):
+                            cambiar_estado_pedido(p, 'Listo')
+                            refrescar_tablero()
+
+                    if 'Entregado' in siguientes:
+                        if c_b3.button("🚚 Entregar", key=f"e_{p['id']}"):
+                            # Estado, descuento de stock y venta en una sola transacción
+                            cambiar_estado_pedido(p, 'Entregado')
+                            refrescar_tablero()
+
+                    # Botón cancelar siempre disponible
+                    if 'Cancelado' in siguientes and st.button("❌ Cancelar", key=f"c_{p['id']}"):
+                        cambiar_estado_pedido(p, 'Cancelado')
+                        refrescar_tablero()
+                st.divider()
+
 # --- APLICACIÓN PRINCIPAL ---
 def main_app():
     # Sidebar
@@ -235,6 +556,30 @@ def main_app():
         </div>
         """, unsafe_allow_html=True)
         
+        # Estado de la conexión y de la cola de escrituras sin conexión
+        if supabase:
+            pendientes, problemas = supabase.pendientes(), supabase.problemas()
+            if not supabase.en_linea:
+                st.warning(f"📴 Sin conexión. Mostrando la última copia guardada; {pendientes} cambios en cola.")
+            elif pendientes:
+                st.info(f"⏳ {pendientes} cambios por sincronizar.")
+            if pendientes and st.button("🔄 Sincronizar ahora", use_container_width=True):
+                st.toast(f"{supabase.sincronizar(reintentar=True)} cambios enviados.")
+                st.rerun()
+            if problemas:
+                with st.expander(f"⚠️ {len(problemas)} cambios sin aplicar"):
+                    for p in problemas:
+                        st.caption(f"{p['creado']:%d/%m %H:%M} · {p['tabla']} · {' → '.join(m for m, _, _ in p['pasos'][1:]) or p['pasos'][0][0]}")
+                        st.write(p['detalle'])
+                        b1, b2 = st.columns(2)
+                        if b1.button("Aplicar igual", key=f"cola_forzar_{p['id']}"):
+                            supabase.forzar(p['id'])
+                            supabase.sincronizar()
+                            st.rerun()
+                        if b2.button("Descartar", key=f"cola_descartar_{p['id']}"):
+                            supabase.descartar(p['id'])
+                            st.rerun()
+
         st.write("")
         if st.button("🚪 Cerrar Sesión", use_container_width=True):
             st.session_state.authenticated = False
@@ -251,58 +596,46 @@ def main_app():
 
         ventas_tot = 0
         gastos_tot = 0
-        df_v = pd.DataFrame()
-        df_g = pd.DataFrame()
+        ajustes_tot = 0
+        df_mes = pd.DataFrame(columns=['mes', 'tipo', 'monto'])
+        version_fin = None
 
         if supabase:
-            # Ventas
-            try:
-                pr = supabase.table('pedidos').select("fecha_entrega, total_pedido, estado").execute().data
-                if pr:
-                    dfp = pd.DataFrame(pr)
-                    if 'total_pedido' in dfp.columns and not dfp.empty:
-                        ventas_tot = dfp[dfp['estado'] == 'Entregado']['total_pedido'].sum()
-                        dfp['fecha'] = pd.to_datetime(dfp['fecha_entrega'])
-                        dfp['tipo'] = 'Venta'
-                        dfp = dfp.rename(columns={'total_pedido': 'monto'})
-                        df_v = dfp[dfp['estado'] == 'Entregado'][['fecha', 'monto', 'tipo']]
-            except: pass
-            
-            # Gastos
+            # Totales por mes y tipo mantenidos por el libro financiero; solo se vuelven a pedir si cambió la versión
             try:
-                gr = supabase.table('gastos').select("*").execute().data
-                if gr:
-                    dfg = pd.DataFrame(gr)
-                    if 'monto' in dfg.columns:
-                        gastos_tot = dfg['monto'].sum()
-                        dfg['fecha'] = pd.to_datetime(dfg['fecha'])
-                        dfg['tipo'] = 'Gasto'
-                        df_g = dfg[['fecha', 'monto', 'tipo']]
-            except: pass
+                version_fin = version_finanzas()
+                df_mes = resumen_mensual(version_fin)
+                ventas_tot = df_mes.loc[df_mes['tipo'] == 'Venta', 'monto'].sum()
+                gastos_tot = df_mes.loc[df_mes['tipo'] == 'Gasto', 'monto'].sum()
+                ajustes_tot = df_mes.loc[df_mes['tipo'] == 'Ajuste', 'monto'].sum()
+            except Exception as e:
+                st.error(f"Error cargando finanzas: {e}")
 
-        balance = ventas_tot - gastos_tot
+        balance = ventas_tot - gastos_tot + ajustes_tot
         
         c1, c2, c3 = st.columns(3)
-        c1.metric("Ingresos Totales (Ventas)", f"${ventas_tot:,.0f}", help="Solo pedidos entregados")
-        c2.metric("Egresos Totales (Compras)", f"${gastos_tot:,.0f}", help="Compras registradas")
-        c3.metric("Balance Neto (Ganancia)", f"${balance:,.0f}", delta="Rentable" if balance > 0 else "Pérdida")
+        c1.metric("Ingresos Totales (Ventas)", f"${ventas_tot:,.0f}", help="Pedidos entregados, menos anulaciones")
+        c2.metric("Egresos Totales (Compras)", f"${gastos_tot:,.0f}", help="Compras de insumos registradas")
+        c3.metric("Balance Neto (Ganancia)", f"${balance:,.0f}", delta="Rentable" if balance > 0 else "Pérdida",
+                  help=f"Incluye ajustes por ${ajustes_tot:,.0f}" if ajustes_tot else None)
+
+        # Costo de lo vendido según el costeo de insumos (promedio ponderado / FIFO)
+        if supabase:
+            try:
+                rc = supabase.rpc('resumen_costeo', {}).execute().data
+                if rc:
+                    costo_vendido = float(rc[0]['costo_vendido'] or 0)
+                    c4, c5, c6 = st.columns(3)
+                    c4.metric("Costo Insumos Vendidos", f"${costo_vendido:,.0f}", help="Valorizado al costo promedio o FIFO de cada insumo")
+                    c5.metric("Margen Bruto", f"${ventas_tot - costo_vendido:,.0f}")
+                    c6.metric("Valor del Inventario", f"${float(rc[0]['valor_inventario'] or 0):,.0f}")
+            except: pass
 
         st.write("")
         st.subheader("📈 Evolución Mensual")
         
-        if not df_v.empty or not df_g.empty:
-            df_full = pd.concat([df_v, df_g])
-            df_full['Mes'] = df_full['fecha'].dt.strftime('%Y-%m')
-            chart_data = df_full.groupby(['Mes', 'tipo'])['monto'].sum().reset_index()
-            
-            chart = alt.Chart(chart_data).mark_bar().encode(
-                x='Mes',
-                y='monto',
-                color=alt.Color('tipo', scale=alt.Scale(domain=['Venta', 'Gasto'], range=['#22c55e', '#ef4444'])),
-                tooltip=['Mes', 'tipo', 'monto']
-            ).interactive()
-            
-            st.altair_chart(chart, use_container_width=True)
+        if df_mes['mes'].notna().any():
+            st.altair_chart(grafico_mensual(version_fin), use_container_width=True)
         else:
             st.info("Aún no hay suficientes movimientos para generar gráficos.")
 
@@ -312,25 +645,108 @@ def main_app():
     elif menu == "🛒 Pedidos" or menu == "📌 Pedidos": # Aceptamos ambos nombres por si acaso
         st.title("🛒 Gestión de Pedidos")
 
-        # 1. Cargar Datos del Catálogo
-        mapa_productos_base = {}
-        todas_variaciones = []
-        lista_bases_nombres = []
-        
+        # 1. Catálogo desde el índice en memoria (solo va a la BD si cambió la versión)
+        indice = {"productos": {}, "variaciones": {}, "por_producto": {}}
         if supabase:
-            try:
-                # Cargar Bases
-                data_p = supabase.table('productos').select("*").order('nombre').execute().data
-                if data_p:
-                    mapa_productos_base = {p['nombre']: p for p in data_p}
-                    lista_bases_nombres = list(mapa_productos_base.keys())
-
-                # Cargar Variaciones (Hijos)
-                todas_variaciones = supabase.table('variaciones').select("*").execute().data
+            try: indice = indice_catalogo()
             except Exception as e:
                 st.error(f"Error conectando al catálogo: {e}")
+        mapa_productos_base = indice['productos']
+        lista_bases_nombres = list(mapa_productos_base.keys())
+        todas_variaciones = list(indice['variaciones'].values())
+
+        tab_nuevo, tab_importar, tab_tablero, tab_plan = st.tabs(["➕ Nuevo Pedido", "📥 Importar Pedidos", "📋 Tablero de Cocina", "🧮 Planificación"])
+
+        # --- TAB: IMPORTACIÓN MASIVA ---
+        with tab_importar:
+            st.subheader("📥 Importar Pedidos (Eventos / Empresas)")
+            st.caption("Columnas: CLIENTE, FECHA_ENTREGA, PRODUCTO (\"Base - Variación\"), CANTIDAD. Opcionales: PEDIDO (agrupa líneas), CONTACTO, HORA, PRECIO (por defecto el del catálogo), NOTAS.")
+            archivo_ped = st.file_uploader("Archivo CSV o Excel", type=["csv", "xlsx"], key=f"imp_ped_{st.session_state.get('imp_ped_n', 0)}")
+            if archivo_ped:
+                try:
+                    # Todo como texto (teléfonos, códigos); los números y fechas se interpretan al validar
+                    if archivo_ped.name.lower().endswith('.csv'): df_imp = pd.read_csv(archivo_ped, sep=None, engine='python', dtype=str)
+                    else: df_imp = pd.read_excel(archivo_ped, dtype=str)
+                    pedidos_imp, lineas_imp, errores_imp = preparar_importacion(df_imp, indice)
+                except Exception as e:
+                    st.error(f"Error leyendo el archivo: {e}")
+                    pedidos_imp, lineas_imp, errores_imp = [], pd.DataFrame(), pd.DataFrame()
+
+                if not errores_imp.empty:
+                    st.error(f"❌ {len(errores_imp)} línea(s) con errores. Corrige el archivo y vuelve a cargarlo; no se importó nada.")
+                    st.dataframe(errores_imp, hide_index=True, use_container_width=True)
+                elif pedidos_imp:
+                    m1, m2, m3 = st.columns(3)
+                    m1.metric("Pedidos", len(pedidos_imp))
+                    m2.metric("Líneas", len(lineas_imp))
+                    m3.metric("Total", f"${sum(p['total_pedido'] for p in pedidos_imp):,.0f}")
+                    with st.expander("Ver pedidos a crear"):
+                        st.dataframe(pd.DataFrame(pedidos_imp)[['cliente_nombre', 'fecha_entrega', 'hora_entrega', 'nombre_producto_snapshot', 'cantidad', 'total_pedido']],
+                                     hide_index=True, use_container_width=True)
 
-        tab_nuevo, tab_tablero = st.tabs(["➕ Nuevo Pedido", "📋 Tablero de Cocina"])
+                    st.markdown("##### 🧂 Insumos que requiere este lote")
+                    try: demanda = demanda_insumos(lineas_imp)
+                    except Exception as e:
+                        st.error(f"Error calculando insumos: {e}")
+                        demanda = pd.DataFrame()
+                    if demanda.empty: st.info("Los productos importados no tienen receta asociada.")
+                    else:
+                        if (demanda['faltante'] > 0).any(): st.warning(f"⚠️ Falta stock de {int((demanda['faltante'] > 0).sum())} insumo(s) para este lote.")
+                        st.dataframe(demanda.drop(columns=['falta_desde']).style.format({
+                            'necesario': '{:,.2f}', 'stock': '{:,.2f}', 'faltante': '{:,.2f}', 'costo_estimado': '${:,.0f}'
+                        }), hide_index=True, use_container_width=True)
+
+                    if st.button(f"✅ Confirmar e importar {len(pedidos_imp)} pedido(s)", type="primary", key="imp_ped_ok"):
+                        try:
+                            # Todos los pedidos y sus líneas en una sola transacción
+                            res_imp = supabase.rpc('crear_pedidos', {"p_pedidos": pedidos_imp}).execute()
+                            st.session_state.imp_ped_n = st.session_state.get('imp_ped_n', 0) + 1
+                            if en_cola(res_imp): st.info(f"{AVISO_COLA}: {len(pedidos_imp)} pedido(s).")
+                            else: st.success(f"¡Listo! {len(res_imp.data)} pedidos enviados a cocina.")
+                            time.sleep(1.5)
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error importando: {e}")
+
+        # --- TAB: PLANIFICACIÓN DE MATERIALES ---
+        with tab_plan:
+            st.subheader("🧮 Planificación de Materiales")
+            st.caption("Explota los pedidos Pendientes y En Horno por sus recetas y los compara con el stock actual.")
+            if supabase:
+                try:
+                    pend = supabase.table('pedidos').select("id").in_('estado', ['Pendiente', 'En Horno']).execute().data
+                    lineas_plan = supabase.table('consumo_pedidos').select("pedido_id, fecha_entrega, insumo_id, cantidad").in_('estado', ['Pendiente', 'En Horno']).execute().data
+                    ins_plan = supabase.table('insumos').select("id, nombre, unidad_medida, stock_actual, costo_unitario").execute().data
+                    req_dia, compras = planificar_materiales(lineas_plan, ins_plan)
+                except Exception as e:
+                    st.error(f"Error planificando: {e}")
+                    pend, lineas_plan, req_dia, compras = [], [], pd.DataFrame(), pd.DataFrame()
+
+                if compras.empty:
+                    st.info("No hay pedidos pendientes con receta para planificar.")
+                else:
+                    sin_receta = len(pend) - len({l['pedido_id'] for l in lineas_plan})
+                    faltantes = compras[compras['faltante'] > 0]
+                    m1, m2, m3 = st.columns(3)
+                    m1.metric("Pedidos planificados", len(pend) - sin_receta)
+                    m2.metric("Insumos con faltante", len(faltantes))
+                    m3.metric("Compra estimada", f"${faltantes['costo_estimado'].sum():,.0f}")
+                    if sin_receta: st.caption(f"⚠️ {sin_receta} pedido(s) sin receta asociada no se incluyen.")
+
+                    st.markdown("##### 🛒 Lista de Compras")
+                    if faltantes.empty:
+                        st.success("✅ Hay stock para todos los pedidos pendientes.")
+                    else:
+                        vista_compras = faltantes.copy()
+                        vista_compras['falta_desde'] = pd.to_datetime(vista_compras['falta_desde']).dt.strftime('%d/%m/%Y')
+                        st.dataframe(vista_compras.style.format({
+                            'necesario': '{:,.2f}', 'stock': '{:,.2f}', 'faltante': '{:,.2f}', 'costo_estimado': '${:,.0f}'
+                        }), hide_index=True, use_container_width=True)
+
+                    with st.expander("📅 Requerimiento por día de entrega"):
+                        vista_req = req_dia.copy()
+                        vista_req.index = pd.to_datetime(vista_req.index).strftime('%d/%m/%Y')
+                        st.dataframe(vista_req.round(2), use_container_width=True)
 
         # --- TAB: NUEVO PEDIDO ---
         with tab_nuevo:
@@ -361,8 +777,7 @@ def main_app():
 
                     if base_selec:
                         id_base = mapa_productos_base[base_selec]['id']
-                        # Filtrar hijos que pertenezcan a esta base
-                        vars_filtradas = [v for v in todas_variaciones if v['producto_id'] == id_base]
+                        vars_filtradas = indice['por_producto'].get(id_base, [])
                         
                         if not vars_filtradas:
                             st.warning(f"La '{base_selec}' no tiene tamaños ni sabores creados. Edítala en el Catálogo.")
@@ -383,31 +798,37 @@ def main_app():
                     c_cant, c_precio = st.columns(2)
                     cantidad = c_cant.number_input("Cantidad", 1, 50, 1)
                     precio_final = c_precio.number_input("Precio Final Unitario ($)", value=int(precio_sugerido), step=500)
+
+                    # Pedido de varias líneas: se van agregando; sin líneas se confirma solo lo seleccionado
+                    carrito = st.session_state.setdefault('carrito', [])
+                    if st.button("➕ Agregar al pedido", use_container_width=True, disabled=variacion_data is None):
+                        carrito.append({"variacion_id": variacion_data['id'], "producto": f"{base_selec} - {variacion_data['nombre']}",
+                                        "cantidad": cantidad, "precio_unitario": precio_final})
+                    for k, l in enumerate(carrito):
+                        c_l, c_x = st.columns([6, 1])
+                        c_l.markdown(f"• **{l['producto']}** x{l['cantidad']} — ${l['cantidad'] * l['precio_unitario']:,.0f}")
+                        if c_x.button("🗑️", key=f"carrito_del_{k}"):
+                            carrito.pop(k)
+                            st.rerun()
+                    if carrito and variacion_data: st.caption("Se confirma lo agregado al pedido; usa ➕ para sumar la selección actual.")
+                    lineas = carrito or ([{"variacion_id": variacion_data['id'], "producto": f"{base_selec} - {variacion_data['nombre']}",
+                                           "cantidad": cantidad, "precio_unitario": precio_final}] if variacion_data else [])
                     
-                    total_calc = cantidad * precio_final
+                    total_calc = sum(l['cantidad'] * l['precio_unitario'] for l in lineas)
                     st.markdown(f"<h2 style='text-align:right; color:#f2590d'>Total: ${total_calc:,.0f}</h2>", unsafe_allow_html=True)
                     
                     notas = st.text_area("📝 Notas Especiales (Dedicatoria, Alergias, Diseño)")
 
                     if st.button("💾 Confirmar Pedido", type="primary", use_container_width=True):
-                        if cliente_nombre and variacion_data:
+                        if cliente_nombre and lineas:
                             try:
-                                datos = {
-                                    "cliente_nombre": cliente_nombre,
-                                    "cliente_contacto": cliente_contacto,
-                                    "fecha_entrega": str(fecha_entrega),
-                                    "hora_entrega": str(hora_entrega),
-                                    "variacion_id": variacion_data['id'],
-                                    "nombre_producto_snapshot": f"{base_selec} - {variacion_data['nombre']}",
-                                    "cantidad": cantidad,
-                                    "precio_unitario_final": precio_final,
-                                    "total_pedido": total_calc,
-                                    "estado": "Pendiente",
-                                    "notas": notas
-                                }
-                                supabase.table('pedidos').insert(datos).execute()
-                                st.balloons()
-                                st.success("¡Pedido enviado a cocina!")
+                                datos = armar_pedido(cliente_nombre, cliente_contacto, str(fecha_entrega), str(hora_entrega), notas, lineas)
+                                res_ped = supabase.rpc('crear_pedidos', {"p_pedidos": [datos]}).execute()
+                                st.session_state.carrito = []
+                                if en_cola(res_ped): st.info(f"{AVISO_COLA}: pedido de {cliente_nombre}.")
+                                else:
+                                    st.balloons()
+                                    st.success("¡Pedido enviado a cocina!")
                                 time.sleep(1.5)
                                 st.rerun()
                             except Exception as e:
@@ -417,71 +838,7 @@ def main_app():
 
         # --- TAB: KANBAN ---
         with tab_tablero:
-            st.subheader("📋 Tablero de Producción")
-            
-            # Cargar pedidos activos
-            pedidos_activos = []
-            if supabase:
-                try:
-                    # Traemos todo lo que no esté Cancelado ni Entregado (histórico)
-                    pedidos_activos = supabase.table('pedidos').select("*").neq('estado', 'Cancelado').neq('estado', 'Entregado').order('fecha_entrega').execute().data
-                except: pass
-            
-            if not pedidos_activos:
-                st.info("🎉 No hay pedidos pendientes. ¡Todo al día!")
-            else:
-                for p in pedidos_activos:
-                    # Tarjeta de Pedido
-                    with st.container():
-                        st.markdown(f"""
-                        <div class="kanban-card">
-                            <div style="display:flex; justify-content:space-between;">
-                                <span>🆔 <b>#{p['id']}</b></span>
-                                <span>📅 <b>{p['fecha_entrega']}</b></span>
-                            </div>
-                            <h4 style="margin:5px 0">{p['cliente_nombre']}</h4>
-                            <p style="color:#666">🍰 {p['nombre_producto_snapshot']} (x{p['cantidad']})</p>
-                            <p><i>Nota: {p.get('notas') or 'Sin notas'}</i></p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        col_state, col_btns = st.columns([2, 3])
-                        
-                        with col_state:
-                            st.caption("Estado Actual:")
-                            if p['estado'] == 'Pendiente': st.warning("🟡 Pendiente")
-                            elif p['estado'] == 'En Horno': st.info("🔵 En Horno")
-                            elif p['estado'] == 'Listo': st.success("🟢 Listo para Retiro")
-                        
-                        with col_btns:
-                            st.caption("Acciones:")
-                            c_b1, c_b2, c_b3 = st.columns(3)
-                            
-                            # Lógica de Botones según estado
-                            if p['estado'] == 'Pendiente':
-                                if c_b1.button("🔥 Horno", key=f"h_{p['id']}"):
-                                    supabase.table('pedidos').update({'estado': 'En Horno'}).eq('id', p['id']).execute()
-                                    st.rerun()
-                            
-                            if p['estado'] == 'En Horno':
-                                if c_b2.button("✅ Listo", key=f"l_{p['id']}"):
-                                    supabase.table('pedidos').update({'estado': 'Listo'}).eq('id', p['id']).execute()
-                                    st.rerun()
-                                    
-                            if p['estado'] == 'Listo':
-                                if c_b3.button("🚚 Entregar", key=f"e_{p['id']}"):
-                                    supabase.table('pedidos').update({'estado': 'Entregado'}).eq('id', p['id']).execute()
-                                    # Registrar Venta en Gastos (Ingreso positivo)
-                                    registrar_gasto(p['total_pedido'] * 1, f"Venta Pedido #{p['id']} - {p['cliente_nombre']}")
-                                    st.toast("¡Pedido Entregado y Venta Registrada!")
-                                    time.sleep(1.5)
-                                    st.rerun()
-                            
-                            # Botón cancelar siempre disponible
-                            if st.button("❌ Cancelar", key=f"c_{p['id']}"):
-                                supabase.table('pedidos').update({'estado': 'Cancelado'}).eq('id', p['id']).execute()
-                                st.rerun()
-                        st.divider()
+            tablero_cocina(todas_variaciones)
 
     # ==========================================
     # 🧁 PRODUCTOS Y VARIACIONES (V11: DECIMALES LIMPIOS)
@@ -490,50 +847,6 @@ def main_app():
         st.title("🧁 Catálogo Maestro")
         st.markdown("Gestiona tus masas base y crea sus variaciones con calculadora de costos avanzada.")
 
-        # --- HELPER: Conversión para Recetas ---
-        def convertir_a_base(cantidad, unidad_receta, unidad_inventario):
-            if unidad_receta == unidad_inventario: return cantidad
-            factor_cdta = 5
-            factor_cda = 15
-
-            if unidad_inventario == 'kg':
-                if unidad_receta == 'gr': return cantidad / 1000
-                if unidad_receta == 'cdta': return (cantidad * factor_cdta) / 1000 
-                if unidad_receta == 'cda': return (cantidad * factor_cda) / 1000
-            
-            if unidad_inventario == 'gr':
-                if unidad_receta == 'kg': return cantidad * 1000
-                if unidad_receta == 'cdta': return cantidad * factor_cdta
-                if unidad_receta == 'cda': return cantidad * factor_cda
-            
-            if unidad_inventario == 'lt':
-                if unidad_receta in ['ml', 'cc']: return cantidad / 1000
-                if unidad_receta == 'cdta': return (cantidad * factor_cdta) / 1000
-                if unidad_receta == 'cda': return (cantidad * factor_cda) / 1000
-            
-            if unidad_inventario in ['ml', 'cc']:
-                if unidad_receta == 'lt': return cantidad * 1000
-                if unidad_receta == 'cdta': return cantidad * factor_cdta
-                if unidad_receta == 'cda': return cantidad * factor_cda
-            return 0 
-
-        def calcular_precio_final(costo_insumos, p_merma, p_ops, costo_mo, p_maq, p_margen, costo_empaque):
-            val_merma = costo_insumos * (p_merma / 100)
-            sub1 = costo_insumos + val_merma
-            val_ops = sub1 * (p_ops / 100)
-            sub2 = sub1 + val_ops
-            sub3 = sub2 + costo_mo
-            val_maq = sub3 * (p_maq / 100)
-            sub4 = sub3 + val_maq
-            val_ganancia = sub4 * (p_margen / 100)
-            sub5 = sub4 + val_ganancia
-            final = sub5 + costo_empaque
-            
-            return final, {
-                "insumos": costo_insumos, "merma": val_merma, "ops": val_ops,
-                "mo": costo_mo, "maq": val_maq, "ganancia": val_ganancia, "empaque": costo_empaque
-            }
-        
         def mostrar_cantidad(valor):
             if valor == int(valor): return str(int(valor))
             return f"{valor:.2f}".rstrip('0').rstrip('.')
@@ -543,16 +856,55 @@ def main_app():
         lista_productos_base = []
         mapa_productos_base = {}
 
+        indice = {"productos": {}, "variaciones": {}, "por_producto": {}}
+
         if supabase:
             try:
                 data_i = supabase.table('insumos').select("*").order('nombre').execute().data
                 mapa_insumos = {i['nombre']: i for i in data_i}
-                data_p = supabase.table('productos').select("*").order('nombre').execute().data
-                lista_productos_base = [p['nombre'] for p in data_p]
-                mapa_productos_base = {p['nombre']: p for p in data_p}
+                indice = indice_catalogo()
+                lista_productos_base = list(indice['productos'].keys())
+                mapa_productos_base = indice['productos']
             except: pass
         
-        tab_catalogo, tab_base, tab_variacion, tab_editor = st.tabs(["📖 Ver Catálogo", "✨ 1. Crear Masa Base", "🍰 2. Crear Variación", "✏️ Editor de Recetas"])
+        tab_catalogo, tab_base, tab_variacion, tab_editor, tab_recosteo = st.tabs(["📖 Ver Catálogo", "✨ 1. Crear Masa Base", "🍰 2. Crear Variación", "✏️ Editor de Recetas", "📉 Re-costeo"])
+
+        with tab_recosteo:
+            st.subheader("📉 Re-costeo del Catálogo")
+            st.caption("Recalcula todas las recetas con los precios actuales de los insumos y marca las que quedaron bajo el margen mínimo.")
+            margen_min = st.slider("Margen mínimo aceptable (%)", 0, 100, 40, key="rc_margen")
+            if supabase:
+                try:
+                    df_rc = recostear_catalogo(list(indice['variaciones'].values()), costos_insumos_variaciones())
+                except Exception as e:
+                    st.error(f"Error recosteando: {e}")
+                    df_rc = pd.DataFrame()
+
+                if df_rc.empty:
+                    st.info("No hay recetas para recostear.")
+                else:
+                    df_rc['bajo_margen'] = df_rc['margen_real'] < margen_min
+                    n_bajo = int(df_rc['bajo_margen'].sum())
+                    if n_bajo: st.warning(f"⚠️ {n_bajo} receta(s) bajo {margen_min}% de margen.")
+                    else: st.success("✅ Todas las recetas sobre el margen mínimo.")
+                    solo_bajo = st.checkbox("Mostrar solo las que están bajo el margen", value=bool(n_bajo), key="rc_solo")
+                    vista_rc = df_rc[df_rc['bajo_margen']] if solo_bajo else df_rc
+                    st.dataframe(
+                        vista_rc.drop(columns=['id']).style.format({
+                            'precio': '${:,.0f}', 'costo_insumos': '${:,.0f}', 'precio_sugerido': '${:,.0f}',
+                            'margen_objetivo': '{:.0f}%', 'margen_real': '{:.1f}%'
+                        }),
+                        hide_index=True, use_container_width=True
+                    )
+
+                    if st.button("💾 Guardar costos actualizados en las recetas", key="rc_guardar"):
+                        # Solo cambia el 'costo' de cada línea (un UPDATE en la BD); cantidades y precios de venta quedan igual
+                        try:
+                            res_act = supabase.rpc('actualizar_costos_recetas', {}).execute()
+                            invalidar_catalogo()
+                            st.toast(AVISO_COLA if en_cola(res_act) else f"✅ {res_act.data} recetas actualizadas.")
+                        except Exception as e:
+                            st.error(f"Error guardando costos: {e}")
         
         with tab_editor:
             st.subheader("✏️ Editor de Recetas")
@@ -575,17 +927,11 @@ def main_app():
                         cc1, cc2 = st.columns(2)
                         v_cant = cc1.number_input("Cant.", min_value=0.0, value=1.0, format="%.2f", step=0.1, key="edit_cant")
                         
-                        opts = [u_base]
-                        if u_base == 'kg': opts = ['gr', 'kg', 'cdta', 'cda']
-                        elif u_base == 'gr': opts = ['gr', 'kg', 'cdta', 'cda']
-                        elif u_base == 'lt': opts = ['ml', 'lt', 'cc', 'cdta', 'cda']
-                        elif u_base in ['ml', 'cc']: opts = ['ml', 'lt', 'cc', 'cdta', 'cda']
-                        v_uni = cc2.selectbox("Unidad", opts, key="edit_uni")
+                        v_uni = cc2.selectbox("Unidad", opciones_unidad(u_base, receta=True), key="edit_uni")
                         
                         if st.button("➕ Añadir", key="edit_add_btn"):
                             if v_cant > 0:
-                                cant_norm = convertir_a_base(v_cant, v_uni, u_base)
-                                costo_linea = cant_norm * d_ins['costo_unitario']
+                                costo_linea = (convertir(v_cant, v_uni, u_base) or 0) * d_ins['costo_unitario']
                                 st.session_state.edit_ingredientes.append({
                                     "nombre": insumo_k, "cantidad": v_cant, "unidad": v_uni, 
                                     "costo": costo_linea, "insumo_id": d_ins['id']
@@ -594,15 +940,11 @@ def main_app():
                     
                     st.divider()
                     st.caption("Lista de Ingredientes:")
-                    total_receta_edit = 0
+                    costos_edit = costear_ingredientes(st.session_state.edit_ingredientes, mapa_insumos)
+                    total_receta_edit = float(costos_edit.sum())
                     for idx, ing in enumerate(st.session_state.edit_ingredientes):
-                        costo_actual = ing['costo']
-                        if ing['nombre'] in mapa_insumos:
-                            d_actual = mapa_insumos[ing['nombre']]
-                            cant_norm = convertir_a_base(ing['cantidad'], ing['unidad'], d_actual['unidad_medida'])
-                            costo_actual = cant_norm * d_actual['costo_unitario']
+                        costo_actual = float(costos_edit[idx])
                         ing['costo'] = costo_actual
-                        total_receta_edit += costo_actual
                         
                         c_txt, c_btn = st.columns([4, 1])
                         cant_display = mostrar_cantidad(ing['cantidad'])
@@ -617,14 +959,15 @@ def main_app():
                     
                     with st.expander("⚙️ Configuración Avanzada de Costos", expanded=True):
                         ep1, ep2 = st.columns(2)
-                        p_merma = ep1.slider("Merma (%)", 0, 15, 5, key="ed_merma")
-                        p_ops = ep2.slider("Gastos Ops (%)", 0, 30, 15, key="ed_ops")
+                        params_edit = parametros_costo(var_data)
+                        p_merma = ep1.slider("Merma (%)", 0, 15, int(params_edit["merma"]), key="ed_merma")
+                        p_ops = ep2.slider("Gastos Ops (%)", 0, 30, int(params_edit["ops"]), key="ed_ops")
                         ep3, ep4 = st.columns(2)
-                        costo_mo = ep3.number_input("Mano de Obra ($)", value=6400, step=1000, key="ed_mo")
-                        p_maq = ep4.slider("Mantención Maq. (%)", 0, 20, 5, key="ed_maq")
+                        costo_mo = ep3.number_input("Mano de Obra ($)", value=int(params_edit["mo"]), step=1000, key="ed_mo")
+                        p_maq = ep4.slider("Mantención Maq. (%)", 0, 20, int(params_edit["maq"]), key="ed_maq")
                         st.divider()
-                        p_margen = st.slider("Margen Ganancia (%)", 10, 100, 60, key="ed_margen")
-                        costo_empaque = st.number_input("Costo Empaque ($)", value=3000, step=500, key="ed_empaque")
+                        p_margen = st.slider("Margen Ganancia (%)", 10, 100, int(params_edit["margen"]), key="ed_margen")
+                        costo_empaque = st.number_input("Costo Empaque ($)", value=int(params_edit["empaque"]), step=500, key="ed_empaque")
 
                     precio_sug_edit, breakdown = calcular_precio_final(
                         total_receta_edit, p_merma, p_ops, costo_mo, p_maq, p_margen, costo_empaque
@@ -640,14 +983,21 @@ def main_app():
                     
                     st.markdown(f"#### Precio Sugerido: ${precio_sug_edit:,.0f}")
                     precio_final_edit = st.number_input("Precio Venta Final ($)", value=int(precio_sug_edit), step=500, key="edit_precio_f")
+                    et1, et2 = st.columns(2)
+                    t_prep_edit = et1.number_input("⏱️ Preparación (min/unidad)", min_value=0, value=int(var_data.get('tiempo_prep_min') or TIEMPOS_DEFECTO[0]), step=5, key="edit_t_prep")
+                    t_horno_edit = et2.number_input("🔥 Horno (min/unidad)", min_value=0, value=int(var_data.get('tiempo_horno_min') or TIEMPOS_DEFECTO[1]), step=5, key="edit_t_horno")
                     
                     if st.button("💾 Guardar Cambios", type="primary", use_container_width=True):
                         try:
-                            supabase.table('variaciones').update({
+                            res_edit = guardar_receta(st.session_state.edit_var_id, {
                                 "precio": precio_final_edit,
-                                "ingredientes_json": json.dumps(st.session_state.edit_ingredientes)
-                            }).eq('id', st.session_state.edit_var_id).execute()
-                            st.success("¡Actualizado!")
+                                "parametros_json": json.dumps({"merma": p_merma, "ops": p_ops, "mo": costo_mo, "maq": p_maq,
+                                                               "margen": p_margen, "empaque": costo_empaque, "lote": params_edit["lote"]}),
+                                "tiempo_prep_min": t_prep_edit,
+                                "tiempo_horno_min": t_horno_edit
+                            }, st.session_state.edit_ingredientes)
+                            if res_edit is None: st.info(f"{AVISO_COLA}: receta.")
+                            else: st.success("¡Actualizado!")
                             st.session_state.edit_var_id = None
                             time.sleep(1.5)
                             st.rerun()
@@ -670,8 +1020,10 @@ def main_app():
                         exist = supabase.table('productos').select('id').eq('nombre', pb_nombre).execute().data
                         if exist: st.warning("¡Ya existe!")
                         else:
-                            supabase.table('productos').insert({"nombre": pb_nombre, "categoria": pb_cat, "imagen_url": pb_img}).execute()
-                            st.success(f"Creado: {pb_nombre}")
+                            res_base = supabase.table('productos').insert({"nombre": pb_nombre, "categoria": pb_cat, "imagen_url": pb_img}).execute()
+                            invalidar_catalogo()
+                            if en_cola(res_base): st.info(f"{AVISO_COLA}: {pb_nombre}.")
+                            else: st.success(f"Creado: {pb_nombre}")
                             time.sleep(1.5)
                             st.rerun()
                     except Exception as e: st.error(f"Error: {e}")
@@ -723,18 +1075,12 @@ def main_app():
                             label_cant = "Cantidad LOTE" if usar_lote else "Cantidad UNIDAD"
                             v_cant = cc1.number_input(label_cant, min_value=0.0, value=1.0, format="%.2f", step=0.1)
                             
-                            opts = [u_base]
-                            if u_base == 'kg': opts = ['gr', 'kg', 'cdta', 'cda']
-                            elif u_base == 'gr': opts = ['gr', 'kg', 'cdta', 'cda']
-                            elif u_base == 'lt': opts = ['ml', 'lt', 'cc', 'cdta', 'cda']
-                            elif u_base in ['ml', 'cc']: opts = ['ml', 'lt', 'cc', 'cdta', 'cda']
-                            
-                            v_uni = cc2.selectbox("Unidad", opts)
+                            v_uni = cc2.selectbox("Unidad", opciones_unidad(u_base, receta=True))
                             
                             if st.button("⬇️ Agregar"):
                                 if v_cant > 0:
                                     # 1. Normalizar a unidad base del sistema
-                                    cant_norm_sistema = convertir_a_base(v_cant, v_uni, u_base)
+                                    cant_norm_sistema = convertir(v_cant, v_uni, u_base) or 0
                                     
                                     # 2. Calcular costo (SIEMPRE con la cantidad normalizada completa)
                                     costo_linea = cant_norm_sistema * d_ins['costo_unitario']
@@ -759,14 +1105,10 @@ def main_app():
                         else:
                             st.caption(f"Ficha Técnica ({var_tamano}):")
                         
+                        # Recalcular costo actualizado por si cambió el precio del insumo (todas las líneas de una vez)
+                        costos_var = costear_ingredientes(st.session_state.var_ingredientes, mapa_insumos)
                         for i, item in enumerate(st.session_state.var_ingredientes):
-                            # Recalcular costo actualizado por si cambió el precio del insumo
-                            if item['nombre'] in mapa_insumos:
-                                d_actual = mapa_insumos[item['nombre']]
-                                cant_norm = convertir_a_base(item['cantidad'], item['unidad'], d_actual['unidad_medida'])
-                                costo_actual = cant_norm * d_actual['costo_unitario']
-                                item['costo'] = costo_actual
-                            
+                            item['costo'] = float(costos_var[i])
                             total_receta += item['costo']
                             
                             # Mostrar ingrediente
@@ -876,17 +1218,24 @@ def main_app():
                             
                             st.markdown(f"#### Precio Unitario Sugerido: ${precio_unitario_sug:,.0f}")
                             precio_final = st.number_input("Precio Venta Final Unitario ($)", value=int(precio_unitario_sug), step=100)
+                            ct1, ct2 = st.columns(2)
+                            t_prep = ct1.number_input("⏱️ Preparación (min/unidad)", min_value=0, value=TIEMPOS_DEFECTO[0], step=5)
+                            t_horno = ct2.number_input("🔥 Horno (min/unidad)", min_value=0, value=TIEMPOS_DEFECTO[1], step=5)
                             
                             if st.button("💾 Guardar Receta", type="primary", use_container_width=True):
                                 if st.session_state.var_ingredientes and var_sabor:
                                     try:
-                                        supabase.table('variaciones').insert({
+                                        res_receta = guardar_receta(None, {
                                             "producto_id": id_padre, "nombre": nombre_completo,
                                             "precio": precio_final, 
-                                            "ingredientes_json": json.dumps(st.session_state.var_ingredientes),
-                                            "rendimiento": factor_div
-                                        }).execute()
-                                        st.success(f"✅ Guardado! Precio unitario: ${precio_final:,.0f}")
+                                            "rendimiento": factor_div,
+                                            "parametros_json": json.dumps({"merma": p_merma, "ops": p_ops, "mo": costo_mo, "maq": p_maq,
+                                                                           "margen": p_margen, "empaque": costo_empaque, "lote": usar_lote}),
+                                            "tiempo_prep_min": t_prep,
+                                            "tiempo_horno_min": t_horno
+                                        }, st.session_state.var_ingredientes)
+                                        if res_receta is None: st.info(f"{AVISO_COLA}: {nombre_completo}.")
+                                        else: st.success(f"✅ Guardado! Precio unitario: ${precio_final:,.0f}")
                                         if usar_lote:
                                             st.info(f"💡 Lote completo: ${precio_final * factor_div:,.0f}")
                                         st.session_state.var_ingredientes = []
@@ -903,11 +1252,11 @@ def main_app():
         with tab_catalogo:
             st.subheader("Catálogo")
             if lista_productos_base:
-                try: all_vars = supabase.table('variaciones').select("*").order('nombre').execute().data
-                except: all_vars = []
+                try: costos_var = costos_insumos_variaciones()
+                except: costos_var = {}
                 for p_nombre in lista_productos_base:
                     p_data = mapa_productos_base[p_nombre]
-                    variaciones_p = [v for v in all_vars if v['producto_id'] == p_data['id']]
+                    variaciones_p = indice['por_producto'].get(p_data['id'], [])
                     with st.expander(f"🎂 {p_nombre} ({len(variaciones_p)} var)"):
                         col_img, col_info, col_actions = st.columns([2, 3, 1])
                         with col_img:
@@ -921,21 +1270,20 @@ def main_app():
                                     with st.container():
                                         c_v1, c_v2 = st.columns([3, 1])
                                         c_v1.markdown(f"**{v['nombre']}** - ${v['precio']:,.0f}")
+                                        if v['id'] in costos_var:
+                                            c_v1.caption(f"Insumos hoy: ${costos_var[v['id']]:,.0f} por unidad")
                                         with c_v2:
                                             if st.button("✏️", key=f"edit_{v['id']}"):
                                                 st.session_state.edit_var_id = v['id']
                                                 st.session_state.edit_var_data = v
-                                                try: st.session_state.edit_ingredientes = json.loads(v['ingredientes_json'])
-                                                except: st.session_state.edit_ingredientes = []
+                                                st.session_state.edit_ingredientes = [dict(i) for i in v['ingredientes']]
                                                 st.toast("Cargado en Editor ➡️")
                                             if st.button("🗑️", key=f"del_v_{v['id']}"):
-                                                supabase.table('variaciones').delete().eq('id', v['id']).execute()
+                                                if en_cola(supabase.table('variaciones').delete().eq('id', v['id']).execute()): st.toast(AVISO_COLA)
+                                                invalidar_catalogo()
                                                 st.rerun()
                                         with st.popover("Ver ingredientes"):
-                                            try:
-                                                ings = json.loads(v['ingredientes_json'])
-                                                for i in ings: st.markdown(f"**• {i['cantidad']} {i['unidad']} {i['nombre']}**")
-                                            except: pass
+                                            for i in v['ingredientes']: st.markdown(f"**• {mostrar_cantidad(i['cantidad'])} {i['unidad'] or ''} {i['nombre']}**")
                                     st.divider()
                         with col_actions:
                             with st.popover("⚙️ Config"):
@@ -943,10 +1291,13 @@ def main_app():
                                 new_cat_b = st.selectbox("Cat", ["Tortas", "Cóctel", "Individuales", "Bollería"], key=f"c_{p_data['id']}")
                                 new_img_b = st.text_input("URL", p_data.get('imagen_url', ''), key=f"i_{p_data['id']}")
                                 if st.button("Guardar", key=f"save_b_{p_data['id']}"):
-                                    supabase.table('productos').update({"nombre": new_name_b, "categoria": new_cat_b, "imagen_url": new_img_b}).eq('id', p_data['id']).execute()
+                                    res_b = supabase.table('productos').update({"nombre": new_name_b, "categoria": new_cat_b, "imagen_url": new_img_b}).eq('id', p_data['id']).execute()
+                                    if en_cola(res_b): st.toast(AVISO_COLA)
+                                    invalidar_catalogo()
                                     st.rerun()
                             if st.button("🗑️ Borrar", key=f"del_b_{p_data['id']}"):
-                                supabase.table('productos').delete().eq('id', p_data['id']).execute()
+                                if en_cola(supabase.table('productos').delete().eq('id', p_data['id']).execute()): st.toast(AVISO_COLA)
+                                invalidar_catalogo()
                                 st.rerun()
             else: st.info("Crea una masa base primero.")
 
@@ -956,15 +1307,6 @@ def main_app():
     elif menu == "📦 Inventario":
         st.title("📦 Inventario y Costos")
 
-        # --- HELPER CONVERSIÓN ---
-        def normalizar_cantidad(cantidad, unidad_origen, unidad_destino):
-            if unidad_origen == unidad_destino: return cantidad
-            if unidad_destino == 'kg' and unidad_origen == 'gr': return cantidad / 1000
-            if unidad_destino == 'gr' and unidad_origen == 'kg': return cantidad * 1000
-            if unidad_destino == 'lt' and (unidad_origen == 'ml' or unidad_origen == 'cc'): return cantidad / 1000
-            if (unidad_destino == 'ml' or unidad_destino == 'cc') and unidad_origen == 'lt': return cantidad * 1000
-            return None
-        
         def mostrar_cantidad(valor, unidad=None):
             if unidad == 'unidades': return str(int(valor))
             if valor == int(valor): return str(int(valor))
@@ -982,11 +1324,13 @@ def main_app():
                 st.error(f"Error cargando inventario: {e}")
 
         # TABS
-        tab_compra, tab_nuevo, tab_precios, tab_stock = st.tabs([
+        tab_compra, tab_factura, tab_nuevo, tab_precios, tab_stock, tab_mov = st.tabs([
             "🛒 Registrar Compra", 
+            "🧾 Importar Factura",
             "✨ Crear Nuevo Insumo", 
             "💲 Actualizar Precios Mercado", 
-            "📋 Ver y Ajustar Stock"
+            "📋 Ver y Ajustar Stock",
+            "📜 Movimientos"
         ])
 
         # ---------------------------------------------------------
@@ -1009,12 +1353,7 @@ def main_app():
 
                     c1, c2, c3 = st.columns(3)
                     
-                    opts = [u_base]
-                    if u_base == 'kg': opts = ['kg', 'gr']
-                    elif u_base == 'gr': opts = ['gr', 'kg']
-                    elif u_base == 'lt': opts = ['lt', 'ml', 'cc']
-                    elif u_base == 'ml': opts = ['ml', 'lt']
-                    elif u_base == 'unidades': opts = ['unidades']
+                    opts = opciones_unidad(u_base)
                     
                     with c2:
                         u_compra = st.selectbox("Unidad Compra", opts, key="c_u")
@@ -1027,19 +1366,88 @@ def main_app():
                         total_pago = st.number_input("Total Pagado ($)", min_value=0, value=0, step=1000, key="c_p")
 
                     if st.button("✅ Ingresar Stock"):
-                        cant_norm = normalizar_cantidad(cant_input, u_compra, u_base) if u_compra != u_base else cant_input
+                        cant_norm = convertir(cant_input, u_compra, u_base)
                         if cant_norm:
-                            nuevo_precio_ref = total_pago / cant_norm if cant_norm > 0 else datos['costo_unitario']
-                            supabase.table('insumos').update({
-                                "stock_actual": datos['stock_actual'] + cant_norm,
-                                "costo_unitario": nuevo_precio_ref
-                            }).eq('id', datos['id']).execute()
-                            
-                            registrar_gasto(total_pago, f"Compra: {insumo_selec}")
-                            st.toast("✅ Stock ingresado.")
-                            time.sleep(1)
+                            # El costo de referencia pasa a ser el promedio ponderado (o la capa FIFO vigente), no el de esta compra
+                            if registrar_compras([{"insumo_id": datos['id'], "cantidad": cant_norm, "costo_total": total_pago, "descripcion": f"Compra: {insumo_selec}"}]) is None:
+                                st.toast(AVISO_COLA)
+                            else: st.toast("✅ Stock ingresado.")
                             st.rerun()
 
+        # ---------------------------------------------------------
+        # TAB 1b: IMPORTAR FACTURA
+        # ---------------------------------------------------------
+        with tab_factura:
+            st.subheader("Importar Factura o Boleta de Proveedor")
+            st.caption("Columnas: **ITEM**, **CANTIDAD**, **UNIDAD** (opcional; si falta se usa la del insumo) y **TOTAL** pagado por la línea.")
+            if 'n_factura' not in st.session_state: st.session_state.n_factura = 0
+            if 'resultado_factura' in st.session_state:
+                resultado = st.session_state.pop('resultado_factura')
+                if resultado is None: st.info(f"{AVISO_COLA}: factura.")
+                else:
+                    st.success(f"✅ Factura ingresada ({len(resultado)} insumos).")
+                    with st.expander("Ver stock actualizado"):
+                        for r in resultado: st.write(r)
+
+            c_arch, c_prov, c_fecha = st.columns([2, 1, 1])
+            archivo_fac = c_arch.file_uploader("Archivo CSV o Excel", type=['csv', 'xlsx', 'xls'], key=f"fac_{st.session_state.n_factura}")
+            proveedor = c_prov.text_input("Proveedor", key="fac_prov")
+            fecha_fac = c_fecha.date_input("Fecha de compra", key="fac_fecha")
+
+            if archivo_fac and insumos_existentes:
+                try:
+                    if archivo_fac.name.endswith('.csv'):
+                        df_fac = pd.read_csv(archivo_fac, dtype=str, sep=None, engine='python')
+                    else:
+                        df_fac = pd.read_excel(archivo_fac, dtype=str)
+                    lineas_fac = preparar_factura(df_fac, data)
+                except Exception as e:
+                    st.error(f"No se pudo leer la factura: {e}")
+                    lineas_fac = None
+
+                if lineas_fac is not None and not lineas_fac.empty:
+                    st.caption("Revisa el insumo sugerido (la similitud indica qué tan seguro es el emparejamiento) y corrige lo que haga falta.")
+                    revisadas = st.data_editor(
+                        lineas_fac, hide_index=True, use_container_width=True, key=f"fac_ed_{st.session_state.n_factura}",
+                        disabled=['fila', 'item', 'similitud'],
+                        column_config={
+                            "fila": st.column_config.NumberColumn("Fila", width="small"),
+                            "item": "En la factura",
+                            "insumo": st.column_config.SelectboxColumn("Insumo", options=insumos_existentes),
+                            "similitud": st.column_config.ProgressColumn("Similitud", min_value=0, max_value=1, format="%.2f"),
+                            "cantidad": st.column_config.NumberColumn("Cantidad", min_value=0.0),
+                            "unidad": st.column_config.SelectboxColumn("Unidad", options=list(UNIDADES)),
+                            "total": st.column_config.NumberColumn("Total ($)", min_value=0, format="$%d"),
+                        })
+                    fac = convertir_factura(revisadas, mapa_insumos)
+                    errores_fac = fac[fac['error'] != '']
+                    if not errores_fac.empty:
+                        st.error(f"Hay {len(errores_fac)} líneas por corregir antes de ingresar la factura.")
+                        st.dataframe(errores_fac[['fila', 'item', 'error']], hide_index=True, use_container_width=True)
+                    else:
+                        # Varias líneas del mismo insumo se suman en un solo ingreso
+                        por_insumo = fac.groupby(['insumo_id', 'insumo', 'unidad_base'], as_index=False).agg(cantidad=('cantidad_base', 'sum'), total=('total', 'sum'))
+                        por_insumo['costo_unitario'] = por_insumo['total'] / por_insumo['cantidad']
+                        por_insumo['costo_anterior'] = por_insumo['insumo'].map(lambda n: mapa_insumos[n]['costo_unitario'])
+                        st.dataframe(por_insumo[['insumo', 'cantidad', 'unidad_base', 'total', 'costo_unitario', 'costo_anterior']], hide_index=True, use_container_width=True,
+                                     column_config={"total": st.column_config.NumberColumn("Total", format="$%d"),
+                                                    "costo_unitario": st.column_config.NumberColumn("Costo factura / u", format="$%.2f"),
+                                                    "costo_anterior": st.column_config.NumberColumn("Costo actual / u", format="$%.2f")})
+                        st.metric("Total factura", f"${fac['total'].sum():,.0f}")
+                        if st.button(f"✅ Ingresar {len(por_insumo)} insumos", type="primary", key="fac_ok"):
+                            sufijo = f" ({proveedor})" if proveedor else ""
+                            try:
+                                st.session_state.resultado_factura = registrar_compras([
+                                    {"insumo_id": int(r.insumo_id), "cantidad": float(r.cantidad), "costo_total": float(r.total), "descripcion": f"Compra: {r.insumo}{sufijo}"}
+                                    for r in por_insumo.itertuples()
+                                ], fecha=str(fecha_fac))
+                                st.session_state.n_factura += 1
+                                st.rerun()
+                            except Exception as e:
+                                st.error(f"Error ingresando la factura: {e}")
+            elif archivo_fac:
+                st.warning("Crea insumos primero.")
+
         # ---------------------------------------------------------
         # TAB 2: CREAR NUEVO INSUMO
         # ---------------------------------------------------------
@@ -1052,12 +1460,7 @@ def main_app():
             st.markdown("##### 🏷️ Precio de Referencia Inicial")
             c_form1, c_form2, c_form3 = st.columns(3)
             
-            opts = [new_unidad]
-            if new_unidad == 'kg': opts = ['kg', 'gr']
-            elif new_unidad == 'gr': opts = ['gr', 'kg']
-            elif new_unidad == 'lt': opts = ['lt', 'ml', 'cc']
-            elif new_unidad == 'ml': opts = ['ml', 'lt']
-            elif new_unidad == 'unidades': opts = ['unidades']
+            opts = opciones_unidad(new_unidad)
             
             with c_form2: uni_ref = st.selectbox("Unidad del envase", opts, key="n_u")
             with c_form1: 
@@ -1069,17 +1472,23 @@ def main_app():
             
             if st.button("💾 Crear Ficha"):
                 if new_nombre:
-                    cant_norm = normalizar_cantidad(cant_ref, uni_ref, new_unidad) if uni_ref != new_unidad else cant_ref
+                    cant_norm = convertir(cant_ref, uni_ref, new_unidad)
                     if cant_norm and cant_norm > 0:
                         costo_base_calc = precio_ref / cant_norm
                         try:
-                            supabase.table('insumos').insert({
+                            res_nuevo = supabase.table('insumos').insert({
                                 "nombre": new_nombre, 
                                 "unidad_medida": new_unidad, 
                                 "stock_actual": 0, 
                                 "costo_unitario": costo_base_calc
                             }).execute()
-                            st.success(f"✅ Creado: {new_nombre}")
+                            if en_cola(res_nuevo):
+                                # Sin id todavía: el registro de costeo parte de costo_unitario al primer movimiento
+                                st.info(f"{AVISO_COLA}: {new_nombre}.")
+                            else:
+                                # Deja creado el registro de costeo con este precio como punto de partida
+                                if res_nuevo.data: fijar_costo(res_nuevo.data[0]['id'], costo_base_calc)
+                                st.success(f"✅ Creado: {new_nombre}")
                             time.sleep(1.5)
                             st.rerun()
                         except Exception as e: st.error(f"Error: {e}")
@@ -1103,12 +1512,7 @@ def main_app():
                         c_p1, c_p2, c_p3 = st.columns([1.5, 1, 1.5])
                         
                         u_base = mapa_insumos[insumo_upd]['unidad_medida']
-                        opts_p = [u_base]
-                        if u_base == 'kg': opts_p = ['kg', 'gr']
-                        elif u_base == 'gr': opts_p = ['gr', 'kg']
-                        elif u_base == 'lt': opts_p = ['lt', 'ml', 'cc']
-                        elif u_base == 'ml': opts_p = ['ml', 'lt']
-                        elif u_base == 'unidades': opts_p = ['unidades']
+                        opts_p = opciones_unidad(u_base)
                         
                         with c_p2: uni_envase = st.selectbox("Unidad", opts_p, key="p_u")
                         with c_p1: 
@@ -1118,14 +1522,16 @@ def main_app():
                                 cant_envase = st.number_input("Contenido", min_value=0.0, value=1.0, format="%.2f", step=0.1, key="p_c")
                         with c_p3: precio_envase = st.number_input("Precio Total ($)", min_value=0, value=0, step=1000, key="p_p")
                         
-                        cant_norm_p = normalizar_cantidad(cant_envase, uni_envase, u_base) if uni_envase != u_base else cant_envase
+                        cant_norm_p = convertir(cant_envase, uni_envase, u_base)
                         if cant_norm_p and cant_norm_p > 0 and precio_envase > 0:
                             nuevo_costo_base = precio_envase / cant_norm_p
                             if u_base == 'gr' and cant_envase < 1 and uni_envase == 'gr':
                                 st.warning("⚠️ Cuidado: Pusiste menos de 1 gramo.")
                             st.success(f"💡 El **{u_base}** vale **${nuevo_costo_base:,.2f}**")
+                            if (mapa_insumos[insumo_upd]['stock_actual'] or 0) > 0:
+                                st.caption("El stock actual se revaloriza a este costo (promedio y capas FIFO); la diferencia queda en el libro de movimientos.")
                             if st.button("💾 Actualizar Precio Base", type="primary"):
-                                supabase.table('insumos').update({"costo_unitario": nuevo_costo_base}).eq('id', mapa_insumos[insumo_upd]['id']).execute()
+                                if fijar_costo(mapa_insumos[insumo_upd]['id'], nuevo_costo_base) is None: st.toast(AVISO_COLA)
                                 st.rerun()
 
                 st.divider()
@@ -1154,12 +1560,7 @@ def main_app():
                     with c_aj_2:
                         tipo_ajuste = st.radio("Acción", ["➕ Sumar al stock", "📌 Fijar stock total"], horizontal=True, label_visibility="collapsed")
                     
-                    opts_aj = [u_base]
-                    if u_base == 'kg': opts_aj = ['kg', 'gr']
-                    elif u_base == 'gr': opts_aj = ['gr', 'kg']
-                    elif u_base == 'lt': opts_aj = ['lt', 'ml', 'cc']
-                    elif u_base == 'ml': opts_aj = ['ml', 'lt']
-                    elif u_base == 'unidades': opts_aj = ['unidades']
+                    opts_aj = opciones_unidad(u_base)
                     
                     c_aj_3, c_aj_4 = st.columns([1.5, 1.5])
                     
@@ -1172,7 +1573,7 @@ def main_app():
                         else:
                             cant_ajuste = st.number_input("Cantidad", min_value=0.0, value=1.0, format="%.2f", step=0.1, key="aj_cant")
                     
-                    cant_norm_aj = normalizar_cantidad(cant_ajuste, uni_ajuste, u_base) if uni_ajuste != u_base else cant_ajuste
+                    cant_norm_aj = convertir(cant_ajuste, uni_ajuste, u_base)
                     
                     if cant_norm_aj is not None:
                         nuevo_stock = 0
@@ -1188,8 +1589,12 @@ def main_app():
                         stock_display = mostrar_cantidad(nuevo_stock, u_base)
                         
                         if st.button(f"💾 Guardar: Stock quedará en {stock_display} {u_base}", use_container_width=True):
-                            supabase.table('insumos').update({"stock_actual": nuevo_stock}).eq('id', dat_aj['id']).execute()
-                            st.success(f"✅ {msg_accion}. Nuevo total: {stock_display} {u_base}")
+                            if tipo_ajuste == "➕ Sumar al stock":
+                                res_aj = mover_stock([{"insumo_id": dat_aj['id'], "delta": cant_norm_aj, "tipo": "ajuste"}])
+                            else:
+                                res_aj = fijar_stock(dat_aj['id'], nuevo_stock)
+                            if res_aj is None: st.info(f"{AVISO_COLA}: {msg_accion}.")
+                            else: st.success(f"✅ {msg_accion}. Nuevo total: {stock_display} {u_base}")
                             time.sleep(1.5)
                             st.rerun()
 
@@ -1197,14 +1602,80 @@ def main_app():
             
             if insumos_existentes:
                 df = pd.DataFrame(list(mapa_insumos.values()))
-                st.dataframe(df[['nombre', 'stock_actual', 'unidad_medida', 'costo_unitario']], use_container_width=True)
+                try:
+                    costos = pd.DataFrame(supabase.table('costos_insumo').select("insumo_id, metodo, costo_promedio, valor").execute().data)
+                    if not costos.empty:
+                        df = df.merge(costos, left_on='id', right_on='insumo_id', how='left')
+                except: pass
+                columnas = [c for c in ['nombre', 'stock_actual', 'unidad_medida', 'costo_unitario', 'metodo', 'costo_promedio', 'valor'] if c in df.columns]
+                st.dataframe(df[columnas], use_container_width=True)
                 
+                with st.popover("⚖️ Método de Costeo"):
+                    st.caption("Promedio ponderado: cada compra se mezcla con lo que hay. FIFO: se consume primero lo más antiguo.")
+                    ins_met = st.selectbox("Insumo", insumos_existentes, index=None, key="met_item")
+                    metodo_sel = st.radio("Método", ["promedio", "fifo"], horizontal=True, key="met_sel")
+                    if ins_met and st.button("Guardar método", key="met_btn"):
+                        res_met = supabase.rpc('cambiar_metodo_costeo', {"p_insumo_id": mapa_insumos[ins_met]['id'], "p_metodo": metodo_sel}).execute()
+                        if en_cola(res_met): st.toast(AVISO_COLA)
+                        st.rerun()
+
                 with st.popover("🗑️ Borrar Insumo"):
                     to_del = st.selectbox("Eliminar permanentemente:", insumos_existentes, index=None)
                     if to_del:
                         if st.button(f"Confirmar Borrado de {to_del}"):
-                            supabase.table('insumos').delete().eq('nombre', to_del).execute()
-                            st.rerun()
+                            try:
+                                if en_cola(supabase.table('insumos').delete().eq('nombre', to_del).execute()): st.toast(AVISO_COLA)
+                                st.rerun()
+                            except Exception as e:
+                                # El libro de movimientos no se borra: un insumo con historial queda con stock 0
+                                if 'foreign key' in str(e).lower() or '23503' in str(e):
+                                    st.error(f"{to_del} tiene movimientos en el libro y no se puede borrar. Deja su stock en 0.")
+                                else: st.error(f"Error: {e}")
+
+        # ---------------------------------------------------------
+        # TAB 5: LIBRO DE MOVIMIENTOS
+        # ---------------------------------------------------------
+        with tab_mov:
+            st.subheader("📜 Libro de Movimientos")
+            st.caption("Cada entrega, devolución, compra y ajuste queda registrado. El stock de una fecha se reconstruye desde el último snapshot.")
+
+            c_m1, c_m2 = st.columns([2, 1])
+            filtro_mov = c_m1.selectbox("Insumo", insumos_existentes, index=None, placeholder="Todos", key="mov_item")
+            limite_mov = c_m2.number_input("Últimos", min_value=10, max_value=1000, value=100, step=10, key="mov_lim")
+
+            if supabase:
+                try:
+                    q_mov = supabase.table('movimientos_inventario').select("id, fecha, insumo_id, tipo, cantidad, referencia_tipo, referencia_id, usuario")
+                    if filtro_mov: q_mov = q_mov.eq('insumo_id', mapa_insumos[filtro_mov]['id'])
+                    movs = q_mov.order('id', desc=True).limit(limite_mov).execute().data
+                    if movs:
+                        nombres_id = {i['id']: i['nombre'] for i in mapa_insumos.values()}
+                        df_mov = pd.DataFrame(movs)
+                        df_mov['insumo'] = df_mov['insumo_id'].map(nombres_id)
+                        df_mov['fecha'] = pd.to_datetime(df_mov['fecha']).dt.strftime('%d/%m/%Y %H:%M')
+                        st.dataframe(df_mov[['fecha', 'insumo', 'tipo', 'cantidad', 'referencia_tipo', 'referencia_id', 'usuario']], hide_index=True, use_container_width=True)
+                    else:
+                        st.info("Sin movimientos registrados.")
+                except Exception as e:
+                    st.error(f"Error cargando movimientos: {e}")
+
+                st.divider()
+                st.markdown("##### 🕰️ Stock a una fecha")
+                c_f1, c_f2 = st.columns([2, 1])
+                fecha_corte = c_f1.date_input("Fecha de corte", value=datetime.now(ZONA_NEGOCIO).date(), key="mov_fecha")
+                if c_f2.button("📸 Generar snapshot ahora", use_container_width=True):
+                    try:
+                        filas = supabase.rpc('generar_snapshot_inventario', {}).execute().data
+                        st.toast(f"Snapshot guardado ({filas} insumos).", icon="✅")
+                    except Exception as e:
+                        st.error(f"Error generando snapshot: {e}")
+                try:
+                    corte = datetime.combine(fecha_corte, datetime.max.time(), tzinfo=ZONA_NEGOCIO).isoformat()
+                    stock_fecha = supabase.rpc('stock_a_fecha', {"p_fecha": corte}).execute().data
+                    if stock_fecha:
+                        st.dataframe(pd.DataFrame(stock_fecha)[['insumo', 'stock', 'unidad_medida']], hide_index=True, use_container_width=True)
+                except Exception as e:
+                    st.error(f"Error calculando stock: {e}")
                             
     # ==========================================
     # ⚙️ CONFIGURACIÓN (V3: CORRECCIÓN DE TABLA 'GASTOS')
@@ -1228,14 +1699,20 @@ def main_app():
         
         c1, c2 = st.columns(2)
         with c1:
-            with st.expander("🗑️ Borrar Inventario Físico"):
-                st.warning("Borra todos los insumos y stock.")
-                if st.checkbox("Confirmar borrado inventario", key="chk_inv_del"):
-                    if st.button("💣 EJECUTAR BORRADO INV"):
-                        supabase.table('insumos').delete().neq('id', 0).execute()
-                        st.success("Inventario Reiniciado")
-                        time.sleep(2)
-                        st.rerun()
+            with st.expander("🗑️ Reiniciar Inventario Físico"):
+                st.warning("Deja en 0 el stock de todos los insumos. Queda en el libro como ajuste; el historial no se borra.")
+                if st.checkbox("Confirmar reinicio inventario", key="chk_inv_del"):
+                    if st.button("💣 EJECUTAR REINICIO INV"):
+                        try:
+                            # fijar_stock calcula la diferencia con la fila bloqueada: no pisa un movimiento en curso
+                            en_espera = sum(fijar_stock(ins['id'], 0) is None
+                                            for ins in supabase.table('insumos').select("id").neq('stock_actual', 0).execute().data)
+                            if en_espera: st.info(f"{AVISO_COLA}: {en_espera} insumo(s).")
+                            else: st.success("Inventario Reiniciado")
+                            time.sleep(2)
+                            st.rerun()
+                        except Exception as e:
+                            st.error(f"Error: {e}")
 
         with c2:
             with st.expander("💰 Borrar Historial Financiero"):
@@ -1243,8 +1720,8 @@ def main_app():
                 if st.checkbox("Confirmar borrado financiero", key="chk_fin_del"):
                     if st.button("💣 EJECUTAR BORRADO FINANZAS"):
                         try:
-                            # CORRECCIÓN AQUÍ: 'gastos' en lugar de 'transacciones'
-                            supabase.table('gastos').delete().neq('id', 0).execute()
+                            # Los totales mensuales se descuentan solos al borrar del libro
+                            supabase.table('libro_financiero').delete().neq('id', 0).execute()
                             st.success("Historial Financiero Reiniciado")
                             time.sleep(2)
                             st.rerun()
@@ -0,0 +1,30 @@
+-- Movimientos de stock atómicos.
+-- El ERP ya no lee stock_actual, calcula en Python y lo vuelve a escribir: envía deltas y la BD
+-- aplica stock_actual = stock_actual + delta. Dos entregas o compras simultáneas ya no se pisan.
+
+create or replace function aplicar_movimientos_stock(movimientos jsonb)
+returns table (insumo_id bigint, insumo text, stock_anterior numeric, stock_nuevo numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  -- Bloqueo en orden de id: dos lotes concurrentes nunca quedan esperándose en cruz (sin deadlocks)
+  perform 1
+     from insumos i
+    where i.id in (select (m->>'insumo_id')::bigint from jsonb_array_elements(movimientos) m)
+    order by i.id
+      for update;
+
+  return query
+  with deltas as (
+    select m.insumo_id, sum(m.delta) as delta
+      from jsonb_to_recordset(movimientos) as m(insumo_id bigint, delta numeric)
+     group by m.insumo_id
+  )
+  update insumos i
+     set stock_actual = i.stock_actual + d.delta
+    from deltas d
+   where i.id = d.insumo_id
+  returning i.id::bigint, i.nombre::text, (i.stock_actual - d.delta)::numeric, i.stock_actual::numeric;
+end;
+$$;
@@ -0,0 +1,156 @@
+-- Libro de movimientos de inventario (append-only) con snapshots periódicos.
+-- insumos.stock_actual sigue siendo la copia caliente que lee la app; el libro permite auditar
+-- cada cambio y reconstruir el stock de cualquier fecha como snapshot + cola corta de movimientos.
+
+create table if not exists movimientos_inventario (
+  id bigint generated always as identity primary key,
+  fecha timestamptz not null default now(),
+  insumo_id bigint not null references insumos(id) on delete cascade,
+  tipo text not null default 'ajuste' check (tipo in ('entrega', 'devolucion', 'compra', 'ajuste')),
+  cantidad numeric not null,          -- unidad base del insumo; negativo = salida
+  referencia_tipo text,               -- 'pedido' | 'compra'
+  referencia_id bigint,
+  usuario text
+);
+create index if not exists idx_mov_inv_insumo on movimientos_inventario (insumo_id, id);
+create index if not exists idx_mov_inv_fecha on movimientos_inventario (fecha);
+
+create table if not exists snapshots_inventario (
+  id bigint generated always as identity primary key,
+  fecha timestamptz not null default now(),
+  insumo_id bigint not null references insumos(id) on delete cascade,
+  stock numeric not null,
+  ultimo_movimiento_id bigint not null  -- el snapshot incluye todos los movimientos hasta este id
+);
+create index if not exists idx_snap_inv_insumo_fecha on snapshots_inventario (insumo_id, fecha desc);
+
+-- Punto de partida: el stock actual sin movimientos previos
+insert into snapshots_inventario (insumo_id, stock, ultimo_movimiento_id)
+select i.id, i.stock_actual, 0
+  from insumos i
+ where not exists (select 1 from snapshots_inventario s where s.insumo_id = i.id);
+
+-- Ahora cada delta deja su fila en el libro dentro de la misma transacción
+drop function if exists aplicar_movimientos_stock(jsonb);
+
+create or replace function aplicar_movimientos_stock(movimientos jsonb, usuario text default null)
+returns table (insumo_id bigint, insumo text, stock_anterior numeric, stock_nuevo numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  perform 1
+     from insumos i
+    where i.id in (select (m->>'insumo_id')::bigint from jsonb_array_elements(movimientos) m)
+    order by i.id
+      for update;
+
+  insert into movimientos_inventario (insumo_id, tipo, cantidad, referencia_tipo, referencia_id, usuario)
+  select m.insumo_id, coalesce(m.tipo, 'ajuste'), m.delta, m.referencia_tipo, m.referencia_id, aplicar_movimientos_stock.usuario
+    from jsonb_to_recordset(movimientos) as m(insumo_id bigint, delta numeric, tipo text, referencia_tipo text, referencia_id bigint)
+   where m.delta <> 0
+     and exists (select 1 from insumos i where i.id = m.insumo_id);
+
+  return query
+  with deltas as (
+    select m.insumo_id, sum(m.delta) as delta
+      from jsonb_to_recordset(movimientos) as m(insumo_id bigint, delta numeric)
+     group by m.insumo_id
+  )
+  update insumos i
+     set stock_actual = i.stock_actual + d.delta
+    from deltas d
+   where i.id = d.insumo_id
+  returning i.id::bigint, i.nombre::text, (i.stock_actual - d.delta)::numeric, i.stock_actual::numeric;
+end;
+$$;
+
+-- "Fijar stock total": se registra como ajuste por la diferencia, calculada con la fila bloqueada
+create or replace function fijar_stock_insumo(p_insumo_id bigint, p_stock numeric, p_usuario text default null)
+returns table (insumo_id bigint, insumo text, stock_anterior numeric, stock_nuevo numeric)
+language plpgsql
+as $$
+declare
+  v_actual numeric;
+begin
+  select stock_actual into v_actual from insumos where id = p_insumo_id for update;
+  if not found then
+    return;
+  end if;
+  return query
+  select * from aplicar_movimientos_stock(
+    jsonb_build_array(jsonb_build_object('insumo_id', p_insumo_id, 'delta', p_stock - v_actual, 'tipo', 'ajuste')),
+    p_usuario
+  );
+end;
+$$;
+
+-- Stock de cada insumo a una fecha: último snapshot anterior + movimientos posteriores hasta la fecha
+create or replace function stock_a_fecha(p_fecha timestamptz)
+returns table (insumo_id bigint, insumo text, unidad_medida text, stock numeric)
+language sql stable
+as $$
+  select i.id::bigint, i.nombre::text, i.unidad_medida::text,
+         (coalesce(s.stock, 0) + coalesce((
+            select sum(m.cantidad)
+              from movimientos_inventario m
+             where m.insumo_id = i.id
+               and m.id > coalesce(s.ultimo_movimiento_id, 0)
+               and m.fecha <= p_fecha
+         ), 0))::numeric
+    from insumos i
+    left join lateral (
+      select sn.stock, sn.ultimo_movimiento_id
+        from snapshots_inventario sn
+       where sn.insumo_id = i.id and sn.fecha <= p_fecha
+       order by sn.fecha desc
+       limit 1
+    ) s on true
+   order by i.nombre;
+$$;
+
+-- Nuevo snapshot = snapshot anterior + cola; deja la cola vacía para las lecturas siguientes
+create or replace function generar_snapshot_inventario()
+returns integer
+language plpgsql
+as $$
+declare
+  v_hasta bigint;
+  v_filas integer;
+begin
+  -- Espera a que terminen los movimientos en curso para que ninguno quede fuera del corte
+  lock table movimientos_inventario in share mode;
+  select coalesce(max(id), 0) into v_hasta from movimientos_inventario;
+
+  insert into snapshots_inventario (insumo_id, stock, ultimo_movimiento_id)
+  select i.id,
+         coalesce(s.stock, 0) + coalesce((
+           select sum(m.cantidad)
+             from movimientos_inventario m
+            where m.insumo_id = i.id
+              and m.id > coalesce(s.ultimo_movimiento_id, 0)
+              and m.id <= v_hasta
+         ), 0),
+         v_hasta
+    from insumos i
+    left join lateral (
+      select sn.stock, sn.ultimo_movimiento_id
+        from snapshots_inventario sn
+       where sn.insumo_id = i.id
+       order by sn.fecha desc
+       limit 1
+    ) s on true;
+
+  get diagnostics v_filas = row_count;
+  return v_filas;
+end;
+$$;
+
+-- Snapshot diario si el proyecto tiene pg_cron habilitado
+do $$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule('snapshot-inventario', '0 4 * * *', 'select generar_snapshot_inventario()');
+  end if;
+end;
+$$;
@@ -0,0 +1,46 @@
+-- Marcadores para la caché de recetas compiladas en la app.
+-- variaciones.receta_actualizada_en cambia solo cuando cambian ingredientes o rendimiento;
+-- insumos.unidad_actualizada_en solo cuando cambia la unidad base o el nombre (no con cada movimiento de stock).
+
+alter table variaciones add column if not exists receta_actualizada_en timestamptz not null default now();
+alter table insumos add column if not exists unidad_actualizada_en timestamptz not null default now();
+
+create or replace function marcar_receta_actualizada()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'INSERT'
+     or new.ingredientes_json is distinct from old.ingredientes_json
+     or new.rendimiento is distinct from old.rendimiento then
+    new.receta_actualizada_en := clock_timestamp();
+  end if;
+  return new;
+end;
+$$;
+
+create or replace function marcar_unidad_actualizada()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op = 'INSERT'
+     or new.unidad_medida is distinct from old.unidad_medida
+     or new.nombre is distinct from old.nombre then
+    new.unidad_actualizada_en := clock_timestamp();
+  end if;
+  return new;
+end;
+$$;
+
+drop trigger if exists trg_variaciones_receta on variaciones;
+create trigger trg_variaciones_receta
+  before insert or update on variaciones
+  for each row execute function marcar_receta_actualizada();
+
+drop trigger if exists trg_insumos_unidad on insumos;
+create trigger trg_insumos_unidad
+  before insert or update on insumos
+  for each row execute function marcar_unidad_actualizada();
+
+create index if not exists idx_insumos_unidad_actualizada on insumos (unidad_actualizada_en desc);
@@ -0,0 +1,20 @@
+-- Parámetros de costeo de cada variación (merma, ops, mano de obra, maquinaria, margen, empaque, lote)
+-- para poder recalcular todo el catálogo cuando cambian los precios de los insumos.
+alter table variaciones add column if not exists parametros_json text;
+
+-- Guarda en una sola llamada los costos por línea recalculados: [{id, ingredientes_json}, ...]
+create or replace function actualizar_costos_recetas(cambios jsonb)
+returns integer
+language plpgsql
+as $$
+declare
+  v_filas integer;
+begin
+  update variaciones v
+     set ingredientes_json = c.ingredientes_json
+    from jsonb_to_recordset(cambios) as c(id bigint, ingredientes_json text)
+   where v.id = c.id;
+  get diagnostics v_filas = row_count;
+  return v_filas;
+end;
+$$;
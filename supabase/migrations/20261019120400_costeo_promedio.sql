@@ -0,0 +1,192 @@
+-- Costeo de insumos: promedio ponderado móvil con capas FIFO opcionales.
+-- El estado vive en un registro compacto por insumo (costos_insumo) que se actualiza en O(1) con cada
+-- compra o consumo; las capas solo guardan existencias pendientes, no el historial de compras.
+
+alter table movimientos_inventario add column if not exists costo numeric;  -- valor del movimiento (negativo = salida)
+
+create table if not exists costos_insumo (
+  insumo_id bigint primary key references insumos(id) on delete cascade,
+  metodo text not null default 'promedio' check (metodo in ('promedio', 'fifo')),
+  cantidad numeric not null default 0,
+  valor numeric not null default 0,
+  costo_promedio numeric not null default 0,
+  actualizado_en timestamptz not null default now()
+);
+
+create table if not exists capas_costo_insumo (
+  id bigint generated always as identity primary key,
+  insumo_id bigint not null references insumos(id) on delete cascade,
+  cantidad numeric not null,          -- lo que queda de la compra
+  costo_unitario numeric not null,
+  fecha timestamptz not null default now()
+);
+create index if not exists idx_capas_costo_insumo on capas_costo_insumo (insumo_id, id);
+
+-- Punto de partida: el stock actual valorizado al costo de referencia
+insert into costos_insumo (insumo_id, cantidad, valor, costo_promedio)
+select i.id, i.stock_actual, i.stock_actual * coalesce(i.costo_unitario, 0), coalesce(i.costo_unitario, 0)
+  from insumos i
+on conflict (insumo_id) do nothing;
+
+insert into capas_costo_insumo (insumo_id, cantidad, costo_unitario)
+select i.id, i.stock_actual, coalesce(i.costo_unitario, 0)
+  from insumos i
+ where i.stock_actual > 0
+   and not exists (select 1 from capas_costo_insumo c where c.insumo_id = i.id);
+
+-- Actualiza el estado de costo de un insumo y devuelve el valor del movimiento.
+-- Se llama con la fila del insumo ya bloqueada por aplicar_movimientos_stock.
+create or replace function costear_movimiento(p_insumo_id bigint, p_delta numeric, p_tipo text, p_costo_total numeric)
+returns numeric
+language plpgsql
+as $$
+declare
+  r costos_insumo%rowtype;
+  c record;
+  v_unit numeric;
+  v_valor numeric := 0;
+  v_resto numeric;
+  v_toma numeric;
+  v_fifo numeric := 0;
+begin
+  insert into costos_insumo (insumo_id, costo_promedio)
+  select i.id, coalesce(i.costo_unitario, 0) from insumos i where i.id = p_insumo_id
+  on conflict (insumo_id) do nothing;
+
+  select * into r from costos_insumo where insumo_id = p_insumo_id for update;
+  if not found then
+    return null;
+  end if;
+
+  if p_delta > 0 then
+    -- Compras entran a su costo real; devoluciones y ajustes, al promedio vigente
+    v_unit := case when p_tipo = 'compra' and p_costo_total is not null then round(p_costo_total / p_delta, 6) else r.costo_promedio end;
+    v_valor := p_delta * v_unit;
+    insert into capas_costo_insumo (insumo_id, cantidad, costo_unitario) values (p_insumo_id, p_delta, v_unit);
+    if r.cantidad <= 0 then
+      -- Sin existencias el promedio parte de nuevo desde esta entrada
+      r.costo_promedio := v_unit;
+      r.valor := (r.cantidad + p_delta) * v_unit;
+    else
+      r.valor := r.valor + v_valor;
+      r.costo_promedio := round(r.valor / (r.cantidad + p_delta), 6);
+    end if;
+    r.cantidad := r.cantidad + p_delta;
+
+  elsif p_delta < 0 then
+    -- Las capas se consumen siempre de la más antigua; lo que no alcance sale al promedio
+    v_resto := -p_delta;
+    for c in select id, cantidad, costo_unitario from capas_costo_insumo
+              where insumo_id = p_insumo_id order by id for update loop
+      exit when v_resto <= 0;
+      v_toma := least(c.cantidad, v_resto);
+      v_fifo := v_fifo + v_toma * c.costo_unitario;
+      v_resto := v_resto - v_toma;
+      if v_toma >= c.cantidad then
+        delete from capas_costo_insumo where id = c.id;
+      else
+        update capas_costo_insumo set cantidad = cantidad - v_toma where id = c.id;
+      end if;
+    end loop;
+    v_fifo := v_fifo + v_resto * r.costo_promedio;
+
+    r.cantidad := r.cantidad + p_delta;
+    if r.metodo = 'fifo' then
+      v_valor := -v_fifo;
+      r.valor := r.valor - v_fifo;
+      if r.cantidad > 0 then r.costo_promedio := round(r.valor / r.cantidad, 6); end if;
+    else
+      v_valor := p_delta * r.costo_promedio;
+      r.valor := r.cantidad * r.costo_promedio;
+    end if;
+  end if;
+
+  update costos_insumo
+     set cantidad = r.cantidad, valor = round(r.valor, 4), costo_promedio = r.costo_promedio, actualizado_en = now()
+   where insumo_id = p_insumo_id;
+
+  -- Costo de referencia para recetas: el promedio, o en FIFO la próxima capa a consumir.
+  -- Solo se toca cuando cambia (compras, o capa agotada en FIFO) para no pisar precios de mercado.
+  if r.metodo = 'fifo' then
+    update insumos i
+       set costo_unitario = coalesce((select k.costo_unitario from capas_costo_insumo k
+                                       where k.insumo_id = p_insumo_id order by k.id limit 1), r.costo_promedio)
+     where i.id = p_insumo_id;
+  elsif p_tipo = 'compra' then
+    update insumos i set costo_unitario = r.costo_promedio where i.id = p_insumo_id;
+  end if;
+
+  return round(v_valor, 4);
+end;
+$$;
+
+-- Misma firma que antes; ahora cada fila del libro lleva su valor y las compras pueden traer costo_total
+create or replace function aplicar_movimientos_stock(movimientos jsonb, usuario text default null)
+returns table (insumo_id bigint, insumo text, stock_anterior numeric, stock_nuevo numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  m record;
+begin
+  perform 1
+     from insumos i
+    where i.id in (select (x->>'insumo_id')::bigint from jsonb_array_elements(movimientos) x)
+    order by i.id
+      for update;
+
+  for m in select * from jsonb_to_recordset(movimientos)
+             as x(insumo_id bigint, delta numeric, tipo text, referencia_tipo text, referencia_id bigint, costo_total numeric) loop
+    continue when m.delta = 0 or not exists (select 1 from insumos i where i.id = m.insumo_id);
+    insert into movimientos_inventario (insumo_id, tipo, cantidad, referencia_tipo, referencia_id, usuario, costo)
+    values (m.insumo_id, coalesce(m.tipo, 'ajuste'), m.delta, m.referencia_tipo, m.referencia_id,
+            aplicar_movimientos_stock.usuario,
+            costear_movimiento(m.insumo_id, m.delta, coalesce(m.tipo, 'ajuste'), m.costo_total));
+  end loop;
+
+  return query
+  with deltas as (
+    select x.insumo_id, sum(x.delta) as delta
+      from jsonb_to_recordset(movimientos) as x(insumo_id bigint, delta numeric)
+     group by x.insumo_id
+  )
+  update insumos i
+     set stock_actual = i.stock_actual + d.delta
+    from deltas d
+   where i.id = d.insumo_id
+  returning i.id::bigint, i.nombre::text, (i.stock_actual - d.delta)::numeric, i.stock_actual::numeric;
+end;
+$$;
+
+-- Totales para el dashboard financiero
+create or replace function resumen_costeo()
+returns table (costo_vendido numeric, valor_inventario numeric)
+language sql stable
+as $$
+  select coalesce((select -sum(m.costo) from movimientos_inventario m where m.tipo in ('entrega', 'devolucion')), 0),
+         coalesce((select sum(c.valor) from costos_insumo c), 0);
+$$;
+
+-- Cambia el método de un insumo; al pasar a FIFO el valor se recalcula desde las capas pendientes
+create or replace function cambiar_metodo_costeo(p_insumo_id bigint, p_metodo text)
+returns void
+language plpgsql
+as $$
+declare
+  v_capas numeric;
+  v_cant_capas numeric;
+begin
+  perform costear_movimiento(p_insumo_id, 0, 'ajuste', null);  -- asegura el registro
+  update costos_insumo set metodo = p_metodo where insumo_id = p_insumo_id;
+  if p_metodo = 'fifo' then
+    select coalesce(sum(cantidad * costo_unitario), 0), coalesce(sum(cantidad), 0)
+      into v_capas, v_cant_capas
+      from capas_costo_insumo where insumo_id = p_insumo_id;
+    update costos_insumo
+       set valor = v_capas + (cantidad - v_cant_capas) * costo_promedio,
+           costo_promedio = case when cantidad > 0 then round((v_capas + (cantidad - v_cant_capas) * costo_promedio) / cantidad, 6) else costo_promedio end,
+           actualizado_en = now()
+     where insumo_id = p_insumo_id;
+  end if;
+end;
+$$;
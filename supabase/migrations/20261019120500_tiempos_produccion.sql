@@ -0,0 +1,3 @@
+-- Tiempos de producción por variación para programar el horno (minutos por unidad)
+alter table variaciones add column if not exists tiempo_prep_min integer not null default 30;
+alter table variaciones add column if not exists tiempo_horno_min integer not null default 45;
@@ -0,0 +1,19 @@
+-- Marca de cambio por pedido para que los tableros traigan solo lo que cambió desde su última lectura
+alter table pedidos add column if not exists actualizado_en timestamptz not null default now();
+
+create or replace function marcar_pedido_actualizado()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.actualizado_en := clock_timestamp();
+  return new;
+end;
+$$;
+
+drop trigger if exists trg_pedidos_actualizado on pedidos;
+create trigger trg_pedidos_actualizado
+  before insert or update on pedidos
+  for each row execute function marcar_pedido_actualizado();
+
+create index if not exists idx_pedidos_actualizado_en on pedidos (actualizado_en);
@@ -0,0 +1,69 @@
+-- Máquina de estados de pedidos: cambio de estado, movimiento de stock y registro de la venta
+-- en una sola transacción y una sola llamada. Repetir la misma transición no hace nada (doble clic).
+--
+--   Pendiente -> En Horno | Cancelado
+--   En Horno  -> Listo | Cancelado
+--   Listo     -> Entregado | Cancelado
+--   Entregado -> Cancelado (devolución: repone stock y anula la venta)
+--
+-- p_consumo trae el consumo del pedido por insumo en unidad base: [{insumo_id, cantidad}, ...];
+-- el signo lo decide la transición que realmente se aplica.
+
+create or replace function transicionar_pedido(p_pedido_id bigint, p_estado text, p_consumo jsonb default '[]'::jsonb, p_usuario text default null)
+returns table (estado_anterior text, estado_nuevo text, aplicado boolean)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  v_pedido pedidos%rowtype;
+  v_signo integer := 0;
+  v_tipo text;
+  v_movs jsonb;
+begin
+  select * into v_pedido from pedidos where id = p_pedido_id for update;
+  if not found then
+    raise exception 'El pedido % no existe', p_pedido_id;
+  end if;
+
+  if v_pedido.estado = p_estado then
+    return query select v_pedido.estado::text, p_estado, false;
+    return;
+  end if;
+
+  if (v_pedido.estado, p_estado) not in (
+       ('Pendiente', 'En Horno'), ('Pendiente', 'Cancelado'),
+       ('En Horno', 'Listo'), ('En Horno', 'Cancelado'),
+       ('Listo', 'Entregado'), ('Listo', 'Cancelado'),
+       ('Entregado', 'Cancelado')) then
+    raise exception 'Transición no permitida: % -> %', v_pedido.estado, p_estado;
+  end if;
+
+  update pedidos set estado = p_estado where id = p_pedido_id;
+
+  if p_estado = 'Entregado' then
+    v_signo := -1;
+    v_tipo := 'entrega';
+    insert into gastos (fecha, monto, descripcion, tipo)
+    values (current_date, v_pedido.total_pedido, format('Venta Pedido #%s - %s', v_pedido.id, v_pedido.cliente_nombre), 'Compra Insumo');
+  elsif v_pedido.estado = 'Entregado' then
+    v_signo := 1;
+    v_tipo := 'devolucion';
+    insert into gastos (fecha, monto, descripcion, tipo)
+    values (current_date, -v_pedido.total_pedido, format('Anulación Venta Pedido #%s - %s', v_pedido.id, v_pedido.cliente_nombre), 'Compra Insumo');
+  end if;
+
+  if v_signo <> 0 then
+    select jsonb_agg(jsonb_build_object(
+             'insumo_id', c.insumo_id, 'delta', v_signo * c.cantidad, 'tipo', v_tipo,
+             'referencia_tipo', 'pedido', 'referencia_id', p_pedido_id))
+      into v_movs
+      from jsonb_to_recordset(coalesce(p_consumo, '[]'::jsonb)) as c(insumo_id bigint, cantidad numeric)
+     where c.cantidad <> 0;
+    if v_movs is not null then
+      perform aplicar_movimientos_stock(v_movs, p_usuario);
+    end if;
+  end if;
+
+  return query select v_pedido.estado::text, p_estado, true;
+end;
+$$;
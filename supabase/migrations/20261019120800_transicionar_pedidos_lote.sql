@@ -0,0 +1,90 @@
+-- Transiciones en lote para el tablero de cocina: un solo UPDATE para todos los pedidos válidos,
+-- el stock de todos ellos en una sola llamada a aplicar_movimientos_stock y un reporte por pedido.
+-- transicionar_pedido (uno solo) pasa a usar esta misma lógica.
+
+create or replace function transicion_pedido_valida(p_desde text, p_hacia text)
+returns boolean
+language sql immutable
+as $$
+  select (p_desde, p_hacia) in (
+    ('Pendiente', 'En Horno'), ('Pendiente', 'Cancelado'),
+    ('En Horno', 'Listo'), ('En Horno', 'Cancelado'),
+    ('Listo', 'Entregado'), ('Listo', 'Cancelado'),
+    ('Entregado', 'Cancelado'));
+$$;
+
+-- p_consumos: {"<pedido_id>": [{insumo_id, cantidad}, ...], ...} en unidad base
+create or replace function transicionar_pedidos(p_ids bigint[], p_estado text, p_consumos jsonb default '{}'::jsonb, p_usuario text default null)
+returns table (pedido_id bigint, estado_anterior text, estado_nuevo text, aplicado boolean, error text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  v_antes jsonb;
+  v_ok bigint[];
+  v_movs jsonb;
+begin
+  perform 1 from pedidos p where p.id = any(p_ids) order by p.id for update;
+
+  select coalesce(jsonb_object_agg(p.id::text, p.estado), '{}'::jsonb),
+         coalesce(array_agg(p.id) filter (where transicion_pedido_valida(p.estado, p_estado)), '{}')
+    into v_antes, v_ok
+    from pedidos p
+   where p.id = any(p_ids);
+
+  update pedidos p set estado = p_estado where p.id = any(v_ok);
+
+  -- Ventas de lo entregado y anulaciones de lo que estaba entregado
+  insert into gastos (fecha, monto, descripcion, tipo)
+  select current_date,
+         case when p_estado = 'Entregado' then p.total_pedido else -p.total_pedido end,
+         format(case when p_estado = 'Entregado' then 'Venta Pedido #%s - %s' else 'Anulación Venta Pedido #%s - %s' end, p.id, p.cliente_nombre),
+         'Compra Insumo'
+    from pedidos p
+   where p.id = any(v_ok)
+     and (p_estado = 'Entregado' or v_antes->>(p.id::text) = 'Entregado');
+
+  select jsonb_agg(jsonb_build_object(
+           'insumo_id', c.insumo_id,
+           'delta', (case when p_estado = 'Entregado' then -1 else 1 end) * c.cantidad,
+           'tipo', case when p_estado = 'Entregado' then 'entrega' else 'devolucion' end,
+           'referencia_tipo', 'pedido', 'referencia_id', o.id))
+    into v_movs
+    from unnest(v_ok) as o(id)
+    cross join lateral jsonb_to_recordset(coalesce(p_consumos->(o.id::text), '[]'::jsonb)) as c(insumo_id bigint, cantidad numeric)
+   where c.cantidad <> 0
+     and (p_estado = 'Entregado' or v_antes->>(o.id::text) = 'Entregado');
+  if v_movs is not null then
+    perform aplicar_movimientos_stock(v_movs, p_usuario);
+  end if;
+
+  return query
+  select x.id,
+         v_antes->>(x.id::text),
+         case when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then p_estado else v_antes->>(x.id::text) end,
+         x.id = any(v_ok),
+         case
+           when not v_antes ? (x.id::text) then format('El pedido %s no existe', x.id)
+           when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then null
+           else format('Transición no permitida: %s -> %s', v_antes->>(x.id::text), p_estado)
+         end
+    from unnest(p_ids) as x(id);
+end;
+$$;
+
+create or replace function transicionar_pedido(p_pedido_id bigint, p_estado text, p_consumo jsonb default '[]'::jsonb, p_usuario text default null)
+returns table (estado_anterior text, estado_nuevo text, aplicado boolean)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  r record;
+begin
+  select * into r
+    from transicionar_pedidos(array[p_pedido_id], p_estado, jsonb_build_object(p_pedido_id::text, p_consumo), p_usuario);
+  if r.error is not null then
+    raise exception '%', r.error;
+  end if;
+  return query select r.estado_anterior, r.estado_nuevo, r.aplicado;
+end;
+$$;
@@ -0,0 +1,39 @@
+-- Resumen financiero mensual calculado en la BD: una fila por mes y tipo (Venta / Gasto).
+-- Las ventas son los pedidos Entregados por fecha de entrega; los gastos, todas las filas de 'gastos'.
+create or replace view resumen_mensual as
+  select to_char(fecha_entrega, 'YYYY-MM') as mes, 'Venta'::text as tipo, sum(total_pedido) as monto
+    from pedidos
+   where estado = 'Entregado'
+   group by 1
+  union all
+  select to_char(fecha, 'YYYY-MM'), 'Gasto', sum(monto)
+    from gastos
+   group by 1;
+
+-- Versión de los datos: sube con cada sentencia que toca pedidos o gastos, para que la app
+-- solo vuelva a pedir el resumen (y rearmar el gráfico) cuando algo cambió.
+create table if not exists versiones_datos (
+  clave text primary key,
+  version bigint not null default 0
+);
+insert into versiones_datos (clave) values ('finanzas') on conflict do nothing;
+
+create or replace function subir_version_finanzas()
+returns trigger
+language plpgsql
+as $$
+begin
+  update versiones_datos set version = version + 1 where clave = 'finanzas';
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_pedidos_version_finanzas on pedidos;
+create trigger trg_pedidos_version_finanzas
+  after insert or update or delete or truncate on pedidos
+  for each statement execute function subir_version_finanzas();
+
+drop trigger if exists trg_gastos_version_finanzas on gastos;
+create trigger trg_gastos_version_finanzas
+  after insert or update or delete or truncate on gastos
+  for each statement execute function subir_version_finanzas();
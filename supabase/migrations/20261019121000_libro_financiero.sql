@@ -0,0 +1,178 @@
+-- Libro financiero tipado: reemplaza a 'gastos' como registro de ventas, compras y ajustes del ERP.
+-- Antes las ventas se escribían en 'gastos' como "Venta Pedido #..." y Finanzas las sumaba como egreso.
+-- 'gastos' queda como histórico (la app de logística usa su propia tabla con el mismo nombre).
+--
+-- Signos: venta = ingreso (una anulación es una venta negativa), compra_insumo = egreso,
+-- ajuste = corrección directa del balance (positivo suma, negativo resta).
+create table if not exists libro_financiero (
+  id bigserial primary key,
+  fecha date not null default current_date,
+  tipo text not null check (tipo in ('venta', 'compra_insumo', 'ajuste')),
+  monto numeric not null,
+  descripcion text,
+  pedido_id bigint references pedidos(id) on delete set null,
+  insumo_id bigint references insumos(id) on delete set null,
+  usuario text,
+  creado_en timestamptz not null default now()
+);
+
+create index if not exists idx_libro_financiero_fecha_tipo on libro_financiero (fecha, tipo);
+create index if not exists idx_libro_financiero_pedido on libro_financiero (pedido_id) where pedido_id is not null;
+
+-- Totales por mes y tipo, mantenidos al escribir en el libro
+create table if not exists totales_financieros (
+  mes date not null,
+  tipo text not null,
+  monto numeric not null default 0,
+  movimientos integer not null default 0,
+  primary key (mes, tipo)
+);
+
+create or replace function acumular_total_financiero()
+returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    update totales_financieros
+       set monto = monto - old.monto, movimientos = movimientos - 1
+     where mes = date_trunc('month', old.fecha)::date and tipo = old.tipo;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into totales_financieros (mes, tipo, monto, movimientos)
+    values (date_trunc('month', new.fecha)::date, new.tipo, new.monto, 1)
+    on conflict (mes, tipo) do update
+      set monto = totales_financieros.monto + excluded.monto,
+          movimientos = totales_financieros.movimientos + 1;
+  end if;
+  return null;
+end;
+$$;
+
+create or replace function vaciar_totales_financieros()
+returns trigger
+language plpgsql
+as $$
+begin
+  delete from totales_financieros;
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_libro_financiero_totales on libro_financiero;
+create trigger trg_libro_financiero_totales
+  after insert or update or delete on libro_financiero
+  for each row execute function acumular_total_financiero();
+
+drop trigger if exists trg_libro_financiero_truncate on libro_financiero;
+create trigger trg_libro_financiero_truncate
+  after truncate on libro_financiero
+  for each statement execute function vaciar_totales_financieros();
+
+-- La versión de finanzas ahora sigue al libro
+drop trigger if exists trg_pedidos_version_finanzas on pedidos;
+drop trigger if exists trg_gastos_version_finanzas on gastos;
+drop trigger if exists trg_libro_financiero_version on libro_financiero;
+create trigger trg_libro_financiero_version
+  after insert or update or delete or truncate on libro_financiero
+  for each statement execute function subir_version_finanzas();
+
+-- Traspaso del histórico de 'gastos' (solo si el libro está vacío, para poder re-ejecutar)
+do $$
+begin
+  if exists (select 1 from libro_financiero) then return; end if;
+
+  insert into libro_financiero (fecha, tipo, monto, descripcion, pedido_id, insumo_id)
+  select coalesce(g.fecha, current_date),
+         case when v.pedido_id is not null then 'venta'
+              when g.descripcion like 'Compra: %' then 'compra_insumo'
+              else 'ajuste' end,
+         -- lo que no es venta ni compra se registró como egreso: pasa al libro como ajuste negativo
+         case when v.pedido_id is null and g.descripcion not like 'Compra: %' then -g.monto else g.monto end,
+         g.descripcion,
+         (select p.id from pedidos p where p.id = v.pedido_id),
+         (select i.id from insumos i where g.descripcion like 'Compra: %' and i.nombre = substr(g.descripcion, 9) order by i.id limit 1)
+    from gastos g
+    left join lateral (
+      select (regexp_match(g.descripcion, '^(?:Anulación )?Venta Pedido #(\d+)'))[1]::bigint as pedido_id
+    ) v on true
+   where g.monto is not null
+   order by g.id;
+
+  -- Pedidos entregados cuya venta nunca quedó registrada
+  insert into libro_financiero (fecha, tipo, monto, descripcion, pedido_id)
+  select coalesce(p.fecha_entrega, current_date), 'venta', p.total_pedido,
+         format('Venta Pedido #%s - %s', p.id, p.cliente_nombre), p.id
+    from pedidos p
+   where p.estado = 'Entregado'
+     and p.total_pedido is not null
+     and not exists (select 1 from libro_financiero l where l.pedido_id = p.id and l.tipo = 'venta');
+end;
+$$;
+
+-- Resumen mensual leído de los totales: Venta / Gasto (compras) / Ajuste
+create or replace view resumen_mensual as
+  select to_char(mes, 'YYYY-MM') as mes,
+         case tipo when 'venta' then 'Venta' when 'compra_insumo' then 'Gasto' else 'Ajuste' end as tipo,
+         monto
+    from totales_financieros
+   where movimientos > 0;
+
+-- Las transiciones de pedido registran la venta (o su anulación) en el libro
+create or replace function transicionar_pedidos(p_ids bigint[], p_estado text, p_consumos jsonb default '{}'::jsonb, p_usuario text default null)
+returns table (pedido_id bigint, estado_anterior text, estado_nuevo text, aplicado boolean, error text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  v_antes jsonb;
+  v_ok bigint[];
+  v_movs jsonb;
+begin
+  perform 1 from pedidos p where p.id = any(p_ids) order by p.id for update;
+
+  select coalesce(jsonb_object_agg(p.id::text, p.estado), '{}'::jsonb),
+         coalesce(array_agg(p.id) filter (where transicion_pedido_valida(p.estado, p_estado)), '{}')
+    into v_antes, v_ok
+    from pedidos p
+   where p.id = any(p_ids);
+
+  update pedidos p set estado = p_estado where p.id = any(v_ok);
+
+  -- Ventas de lo entregado y anulaciones de lo que estaba entregado
+  insert into libro_financiero (fecha, tipo, monto, descripcion, pedido_id, usuario)
+  select current_date, 'venta',
+         case when p_estado = 'Entregado' then p.total_pedido else -p.total_pedido end,
+         format(case when p_estado = 'Entregado' then 'Venta Pedido #%s - %s' else 'Anulación Venta Pedido #%s - %s' end, p.id, p.cliente_nombre),
+         p.id, p_usuario
+    from pedidos p
+   where p.id = any(v_ok)
+     and (p_estado = 'Entregado' or v_antes->>(p.id::text) = 'Entregado');
+
+  select jsonb_agg(jsonb_build_object(
+           'insumo_id', c.insumo_id,
+           'delta', (case when p_estado = 'Entregado' then -1 else 1 end) * c.cantidad,
+           'tipo', case when p_estado = 'Entregado' then 'entrega' else 'devolucion' end,
+           'referencia_tipo', 'pedido', 'referencia_id', o.id))
+    into v_movs
+    from unnest(v_ok) as o(id)
+    cross join lateral jsonb_to_recordset(coalesce(p_consumos->(o.id::text), '[]'::jsonb)) as c(insumo_id bigint, cantidad numeric)
+   where c.cantidad <> 0
+     and (p_estado = 'Entregado' or v_antes->>(o.id::text) = 'Entregado');
+  if v_movs is not null then
+    perform aplicar_movimientos_stock(v_movs, p_usuario);
+  end if;
+
+  return query
+  select x.id,
+         v_antes->>(x.id::text),
+         case when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then p_estado else v_antes->>(x.id::text) end,
+         x.id = any(v_ok),
+         case
+           when not v_antes ? (x.id::text) then format('El pedido %s no existe', x.id)
+           when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then null
+           else format('Transición no permitida: %s -> %s', v_antes->>(x.id::text), p_estado)
+         end
+    from unnest(p_ids) as x(id);
+end;
+$$;
@@ -0,0 +1,367 @@
+-- Recetas y líneas de pedido normalizadas en vez de texto JSON.
+-- variaciones.ingredientes_json, recetas.ingredientes_json y pedidos.detalle_json se traspasan una sola vez
+-- y quedan como respaldo; desde aquí la app lee y escribe receta_ingredientes y pedido_items.
+
+-- ---------------------------------------------------------------
+-- Unidades: mismo cuadro que UNIDADES / CUCHARAS en erp.py
+-- ---------------------------------------------------------------
+create table if not exists unidades_medida (
+  unidad text primary key,
+  dimension text not null,
+  factor numeric not null  -- a la unidad mínima de su dimensión (gr, ml, unidad)
+);
+insert into unidades_medida (unidad, dimension, factor) values
+  ('gr', 'masa', 1), ('kg', 'masa', 1000),
+  ('ml', 'volumen', 1), ('cc', 'volumen', 1), ('lt', 'volumen', 1000),
+  ('unidades', 'unidad', 1),
+  ('cdta', 'cuchara', 5), ('cda', 'cuchara', 15)
+on conflict (unidad) do update set dimension = excluded.dimension, factor = excluded.factor;
+
+-- Factor para pasar de una unidad a otra; null si no son compatibles.
+-- Las cucharas valen lo mismo en gr que en ml (densidad ~1).
+create or replace function factor_unidad(p_desde text, p_hacia text)
+returns numeric
+language sql stable
+as $$
+  select case
+    when p_desde = p_hacia then 1
+    else (select d.factor / h.factor
+            from unidades_medida d, unidades_medida h
+           where d.unidad = p_desde and h.unidad = p_hacia
+             and (d.dimension = h.dimension
+                  or (d.dimension = 'cuchara' and h.dimension in ('masa', 'volumen'))
+                  or (h.dimension = 'cuchara' and d.dimension in ('masa', 'volumen'))))
+  end;
+$$;
+
+-- ---------------------------------------------------------------
+-- Tablas
+-- ---------------------------------------------------------------
+create table if not exists receta_ingredientes (
+  id bigserial primary key,
+  variacion_id bigint not null references variaciones(id) on delete cascade,
+  posicion integer not null default 0,
+  insumo_id bigint references insumos(id) on delete set null,
+  nombre text not null,           -- nombre del insumo al momento de guardar la receta
+  cantidad numeric not null,      -- para toda la receta (o el lote completo)
+  unidad text,                    -- null = unidad base del insumo (recetas antiguas)
+  costo numeric not null default 0
+);
+create index if not exists idx_receta_ingredientes_variacion on receta_ingredientes (variacion_id, posicion);
+create index if not exists idx_receta_ingredientes_insumo on receta_ingredientes (insumo_id);
+
+create table if not exists pedido_items (
+  id bigserial primary key,
+  pedido_id bigint not null references pedidos(id) on delete cascade,
+  variacion_id bigint references variaciones(id) on delete set null,
+  producto text not null,
+  cantidad numeric not null,
+  precio_unitario numeric
+);
+create index if not exists idx_pedido_items_pedido on pedido_items (pedido_id);
+create index if not exists idx_pedido_items_variacion on pedido_items (variacion_id);
+
+-- ---------------------------------------------------------------
+-- Traspaso desde los JSON (solo si las tablas nuevas están vacías)
+-- ---------------------------------------------------------------
+create or replace function pg_temp.json_o_vacio(p_texto text)
+returns jsonb
+language plpgsql
+as $$
+declare
+  v jsonb;
+begin
+  v := nullif(p_texto, '')::jsonb;
+  return case when jsonb_typeof(v) = 'array' then v else '[]'::jsonb end;
+exception when others then
+  return '[]'::jsonb;
+end;
+$$;
+
+do $$
+begin
+  if not exists (select 1 from receta_ingredientes) then
+    insert into receta_ingredientes (variacion_id, posicion, insumo_id, nombre, cantidad, unidad, costo)
+    select v.id, e.n,
+           coalesce((select i.id from insumos i where i.id::text = e.ing->>'insumo_id'),
+                    (select i.id from insumos i where i.nombre = e.ing->>'nombre' order by i.id limit 1)),
+           coalesce(e.ing->>'nombre', ''), (e.ing->>'cantidad')::numeric, e.ing->>'unidad',
+           coalesce((e.ing->>'costo')::numeric, 0)
+      from variaciones v
+     cross join lateral jsonb_array_elements(pg_temp.json_o_vacio(v.ingredientes_json)) with ordinality as e(ing, n)
+     where e.ing->>'cantidad' is not null;
+
+    -- Recetas antiguas (por nombre "Producto - Variación", cantidades en unidad base) para variaciones sin ingredientes
+    insert into receta_ingredientes (variacion_id, posicion, insumo_id, nombre, cantidad, unidad)
+    select v.id, e.n,
+           (select i.id from insumos i where i.nombre = e.ing->>'nombre' order by i.id limit 1),
+           coalesce(e.ing->>'nombre', ''), (e.ing->>'cantidad')::numeric, null
+      from variaciones v
+      join productos p on p.id = v.producto_id
+      join lateral (select r.ingredientes_json from recetas r where r.nombre = p.nombre || ' - ' || v.nombre order by r.id limit 1) r on true
+     cross join lateral jsonb_array_elements(pg_temp.json_o_vacio(r.ingredientes_json)) with ordinality as e(ing, n)
+     where not exists (select 1 from receta_ingredientes ri where ri.variacion_id = v.id)
+       and e.ing->>'cantidad' is not null;
+  end if;
+
+  if not exists (select 1 from pedido_items) then
+    -- Pedidos con detalle: la variación se busca por nombre; si el pedido tiene un solo ítem, vale su variacion_id
+    insert into pedido_items (pedido_id, variacion_id, producto, cantidad, precio_unitario)
+    select p.id,
+           coalesce((select v.id from variaciones v join productos pr on pr.id = v.producto_id
+                      where pr.nombre || ' - ' || v.nombre = e.item->>'producto' order by v.id limit 1),
+                    case when jsonb_array_length(pg_temp.json_o_vacio(p.detalle_json)) = 1
+                         then (select v.id from variaciones v where v.id = p.variacion_id) end),
+           coalesce(e.item->>'producto', p.nombre_producto_snapshot, ''),
+           (e.item->>'cantidad')::numeric,
+           case when jsonb_array_length(pg_temp.json_o_vacio(p.detalle_json)) = 1 then p.precio_unitario_final end
+      from pedidos p
+     cross join lateral jsonb_array_elements(pg_temp.json_o_vacio(p.detalle_json)) as e(item)
+     where e.item->>'cantidad' is not null;
+
+    insert into pedido_items (pedido_id, variacion_id, producto, cantidad, precio_unitario)
+    select p.id, (select v.id from variaciones v where v.id = p.variacion_id),
+           coalesce(p.nombre_producto_snapshot, ''), coalesce(p.cantidad, 1), p.precio_unitario_final
+      from pedidos p
+     where not exists (select 1 from pedido_items pi where pi.pedido_id = p.id)
+       and p.variacion_id is not null;
+  end if;
+end;
+$$;
+
+comment on column variaciones.ingredientes_json is 'Respaldo: traspasado a receta_ingredientes';
+comment on column recetas.ingredientes_json is 'Respaldo: traspasado a receta_ingredientes';
+comment on column pedidos.detalle_json is 'Respaldo: traspasado a pedido_items';
+
+-- Los marcadores de 20261019120200_marcadores_recetas.sql servían a la caché de recetas compiladas desde
+-- ingredientes_json; con receta_ingredientes y el índice del catálogo (versiones_datos) ya nadie los lee
+drop trigger if exists trg_variaciones_receta on variaciones;
+drop trigger if exists trg_insumos_unidad on insumos;
+drop function if exists marcar_receta_actualizada();
+drop function if exists marcar_unidad_actualizada();
+drop index if exists idx_insumos_unidad_actualizada;
+alter table variaciones drop column if exists receta_actualizada_en;
+alter table insumos drop column if exists unidad_actualizada_en;
+
+-- ---------------------------------------------------------------
+-- Vistas: la receta explotada en unidad base y lo que consume cada pedido
+-- ---------------------------------------------------------------
+-- Cantidad de cada insumo, en su unidad base, por unidad vendida de la variación
+create or replace view receta_consumo as
+  select ri.variacion_id, ri.insumo_id,
+         sum(ri.cantidad * factor_unidad(coalesce(ri.unidad, i.unidad_medida), i.unidad_medida)
+             / coalesce(nullif(v.rendimiento, 0), 1)) as cantidad
+    from receta_ingredientes ri
+    join insumos i on i.id = ri.insumo_id
+    join variaciones v on v.id = ri.variacion_id
+   where factor_unidad(coalesce(ri.unidad, i.unidad_medida), i.unidad_medida) is not null
+   group by ri.variacion_id, ri.insumo_id;
+
+create or replace view consumo_pedidos as
+  select p.id as pedido_id, p.estado, p.fecha_entrega, rc.insumo_id, round(sum(pi.cantidad * rc.cantidad), 6) as cantidad
+    from pedidos p
+    join pedido_items pi on pi.pedido_id = p.id
+    join receta_consumo rc on rc.variacion_id = pi.variacion_id
+   group by p.id, p.estado, p.fecha_entrega, rc.insumo_id;
+
+-- Costo de insumos por unidad vendida con el costo actual de cada insumo
+create or replace view costo_recetas as
+  select rc.variacion_id, round(sum(rc.cantidad * coalesce(i.costo_unitario, 0)), 4) as costo_insumos
+    from receta_consumo rc
+    join insumos i on i.id = rc.insumo_id
+   group by rc.variacion_id;
+
+-- ---------------------------------------------------------------
+-- Escritura
+-- ---------------------------------------------------------------
+-- Crea o actualiza una variación y reemplaza sus ingredientes en una transacción.
+-- p_datos: columnas de variaciones a guardar; p_ingredientes: [{nombre, cantidad, unidad, costo, insumo_id}, ...]
+create or replace function guardar_receta(p_variacion_id bigint, p_datos jsonb, p_ingredientes jsonb)
+returns bigint
+language plpgsql
+as $$
+declare
+  r variaciones;
+  v_id bigint := p_variacion_id;
+begin
+  r := jsonb_populate_record(null::variaciones, p_datos);
+  if v_id is null then
+    insert into variaciones (producto_id, nombre, precio, rendimiento, parametros_json, tiempo_prep_min, tiempo_horno_min)
+    values (r.producto_id, r.nombre, r.precio, coalesce(r.rendimiento, 1), r.parametros_json,
+            coalesce(r.tiempo_prep_min, 30), coalesce(r.tiempo_horno_min, 45))
+    returning id into v_id;
+  else
+    update variaciones v
+       set producto_id = case when p_datos ? 'producto_id' then r.producto_id else v.producto_id end,
+           nombre = case when p_datos ? 'nombre' then r.nombre else v.nombre end,
+           precio = case when p_datos ? 'precio' then r.precio else v.precio end,
+           rendimiento = case when p_datos ? 'rendimiento' then r.rendimiento else v.rendimiento end,
+           parametros_json = case when p_datos ? 'parametros_json' then r.parametros_json else v.parametros_json end,
+           tiempo_prep_min = case when p_datos ? 'tiempo_prep_min' then r.tiempo_prep_min else v.tiempo_prep_min end,
+           tiempo_horno_min = case when p_datos ? 'tiempo_horno_min' then r.tiempo_horno_min else v.tiempo_horno_min end
+     where v.id = v_id;
+    if not found then
+      raise exception 'La variación % no existe', v_id;
+    end if;
+    delete from receta_ingredientes where variacion_id = v_id;
+  end if;
+
+  insert into receta_ingredientes (variacion_id, posicion, insumo_id, nombre, cantidad, unidad, costo)
+  select v_id, e.n,
+         coalesce((select i.id from insumos i where i.id = e.insumo_id),
+                  (select i.id from insumos i where i.nombre = e.nombre order by i.id limit 1)),
+         e.nombre, e.cantidad, e.unidad, coalesce(e.costo, 0)
+    from rows from (jsonb_to_recordset(coalesce(p_ingredientes, '[]'::jsonb))
+                    as (nombre text, cantidad numeric, unidad text, costo numeric, insumo_id bigint)) with ordinality
+         as e(nombre, cantidad, unidad, costo, insumo_id, n);
+  return v_id;
+end;
+$$;
+
+-- Re-costeo: el costo guardado de cada línea pasa a ser su cantidad por el costo actual del insumo
+drop function if exists actualizar_costos_recetas(jsonb);
+create or replace function actualizar_costos_recetas()
+returns integer
+language plpgsql
+as $$
+declare
+  v_filas integer;
+begin
+  with act as (
+    update receta_ingredientes ri
+       set costo = round(ri.cantidad * factor_unidad(coalesce(ri.unidad, i.unidad_medida), i.unidad_medida) * coalesce(i.costo_unitario, 0), 2)
+      from insumos i
+     where i.id = ri.insumo_id
+       and factor_unidad(coalesce(ri.unidad, i.unidad_medida), i.unidad_medida) is not null
+    returning ri.variacion_id
+  )
+  select count(distinct variacion_id) into v_filas from act;
+  return v_filas;
+end;
+$$;
+
+-- Crea pedidos con sus ítems: [{cliente_nombre, ..., items: [{variacion_id, producto, cantidad, precio_unitario}]}, ...]
+create or replace function crear_pedidos(p_pedidos jsonb)
+returns setof bigint
+language plpgsql
+as $$
+declare
+  e jsonb;
+  r pedidos;
+  v_id bigint;
+begin
+  for e in select * from jsonb_array_elements(p_pedidos) loop
+    r := jsonb_populate_record(null::pedidos, e - 'items');
+    insert into pedidos (cliente_nombre, cliente_contacto, fecha_entrega, hora_entrega, variacion_id, nombre_producto_snapshot,
+                         cantidad, precio_unitario_final, total_pedido, estado, notas)
+    values (r.cliente_nombre, r.cliente_contacto, r.fecha_entrega, r.hora_entrega, r.variacion_id, r.nombre_producto_snapshot,
+            r.cantidad, r.precio_unitario_final, r.total_pedido, coalesce(r.estado, 'Pendiente'), r.notas)
+    returning id into v_id;
+
+    insert into pedido_items (pedido_id, variacion_id, producto, cantidad, precio_unitario)
+    select v_id, i.variacion_id, i.producto, i.cantidad, i.precio_unitario
+      from jsonb_to_recordset(coalesce(e->'items', '[]'::jsonb))
+           as i(variacion_id bigint, producto text, cantidad numeric, precio_unitario numeric);
+    return next v_id;
+  end loop;
+end;
+$$;
+
+-- ---------------------------------------------------------------
+-- Transiciones: el consumo se calcula en la BD desde pedido_items y las recetas.
+-- Al cancelar un pedido entregado se devuelve exactamente lo que se descontó (libro de movimientos);
+-- si se entregó antes de existir el libro, lo que indica su receta.
+-- ---------------------------------------------------------------
+drop function if exists transicionar_pedido(bigint, text, jsonb, text);
+drop function if exists transicionar_pedidos(bigint[], text, jsonb, text);
+
+create or replace function transicionar_pedidos(p_ids bigint[], p_estado text, p_usuario text default null)
+returns table (pedido_id bigint, estado_anterior text, estado_nuevo text, aplicado boolean, error text)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  v_antes jsonb;
+  v_ok bigint[];
+  v_movs jsonb;
+begin
+  perform 1 from pedidos p where p.id = any(p_ids) order by p.id for update;
+
+  select coalesce(jsonb_object_agg(p.id::text, p.estado), '{}'::jsonb),
+         coalesce(array_agg(p.id) filter (where transicion_pedido_valida(p.estado, p_estado)), '{}')
+    into v_antes, v_ok
+    from pedidos p
+   where p.id = any(p_ids);
+
+  update pedidos p set estado = p_estado where p.id = any(v_ok);
+
+  -- Ventas de lo entregado y anulaciones de lo que estaba entregado
+  insert into libro_financiero (fecha, tipo, monto, descripcion, pedido_id, usuario)
+  select current_date, 'venta',
+         case when p_estado = 'Entregado' then p.total_pedido else -p.total_pedido end,
+         format(case when p_estado = 'Entregado' then 'Venta Pedido #%s - %s' else 'Anulación Venta Pedido #%s - %s' end, p.id, p.cliente_nombre),
+         p.id, p_usuario
+    from pedidos p
+   where p.id = any(v_ok)
+     and (p_estado = 'Entregado' or v_antes->>(p.id::text) = 'Entregado');
+
+  if p_estado = 'Entregado' then
+    select jsonb_agg(jsonb_build_object('insumo_id', c.insumo_id, 'delta', -c.cantidad, 'tipo', 'entrega',
+                                        'referencia_tipo', 'pedido', 'referencia_id', c.pedido_id)
+                     order by c.pedido_id, c.insumo_id)
+      into v_movs
+      from consumo_pedidos c
+     where c.pedido_id = any(v_ok) and c.cantidad <> 0;
+  elsif p_estado = 'Cancelado' then
+    select jsonb_agg(jsonb_build_object('insumo_id', m.insumo_id, 'delta', -m.cantidad, 'tipo', 'devolucion',
+                                        'referencia_tipo', 'pedido', 'referencia_id', m.referencia_id)
+                     order by m.referencia_id, m.insumo_id)
+      into v_movs
+      from (select mi.referencia_id, mi.insumo_id, sum(mi.cantidad) as cantidad
+              from movimientos_inventario mi
+             where mi.referencia_tipo = 'pedido' and mi.tipo = 'entrega'
+               and mi.referencia_id = any(v_ok)
+               and v_antes->>(mi.referencia_id::text) = 'Entregado'
+             group by mi.referencia_id, mi.insumo_id
+            union all
+            select c.pedido_id, c.insumo_id, -c.cantidad
+              from consumo_pedidos c
+             where c.pedido_id = any(v_ok)
+               and v_antes->>(c.pedido_id::text) = 'Entregado'
+               and not exists (select 1 from movimientos_inventario mi
+                                where mi.referencia_tipo = 'pedido' and mi.tipo = 'entrega' and mi.referencia_id = c.pedido_id)) m
+     where m.cantidad <> 0;
+  end if;
+  if v_movs is not null then
+    perform aplicar_movimientos_stock(v_movs, p_usuario);
+  end if;
+
+  return query
+  select x.id,
+         v_antes->>(x.id::text),
+         case when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then p_estado else v_antes->>(x.id::text) end,
+         x.id = any(v_ok),
+         case
+           when not v_antes ? (x.id::text) then format('El pedido %s no existe', x.id)
+           when x.id = any(v_ok) or v_antes->>(x.id::text) = p_estado then null
+           else format('Transición no permitida: %s -> %s', v_antes->>(x.id::text), p_estado)
+         end
+    from unnest(p_ids) as x(id);
+end;
+$$;
+
+create or replace function transicionar_pedido(p_pedido_id bigint, p_estado text, p_usuario text default null)
+returns table (estado_anterior text, estado_nuevo text, aplicado boolean)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  r record;
+begin
+  select * into r from transicionar_pedidos(array[p_pedido_id], p_estado, p_usuario);
+  if r.error is not null then
+    raise exception '%', r.error;
+  end if;
+  return query select r.estado_anterior, r.estado_nuevo, r.aplicado;
+end;
+$$;
@@ -0,0 +1,27 @@
+-- Versión del catálogo (productos, variaciones y sus recetas) para el índice que la app mantiene en memoria.
+insert into versiones_datos (clave) values ('catalogo') on conflict do nothing;
+
+create or replace function subir_version_datos()
+returns trigger
+language plpgsql
+as $$
+begin
+  update versiones_datos set version = version + 1 where clave = tg_argv[0];
+  return null;
+end;
+$$;
+
+drop trigger if exists trg_productos_version_catalogo on productos;
+create trigger trg_productos_version_catalogo
+  after insert or update or delete or truncate on productos
+  for each statement execute function subir_version_datos('catalogo');
+
+drop trigger if exists trg_variaciones_version_catalogo on variaciones;
+create trigger trg_variaciones_version_catalogo
+  after insert or update or delete or truncate on variaciones
+  for each statement execute function subir_version_datos('catalogo');
+
+drop trigger if exists trg_receta_ingredientes_version_catalogo on receta_ingredientes;
+create trigger trg_receta_ingredientes_version_catalogo
+  after insert or update or delete or truncate on receta_ingredientes
+  for each statement execute function subir_version_datos('catalogo');
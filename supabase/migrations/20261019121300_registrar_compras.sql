@@ -0,0 +1,24 @@
+-- Compras (una o una factura completa) en una sola transacción: stock, costo promedio/FIFO,
+-- libro de movimientos y libro financiero.
+-- p_compras: [{insumo_id, cantidad (unidad base), costo_total, descripcion}, ...]
+create or replace function registrar_compras(p_compras jsonb, p_usuario text default null, p_fecha date default null)
+returns table (insumo_id bigint, insumo text, stock_anterior numeric, stock_nuevo numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  insert into libro_financiero (fecha, tipo, monto, descripcion, insumo_id, usuario)
+  select coalesce(p_fecha, current_date), 'compra_insumo', c.costo_total,
+         coalesce(nullif(c.descripcion, ''), 'Compra: ' || i.nombre), i.id, p_usuario
+    from jsonb_to_recordset(p_compras) as c(insumo_id bigint, cantidad numeric, costo_total numeric, descripcion text)
+    join insumos i on i.id = c.insumo_id
+   where c.costo_total is not null;
+
+  return query
+  select * from aplicar_movimientos_stock(
+    (select jsonb_agg(jsonb_build_object('insumo_id', c.insumo_id, 'delta', c.cantidad, 'tipo', 'compra',
+                                         'referencia_tipo', 'compra', 'costo_total', c.costo_total))
+       from jsonb_to_recordset(p_compras) as c(insumo_id bigint, cantidad numeric, costo_total numeric)),
+    p_usuario);
+end;
+$$;
@@ -0,0 +1,45 @@
+-- Precio manual de un insumo ("Actualizar Precios" y "Crear Ficha").
+-- Antes se escribía insumos.costo_unitario directo y el siguiente costear_movimiento lo pisaba
+-- (en FIFO con la capa más antigua, en promedio con la próxima compra). Ahora el precio revaloriza
+-- el estado de costeo: promedio, valor y capas pendientes quedan al nuevo costo, y la diferencia
+-- de valor queda en el libro como un ajuste de cantidad 0 con referencia 'revaluacion'.
+
+create or replace function fijar_costo_insumo(p_insumo_id bigint, p_costo_unitario numeric, p_usuario text default null)
+returns table (insumo_id bigint, insumo text, costo_anterior numeric, costo_nuevo numeric)
+language plpgsql
+as $$
+#variable_conflict use_column
+declare
+  v_anterior numeric;
+  v_valor_antes numeric;
+  v_valor numeric;
+begin
+  -- Mismo bloqueo que aplicar_movimientos_stock: no se cruza con un movimiento en curso
+  select i.costo_unitario into v_anterior from insumos i where i.id = p_insumo_id for update;
+  if not found then
+    return;
+  end if;
+
+  perform costear_movimiento(p_insumo_id, 0, 'ajuste', null);  -- asegura el registro
+  select c.valor into v_valor_antes from costos_insumo c where c.insumo_id = p_insumo_id for update;
+
+  update capas_costo_insumo k set costo_unitario = p_costo_unitario where k.insumo_id = p_insumo_id;
+  update costos_insumo c
+     set costo_promedio = p_costo_unitario,
+         valor = round(c.cantidad * p_costo_unitario, 4),
+         actualizado_en = now()
+   where c.insumo_id = p_insumo_id
+  returning c.valor into v_valor;
+
+  if v_valor is distinct from v_valor_antes then
+    insert into movimientos_inventario (insumo_id, tipo, cantidad, referencia_tipo, usuario, costo)
+    values (p_insumo_id, 'ajuste', 0, 'revaluacion', p_usuario, v_valor - v_valor_antes);
+  end if;
+
+  return query
+  update insumos i
+     set costo_unitario = p_costo_unitario
+   where i.id = p_insumo_id
+  returning i.id::bigint, i.nombre::text, v_anterior, i.costo_unitario::numeric;
+end;
+$$;
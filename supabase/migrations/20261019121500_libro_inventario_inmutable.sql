@@ -0,0 +1,27 @@
+-- El libro de movimientos es append-only: borrar un insumo ya no arrastra su historial.
+-- Con 'on delete cascade' "Borrar Insumo" y "Borrar Inventario" eliminaban en silencio todos sus
+-- movimientos y snapshots. Ahora un insumo con historial no se puede borrar (se deja en stock 0)
+-- y los roles de la API solo pueden agregar filas al libro, nunca editarlas ni borrarlas.
+
+alter table movimientos_inventario drop constraint if exists movimientos_inventario_insumo_id_fkey;
+alter table movimientos_inventario
+  add constraint movimientos_inventario_insumo_id_fkey
+  foreign key (insumo_id) references insumos(id) on delete restrict;
+
+alter table snapshots_inventario drop constraint if exists snapshots_inventario_insumo_id_fkey;
+alter table snapshots_inventario
+  add constraint snapshots_inventario_insumo_id_fkey
+  foreign key (insumo_id) references insumos(id) on delete restrict;
+
+do $$
+declare
+  r text;
+begin
+  foreach r in array array['anon', 'authenticated'] loop
+    if exists (select 1 from pg_roles where rolname = r) then
+      execute format('revoke update, delete, truncate on movimientos_inventario from %I', r);
+      execute format('revoke update, delete, truncate on snapshots_inventario from %I', r);
+    end if;
+  end loop;
+end;
+$$;
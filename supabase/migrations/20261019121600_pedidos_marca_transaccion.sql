@@ -0,0 +1,40 @@
+-- Marca del tablero en orden de commit. actualizado_en se toma antes de confirmar: una transacción
+-- larga (un lote de transicionar_pedidos o crear_pedidos) puede hacerse visible con una marca más
+-- vieja que la última que ya leyó el tablero, y ningún margen fijo la cubre.
+-- Cada fila guarda el id de la transacción que la escribió; la marca de una lectura es el xmin de su
+-- snapshot: toda transacción que esa lectura no alcanzó a ver tiene un id >= xmin y entra en la siguiente.
+
+alter table pedidos add column if not exists cambio_xid xid8;
+
+create or replace function marcar_pedido_actualizado()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.actualizado_en := clock_timestamp();
+  new.cambio_xid := pg_current_xact_id();
+  return new;
+end;
+$$;
+
+create index if not exists idx_pedidos_cambio_xid on pedidos (cambio_xid);
+
+-- Sin p_desde: carga inicial con los pedidos activos. Con p_desde: todo lo escrito desde esa marca,
+-- incluidos los que pasaron a Cancelado o Entregado (el tablero los saca). Cada pedido lleva sus líneas
+-- en 'items' (variación y cantidad) para el plan de horno; se crean en la misma transacción que el pedido.
+create or replace function pedidos_cambiados(p_desde text default null)
+returns jsonb
+language sql
+stable
+as $$
+  select jsonb_build_object(
+    'marca', pg_snapshot_xmin(pg_current_snapshot())::text,
+    'pedidos', coalesce((
+      select jsonb_agg(to_jsonb(p) || jsonb_build_object('items', coalesce((
+               select jsonb_agg(jsonb_build_object('variacion_id', i.variacion_id, 'cantidad', i.cantidad) order by i.id)
+                 from pedido_items i
+                where i.pedido_id = p.id), '[]'::jsonb)) order by p.id)
+        from pedidos p
+       where case when p_desde is null then p.estado not in ('Cancelado', 'Entregado')
+                  else p.cambio_xid >= p_desde::xid8 end), '[]'::jsonb));
+$$;
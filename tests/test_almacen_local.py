@@ -0,0 +1,104 @@
+# Comportamiento de las funciones rpc de AlmacenSQLite que no depende de Postgres: se corre siempre,
+# a diferencia de test_paridad_almacenes.py que necesita ERP_TEST_DB_URL.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from almacen_local import AlmacenSQLite  # noqa: E402
+
+
+@pytest.fixture
+def almacen():
+    almacen = AlmacenSQLite(sembrar=False)
+    almacen.ids = {k: almacen.table('insumos').insert({"nombre": k, "unidad_medida": u, "stock_actual": 0, "costo_unitario": 100})
+                   .execute().data[0]['id'] for k, u in (('harina', 'kg'), ('huevos', 'unidades'))}
+    # El stock inicial entra por el libro para que el costeo y stock_a_fecha partan de él
+    almacen.rpc('aplicar_movimientos_stock', {"movimientos": [
+        {"insumo_id": almacen.ids['harina'], "delta": 10, "tipo": "compra", "costo_total": 1000},
+        {"insumo_id": almacen.ids['huevos'], "delta": 30, "tipo": "compra", "costo_total": 3000}]}).execute()
+    producto = almacen.table('productos').insert({"nombre": "Torta"}).execute().data[0]['id']
+    # 500 gr de harina y 3 huevos rinden 2 unidades
+    almacen.variacion = almacen.rpc('guardar_receta', {
+        "p_variacion_id": None, "p_datos": {"producto_id": producto, "nombre": "Chica", "precio": 5000, "rendimiento": 2},
+        "p_ingredientes": [{"nombre": "harina", "insumo_id": almacen.ids['harina'], "cantidad": 500, "unidad": "gr"},
+                           {"nombre": "huevos", "cantidad": 3, "unidad": "unidades"}]}).execute().data
+    return almacen
+
+
+def _stock(almacen):
+    return {f['nombre']: f['stock_actual'] for f in almacen.table('insumos').select('nombre, stock_actual').execute().data}
+
+
+def _pedido(almacen, cantidad=2):
+    return almacen.rpc('crear_pedidos', {"p_pedidos": [{
+        "cliente_nombre": "Ana", "fecha_entrega": "2026-10-20", "hora_entrega": "12:00", "variacion_id": almacen.variacion,
+        "nombre_producto_snapshot": "Torta - Chica", "cantidad": cantidad, "precio_unitario_final": 5000, "total_pedido": 5000 * cantidad,
+        "items": [{"variacion_id": almacen.variacion, "producto": "Torta - Chica", "cantidad": cantidad, "precio_unitario": 5000}]}]}).execute().data[0]
+
+
+def test_guardar_receta_reemplaza_ingredientes(almacen):
+    receta = almacen._filas("SELECT insumo_id, cantidad FROM receta_ingredientes WHERE variacion_id = ? ORDER BY posicion", (almacen.variacion,))
+    assert receta == [{"insumo_id": almacen.ids['harina'], "cantidad": 500}, {"insumo_id": almacen.ids['huevos'], "cantidad": 3}]  # huevos por nombre
+
+    almacen.rpc('guardar_receta', {"p_variacion_id": almacen.variacion, "p_datos": {"precio": 6000},
+                                   "p_ingredientes": [{"nombre": "huevos", "insumo_id": almacen.ids['huevos'], "cantidad": 4}]}).execute()
+    receta = almacen._filas("SELECT insumo_id, cantidad FROM receta_ingredientes WHERE variacion_id = ?", (almacen.variacion,))
+    assert receta == [{"insumo_id": almacen.ids['huevos'], "cantidad": 4}]
+
+    with pytest.raises(ValueError):
+        almacen.rpc('guardar_receta', {"p_variacion_id": 999, "p_datos": {"precio": 1}, "p_ingredientes": []}).execute()
+
+
+def test_entrega_descuenta_la_receta_y_la_anulacion_la_devuelve(almacen):
+    pedido = _pedido(almacen)
+    assert almacen._filas("SELECT variacion_id, cantidad FROM pedido_items WHERE pedido_id = ?", (pedido,)) == \
+        [{"variacion_id": almacen.variacion, "cantidad": 2}]
+
+    reporte = almacen.rpc('transicionar_pedidos', {"p_ids": [pedido], "p_estado": "Listo"}).execute().data
+    assert reporte == [{"pedido_id": pedido, "estado_anterior": "Pendiente", "estado_nuevo": "Pendiente", "aplicado": False,
+                        "error": "Transición no permitida: Pendiente -> Listo"}]
+
+    for estado in ("En Horno", "Listo", "Entregado"):
+        almacen.rpc('transicionar_pedidos', {"p_ids": [pedido], "p_estado": estado}).execute()
+    assert _stock(almacen) == {"harina": 9.5, "huevos": 27}
+    assert almacen._filas("SELECT tipo, monto FROM libro_financiero WHERE pedido_id = ?", (pedido,)) == [{"tipo": "venta", "monto": 10000}]
+
+    # Se devuelve lo que se descontó aunque la receta haya cambiado después de la entrega
+    almacen.rpc('guardar_receta', {"p_variacion_id": almacen.variacion, "p_datos": {},
+                                   "p_ingredientes": [{"nombre": "harina", "insumo_id": almacen.ids['harina'], "cantidad": 2, "unidad": "kg"}]}).execute()
+    almacen.rpc('transicionar_pedidos', {"p_ids": [pedido], "p_estado": "Cancelado"}).execute()
+    assert _stock(almacen) == {"harina": 10, "huevos": 30}
+    assert sum(f['monto'] for f in almacen._filas("SELECT monto FROM libro_financiero WHERE pedido_id = ?", (pedido,))) == 0
+
+
+def test_registrar_compras_suma_stock_y_anota_el_gasto(almacen):
+    almacen.rpc('registrar_compras', {"p_compras": [{"insumo_id": almacen.ids['harina'], "cantidad": 10, "costo_total": 3000}],
+                                      "p_fecha": "2026-10-19"}).execute()
+    assert _stock(almacen)['harina'] == 20
+    costo = almacen._filas("SELECT costo_promedio FROM costos_insumo WHERE insumo_id = ?", (almacen.ids['harina'],))[0]['costo_promedio']
+    assert costo == pytest.approx(200)  # 10 a 100 y 10 a 300
+    assert almacen._filas("SELECT fecha, tipo, monto FROM libro_financiero") == [{"fecha": "2026-10-19", "tipo": "compra_insumo", "monto": 3000}]
+
+
+def test_stock_a_fecha_parte_del_ultimo_snapshot(almacen):
+    almacen.rpc('aplicar_movimientos_stock', {"movimientos": [{"insumo_id": almacen.ids['harina'], "delta": -4, "tipo": "ajuste"}]}).execute()
+    almacen.rpc('generar_snapshot_inventario').execute()
+    almacen.rpc('aplicar_movimientos_stock', {"movimientos": [{"insumo_id": almacen.ids['harina'], "delta": 1, "tipo": "devolucion"}]}).execute()
+    stock = {f['insumo']: f['stock'] for f in almacen.rpc('stock_a_fecha', {"p_fecha": "2999-01-01T00:00:00+00:00"}).execute().data}
+    assert stock == {"harina": 7, "huevos": 30}
+    assert stock == _stock(almacen)
+
+
+def test_pedidos_cambiados_desde_la_marca(almacen):
+    primero = _pedido(almacen)
+    carga = almacen.rpc('pedidos_cambiados').execute().data
+    assert [p['id'] for p in carga['pedidos']] == [primero]
+    assert carga['pedidos'][0]['items'] == [{"variacion_id": almacen.variacion, "cantidad": 2}]
+
+    segundo = _pedido(almacen, cantidad=1)
+    almacen.rpc('transicionar_pedidos', {"p_ids": [primero], "p_estado": "Cancelado"}).execute()
+    cambios = almacen.rpc('pedidos_cambiados', {"p_desde": carga['marca']}).execute().data
+    assert {p['id']: p['estado'] for p in cambios['pedidos']} == {primero: "Cancelado", segundo: "Pendiente"}
+    assert almacen.rpc('pedidos_cambiados', {"p_desde": cambios['marca']}).execute().data['pedidos'] == []
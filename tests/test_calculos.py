@@ -0,0 +1,166 @@
+# Cálculos de calculos.py que usa erp.py: conversión de unidades, plan de horno e importaciones.
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from calculos import (TIEMPOS_DEFECTO, convertir, convertir_factura, costear_ingredientes, emparejar_insumos,  # noqa: E402
+                      opciones_unidad, preparar_factura, preparar_importacion, programar_horno)
+
+
+def test_convertir_escalares():
+    assert convertir(1500, 'gr', 'kg') == 1.5
+    assert convertir(2, 'cda', 'ml') == 30
+    assert convertir(1, 'cdta', 'gr') == 5  # las cucharas valen lo mismo en gr que en ml
+    assert convertir(3, 'caja', 'caja') == 3  # misma unidad aunque no esté en la tabla
+    assert convertir(1, 'kg', 'lt') is None
+    assert convertir(1, 'unidades', 'gr') is None
+    assert convertir(1, 'caja', 'kg') is None
+
+
+def test_convertir_arrays_marca_nan_en_pares_incompatibles():
+    res = convertir([500, 2, 1, 4], ['gr', 'lt', 'kg', 'cdta'], ['kg', 'ml', 'unidades', 'gr'])
+    assert res[[0, 1, 3]] == pytest.approx([0.5, 2000, 20])
+    assert np.isnan(res[2])
+
+
+def test_opciones_unidad():
+    assert opciones_unidad('kg') == ['kg', 'gr']
+    assert opciones_unidad('kg', receta=True) == ['gr', 'kg', 'cdta', 'cda']
+    assert opciones_unidad('unidades', receta=True) == ['unidades']
+    assert opciones_unidad('caja') == ['caja']
+
+
+def test_costear_ingredientes_mantiene_el_costo_guardado_sin_conversion():
+    mapa = {'Harina': {'unidad_medida': 'kg', 'costo_unitario': 1200}, 'Huevos': {'unidad_medida': 'unidades', 'costo_unitario': 180}}
+    costos = costear_ingredientes([{'nombre': 'Harina', 'cantidad': 500, 'unidad': 'gr'},
+                                   {'nombre': 'Huevos', 'cantidad': 100, 'unidad': 'gr', 'costo': 50},   # unidad incompatible
+                                   {'nombre': 'Borrado', 'cantidad': 1, 'unidad': 'kg', 'costo': 70}],  # ya no existe
+                                  mapa)
+    assert costos == pytest.approx([600, 50, 70])
+
+
+AHORA = datetime(2026, 10, 20, 8, 0)
+TIEMPOS = {1: (0, 60)}  # sin preparación, una hora de horno por unidad
+
+
+def _pedido(id, hora, cantidad, estado='Pendiente', fecha='2026-10-20', variacion_id=1):
+    return {"id": id, "estado": estado, "fecha_entrega": fecha, "hora_entrega": hora,
+            "items": [{"variacion_id": variacion_id, "cantidad": cantidad}]}
+
+
+def test_programar_horno_reparte_las_unidades_entre_las_bandejas():
+    pedidos = [_pedido(1, '10:00:00', 2), _pedido(2, '09:30:00', 1)]
+    plan = programar_horno(pedidos, TIEMPOS, 1, AHORA).set_index('id')
+    # Una bandeja: primero el de hora más cercana, luego las dos unidades del otro
+    assert plan.loc[2, 'fin'] == datetime(2026, 10, 20, 9, 0)
+    assert plan.loc[1, 'fin'] == datetime(2026, 10, 20, 11, 0)
+    assert not plan.loc[1, 'a_tiempo'] and plan.loc[1, 'holgura_min'] == -60
+
+    plan = programar_horno(pedidos, TIEMPOS, 2, AHORA).set_index('id')
+    assert plan.loc[1, 'fin'] == datetime(2026, 10, 20, 10, 0)
+    assert plan['a_tiempo'].all()
+
+
+def test_programar_horno_prioriza_lo_que_ya_esta_en_el_horno():
+    pedidos = [_pedido(1, '09:00:00', 1), _pedido(2, '18:00:00', 1, estado='En Horno'), _pedido(3, '09:00:00', 1, estado='Listo')]
+    plan = programar_horno(pedidos, TIEMPOS, 1, AHORA).set_index('id')
+    assert list(plan.index) == [2, 1]
+    assert plan.loc[1, 'inicio'] == datetime(2026, 10, 20, 9, 0)
+
+
+def test_programar_horno_respeta_la_jornada_y_los_tiempos_por_defecto():
+    # Para mañana, variación sin tiempos y pedido antiguo sin ítems: desde la apertura, con los tiempos por defecto
+    antiguo = {"id": 1, "estado": "Pendiente", "fecha_entrega": "2026-10-21", "hora_entrega": None, "variacion_id": 9, "cantidad": 2}
+    plan = programar_horno([antiguo], TIEMPOS, 1, AHORA).iloc[0]
+    prep, horno = TIEMPOS_DEFECTO
+    assert plan['inicio'] == datetime(2026, 10, 21, 7, prep)
+    assert (plan['fin'] - plan['inicio']).total_seconds() == 2 * horno * 60
+    assert plan['limite'] == datetime(2026, 10, 21, 23, 59)
+    assert programar_horno([_pedido(1, '09:00:00', 1, estado='Entregado')], TIEMPOS, 1, AHORA).empty
+
+
+INDICE = {"productos_por_id": {1: {"nombre": "Torta"}},
+          "variaciones": {10: {"id": 10, "producto_id": 1, "nombre": "Chica", "precio": 5000},
+                          11: {"id": 11, "producto_id": 1, "nombre": "Grande", "precio": 9000}}}
+
+
+def test_preparar_importacion_informa_cada_fila_con_error():
+    df = pd.DataFrame([
+        {"Cliente": "", "Fecha Entrega": "20/10/2026", "Producto": "Torta - Chica", "Cantidad": 1},
+        {"Cliente": "Ana", "Fecha Entrega": "no", "Producto": "Torta - Chica", "Cantidad": 1},
+        {"Cliente": None, "Fecha Entrega": None, "Producto": None, "Cantidad": None},  # vacía: se salta
+        {"Cliente": "Ana", "Fecha Entrega": "20/10/2026", "Hora": "25:99", "Producto": "Torta - Chica", "Cantidad": 1},
+        {"Cliente": "Ana", "Fecha Entrega": "20/10/2026", "Producto": "Pie", "Cantidad": 1},
+        {"Cliente": "Ana", "Fecha Entrega": "20/10/2026", "Producto": "Torta - Chica", "Cantidad": 1.5},
+        {"Cliente": "Ana", "Fecha Entrega": "20/10/2026", "Producto": "Torta - Chica", "Cantidad": 1, "Precio": -1},
+        {"Cliente": "Ana", "Fecha Entrega": "20/10/2026", "Producto": "Torta - Chica", "Cantidad": 1},
+    ])
+    pedidos, lineas, errores = preparar_importacion(df, INDICE)
+    assert pedidos == [] and lineas.empty  # con un error no se importa nada
+    assert errores.set_index('fila')['error'].to_dict() == {
+        2: "Falta el cliente", 3: "Fecha inválida", 5: "Hora inválida", 6: "El producto no está en el catálogo",
+        7: "Cantidad inválida", 8: "Precio inválido"}
+
+    with pytest.raises(ValueError, match="CANTIDAD"):
+        preparar_importacion(df.drop(columns=["Cantidad"]), INDICE)
+
+
+def test_preparar_importacion_agrupa_lineas_en_pedidos():
+    df = pd.DataFrame([
+        {"PEDIDO": None, "CLIENTE": "Ana", "FECHA_ENTREGA": "20/10/2026", "HORA": "12:00", "PRODUCTO": "torta - chica", "CANTIDAD": 2, "NOTAS": "sin nueces"},
+        {"PEDIDO": None, "CLIENTE": "Ana", "FECHA_ENTREGA": "20/10/2026", "HORA": "12:00", "PRODUCTO": "Torta - Grande", "CANTIDAD": 1, "PRECIO": 8000},
+        {"PEDIDO": "B1", "CLIENTE": "Beto", "FECHA_ENTREGA": "21/10/2026", "HORA": None, "PRODUCTO": "Torta - Chica", "CANTIDAD": 3, "NOTAS": "retira"},
+    ])
+    pedidos, lineas, errores = preparar_importacion(df, INDICE)
+    assert errores.empty
+    ana, beto = pedidos
+    assert [(l['variacion_id'], l['cantidad'], l['precio_unitario']) for l in ana['items']] == [(10, 2, 5000), (11, 1, 8000)]
+    assert ana['variacion_id'] is None and ana['cantidad'] is None  # varias líneas: el detalle va en 'items'
+    assert (ana['fecha_entrega'], ana['hora_entrega'], ana['total_pedido'], ana['notas']) == ("2026-10-20", "12:00:00", 18000, "sin nueces")
+    assert (beto['variacion_id'], beto['cantidad'], beto['total_pedido'], beto['hora_entrega']) == (10, 3, 15000, None)
+    assert lineas['variacion_id'].tolist() == [10, 11, 10]
+
+
+INSUMOS = [{"id": 1, "nombre": "Azúcar", "unidad_medida": "kg"}, {"id": 2, "nombre": "Harina", "unidad_medida": "kg"},
+           {"id": 3, "nombre": "Leche", "unidad_medida": "lt"}, {"id": 4, "nombre": "Huevos", "unidad_medida": "unidades"}]
+
+
+def test_emparejar_insumos_sin_tildes_ni_mayusculas():
+    res = emparejar_insumos(["AZUCAR", "  azúcar ", "HARINA SELECTA 1KG", "Lehce", "Detergente"], [i['nombre'] for i in INSUMOS])
+    assert res["AZUCAR"] == ("Azúcar", 1.0) and res["  azúcar "] == ("Azúcar", 1.0)
+    assert res["HARINA SELECTA 1KG"][0] == "Harina"  # todas las palabras del insumo están en el texto
+    assert res["Lehce"][0] == "Leche"
+    assert res["Detergente"][0] is None
+
+
+def test_preparar_factura_lee_columnas_y_montos_locales():
+    df = pd.DataFrame({"Descripción": ["AZUCAR 1KG", "Leche entera", "Huevos"], "Cant": ["2,5", "12", "30"],
+                       "UM": ["kilos", "L", None], "Monto": ["$ 3.290", "14.400", "5400"]})
+    fac = preparar_factura(df, INSUMOS)
+    assert fac['insumo'].tolist() == ["Azúcar", "Leche", "Huevos"]
+    assert fac['cantidad'].tolist() == [2.5, 12, 30]
+    assert fac['unidad'].tolist() == ["kg", "lt", None]
+    assert fac['total'].tolist() == [3290, 14400, 5400]
+
+    with pytest.raises(ValueError, match="TOTAL"):
+        preparar_factura(df.drop(columns=["Monto"]), INSUMOS)
+
+
+def test_convertir_factura_pasa_a_la_unidad_base_y_marca_errores():
+    lineas = pd.DataFrame([
+        {"insumo": "Azúcar", "cantidad": 500, "unidad": "gr", "total": 600},
+        {"insumo": "Huevos", "cantidad": 30, "unidad": None, "total": 5400},     # sin unidad: la del insumo
+        {"insumo": "Harina", "cantidad": 2, "unidad": "lt", "total": 2000},      # volumen para un insumo en kg
+        {"insumo": None, "cantidad": 1, "unidad": "kg", "total": 100},
+        {"insumo": "Leche", "cantidad": 0, "unidad": "lt", "total": 100},
+        {"insumo": "Leche", "cantidad": 1, "unidad": "lt", "total": -5},
+    ])
+    fac = convertir_factura(lineas, {i['nombre']: i for i in INSUMOS})
+    assert fac['cantidad_base'][:2].tolist() == [0.5, 30]
+    assert fac['costo_unitario'][:2].tolist() == [1200, 180]
+    assert fac['error'].tolist() == ["", "", "Unidad no compatible", "Elige el insumo", "Cantidad inválida", "Total inválido"]
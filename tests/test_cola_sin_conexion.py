@@ -0,0 +1,238 @@
+# Cola de escrituras sin conexión (almacen_supabase.ClienteResiliente) contra el cliente real de Supabase.
+# El servidor es un sustituto local de PostgREST sobre AlmacenSQLite: se apaga para simular la caída
+# y se puede demorar la respuesta para simular un timeout después de aplicar la escritura.
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+supabase = pytest.importorskip("supabase")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from almacen_local import AlmacenSQLite  # noqa: E402
+from almacen_supabase import COPIAS_POR_TABLA, ERRORES_CONEXION, SIN_RESPUESTA, ClienteResiliente, en_cola  # noqa: E402
+
+PARAMETROS_NO_FILTRO = {'select', 'order', 'limit', 'on_conflict', 'columns'}
+
+
+class SustitutoPostgrest:
+    """Subconjunto de PostgREST que usa el ERP (filtros, orden, límite, insert/upsert/update/delete y rpc)."""
+
+    def __init__(self, almacen):
+        self.almacen = almacen
+        self.peticiones = []
+        self.demora = 0  # segundos de espera antes de responder una escritura ya aplicada
+        self.puerto = 0
+        self._servidor = None
+
+    def levantar(self):
+        sustituto = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+            def do_GET(self): sustituto._atender(self, 'GET')
+            def do_POST(self): sustituto._atender(self, 'POST')
+            def do_PATCH(self): sustituto._atender(self, 'PATCH')
+            def do_DELETE(self): sustituto._atender(self, 'DELETE')
+
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', self.puerto), Manejador)
+        self._servidor.daemon_threads = True
+        self.puerto = self._servidor.server_address[1]
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def apagar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def _atender(self, manejador, metodo):
+        url = urlparse(manejador.path)
+        ruta = url.path.replace('/rest/v1/', '')
+        largo = int(manejador.headers.get('Content-Length') or 0)
+        cuerpo = json.loads(manejador.rfile.read(largo)) if largo else None
+        self.peticiones.append((metodo, ruta, cuerpo))
+        try:
+            if ruta.startswith('rpc/'):
+                datos = self.almacen.rpc(ruta[4:], cuerpo or {}).execute().data
+            else:
+                datos = self._consulta(ruta, metodo, parse_qsl(url.query), cuerpo, manejador.headers.get('Prefer') or '').execute().data
+            codigo = 201 if metodo == 'POST' and not ruta.startswith('rpc/') else 200
+        except Exception as e:
+            codigo, datos = 400, {"message": str(e), "code": "PGRST000", "hint": None, "details": None}
+        if metodo != 'GET' and codigo < 400 and self.demora: time.sleep(self.demora)
+        salida = json.dumps(datos).encode()
+        try:
+            manejador.send_response(codigo)
+            manejador.send_header('Content-Type', 'application/json')
+            manejador.send_header('Content-Length', str(len(salida)))
+            manejador.end_headers()
+            manejador.wfile.write(salida)
+        except OSError:
+            pass  # el cliente ya se fue por timeout
+
+    def _consulta(self, tabla, metodo, parametros, cuerpo, prefer):
+        q = self.almacen.table(tabla)
+        opciones = dict(parametros)
+        if metodo == 'GET': q = q.select(opciones.get('select', '*'))
+        elif metodo == 'POST' and 'merge-duplicates' in prefer: q = q.upsert(cuerpo, on_conflict=opciones.get('on_conflict', 'id'))
+        elif metodo == 'POST': q = q.insert(cuerpo)
+        elif metodo == 'PATCH': q = q.update(cuerpo)
+        else: q = q.delete()
+        for columna, valor in parametros:
+            if columna in PARAMETROS_NO_FILTRO: continue
+            operador, _, valor = valor.partition('.')
+            if operador == 'in': q = q.in_(columna, [v.strip('"') for v in valor.strip('()').split(',')])
+            elif operador == 'is': q = q.is_(columna, valor)
+            else: q = getattr(q, operador)(columna, valor)
+        for orden in filter(None, opciones.get('order', '').split(',')):
+            q = q.order(orden.split('.')[0], desc='.desc' in orden)
+        if 'limit' in opciones: q = q.limit(opciones['limit'])
+        return q
+
+
+@pytest.fixture
+def entorno(tmp_path):
+    almacen = AlmacenSQLite()
+    servidor = SustitutoPostgrest(almacen)
+    servidor.levantar()
+    opciones = supabase.ClientOptions(postgrest_client_timeout=httpx.Timeout(1, connect=1))
+    cliente = ClienteResiliente(
+        lambda: supabase.create_client(f"http://127.0.0.1:{servidor.puerto}", "clave-prueba", options=opciones),
+        str(tmp_path / "diario.sqlite"), espera_reintento=0,
+    )
+    yield almacen, servidor, cliente
+    try: servidor.apagar()
+    except Exception: pass
+
+
+def test_sin_conexion_lee_la_copia_y_envia_la_cola_al_volver(entorno):
+    almacen, servidor, cliente = entorno
+    insumos = cliente.table('insumos').select('*').order('nombre').execute().data
+    servidor.apagar()
+
+    copia = cliente.table('insumos').select('*').order('nombre').execute()
+    assert copia.origen == 'copia' and copia.data == insumos
+    assert en_cola(cliente.table('insumos').update({'costo_unitario': 1300}).eq('id', 1).execute())
+    for nombre in ('Offline 1', 'Offline 2'):
+        cliente.table('productos').insert({'nombre': nombre}).execute()
+    # Otras columnas: no puede viajar en el mismo lote o 'categoria' de las demás quedaría en null
+    cliente.table('productos').insert({'nombre': 'Offline 3', 'categoria': 'Tortas'}).execute()
+    assert cliente.pendientes() == 4
+
+    servidor.levantar()
+    servidor.peticiones.clear()
+    assert cliente.sincronizar(reintentar=True) == 4
+    assert cliente.pendientes() == 0 and cliente.problemas() == []
+    inserts = [c for m, r, c in servidor.peticiones if m == 'POST' and r == 'productos']
+    assert len(inserts) == 2 and len(inserts[0]) == 2
+    assert almacen.table('insumos').select('costo_unitario').eq('id', 1).execute().data == [{'costo_unitario': 1300}]
+    assert len(almacen.table('productos').select('id').in_('nombre', ['Offline 1', 'Offline 2', 'Offline 3']).execute().data) == 3
+
+
+def test_edicion_en_cola_sobre_fila_cambiada_queda_en_conflicto(entorno):
+    almacen, servidor, cliente = entorno
+    cliente.table('insumos').select('*').execute()
+    servidor.apagar()
+    cliente.table('insumos').update({'costo_unitario': 999}).eq('id', 2).execute()
+    almacen.table('insumos').update({'costo_unitario': 1150}).eq('id', 2).execute()  # otro dispositivo
+
+    servidor.levantar()
+    assert cliente.sincronizar(reintentar=True) == 1
+    [problema] = cliente.problemas()
+    assert problema['estado'] == 'conflicto' and 'costo_unitario' in problema['detalle']
+    assert almacen.table('insumos').select('costo_unitario').eq('id', 2).execute().data == [{'costo_unitario': 1150}]
+
+
+def test_escritura_sin_respuesta_no_se_reenvia(entorno):
+    almacen, servidor, cliente = entorno
+    servidor.apagar()
+    cliente.table('productos').insert({'nombre': 'Timeout'}).execute()
+
+    servidor.levantar()
+    servidor.demora = 1.5  # el servidor la aplica pero responde después del timeout del cliente
+    assert cliente.sincronizar(reintentar=True) == 0
+    servidor.demora = 0
+    cliente.sincronizar(reintentar=True)
+    [problema] = cliente.problemas()
+    assert problema['estado'] == 'error' and problema['detalle'] == SIN_RESPUESTA
+    assert cliente.pendientes() == 0
+    assert len(almacen.table('productos').select('id').eq('nombre', 'Timeout').execute().data) == 1
+
+
+def test_tablero_sin_conexion_usa_la_carga_completa(entorno):
+    almacen, servidor, cliente = entorno
+    completa = cliente.rpc('pedidos_cambiados', {'p_desde': None}).execute().data
+    almacen.table('pedidos').update({'estado': 'Listo'}).eq('id', completa['pedidos'][0]['id']).execute()
+    cambios = cliente.rpc('pedidos_cambiados', {'p_desde': completa['marca']}).execute().data
+    assert [p['estado'] for p in cambios['pedidos']] == ['Listo']
+    servidor.apagar()
+
+    copia = cliente.rpc('pedidos_cambiados', {'p_desde': None}).execute()
+    assert copia.origen == 'copia' and copia.data == completa
+    # Las lecturas incrementales no dejan copia: sin conexión el tablero se queda con lo que ya tiene
+    with pytest.raises(ERRORES_CONEXION):
+        cliente.rpc('pedidos_cambiados', {'p_desde': cambios['marca']}).execute()
+
+
+def test_credenciales_no_quedan_en_disco(entorno, tmp_path):
+    _, servidor, cliente = entorno
+    assert cliente.table('usuarios').select('*').eq('username', 'admin').eq('password', 'admin').execute().data
+    servidor.apagar()
+
+    # Sin copia: el login sin conexión falla en vez de aceptar una contraseña vieja
+    with pytest.raises(ERRORES_CONEXION):
+        cliente.table('usuarios').select('*').eq('username', 'admin').eq('password', 'admin').execute()
+    with pytest.raises(ERRORES_CONEXION):
+        cliente.table('usuarios').update({'password': 'nueva'}).eq('username', 'admin').execute()
+    assert cliente.pendientes() == 0
+    assert not any(b'admin' in f.read_bytes() for f in tmp_path.glob("diario.sqlite*"))
+    if os.name == 'posix':
+        assert (tmp_path / "diario.sqlite").stat().st_mode & 0o077 == 0
+
+
+def test_copias_acotadas_y_cuenta_de_pendientes(entorno, tmp_path):
+    _, servidor, cliente = entorno
+    cliente.table('gastos').select('*').execute()
+    for i in range(COPIAS_POR_TABLA + 5):
+        cliente.table('productos').select('*').eq('id', i).execute()
+    cliente._podar()
+    with sqlite3.connect(tmp_path / "diario.sqlite") as conn:
+        assert dict(conn.execute("SELECT tabla, COUNT(*) FROM copias GROUP BY tabla").fetchall()) == {'productos': COPIAS_POR_TABLA}
+
+    servidor.apagar()
+    cliente.table('productos').update({'nombre': 'Sin red'}).eq('id', 1).execute()
+    cliente.table('productos').delete().eq('id', 2).execute()
+    assert cliente.pendientes() == 2
+    with sqlite3.connect(tmp_path / "diario.sqlite") as conn:
+        primera = conn.execute("SELECT MIN(id) FROM diario").fetchone()[0]
+    cliente.descartar(primera)
+    assert cliente.pendientes() == 1
+
+
+def test_rpc_de_valor_absoluto_en_cola_detecta_conflictos(entorno):
+    almacen, servidor, cliente = entorno
+    cliente.table('insumos').select('*').order('nombre').execute()
+    [pedido] = cliente.rpc('pedidos_cambiados', {'p_desde': None}).execute().data['pedidos'][:1]
+    servidor.apagar()
+    # Dos ajustes seguidos del mismo insumo: el segundo se compara contra lo que dejó el primero
+    for stock in (7, 9):
+        assert en_cola(cliente.rpc('fijar_stock_insumo', {'p_insumo_id': 1, 'p_stock': stock, 'p_usuario': 'test'}).execute())
+    cliente.rpc('fijar_costo_insumo', {'p_insumo_id': 2, 'p_costo_unitario': 999, 'p_usuario': 'test'}).execute()
+    cliente.rpc('transicionar_pedidos', {'p_ids': [pedido['id']], 'p_estado': 'En Horno', 'p_usuario': 'test'}).execute()
+    # Otro dispositivo, mientras tanto
+    almacen.rpc('fijar_costo_insumo', {'p_insumo_id': 2, 'p_costo_unitario': 1150, 'p_usuario': 'otro'}).execute()
+    almacen.rpc('transicionar_pedidos', {'p_ids': [pedido['id']], 'p_estado': 'Cancelado', 'p_usuario': 'otro'}).execute()
+
+    servidor.levantar()
+    cliente.sincronizar(reintentar=True)
+    assert cliente.pendientes() == 0
+    assert sorted(p['tabla'] for p in cliente.problemas()) == ['fijar_costo_insumo', 'transicionar_pedidos']
+    assert all(p['estado'] == 'conflicto' for p in cliente.problemas())
+    assert almacen.table('insumos').select('stock_actual').eq('id', 1).execute().data == [{'stock_actual': 9}]
+    assert almacen.table('insumos').select('costo_unitario').eq('id', 2).execute().data == [{'costo_unitario': 1150}]